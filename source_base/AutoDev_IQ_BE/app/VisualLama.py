@@ -1,19 +1,39 @@
 import argparse
 import json
 import os
+import re
 import sys
+import asyncio
+import hashlib
+import threading
 import requests
 import traceback
+from collections import OrderedDict
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
+from starlette.concurrency import run_in_threadpool
+
 from config import config
+from app.llm_scheduler import PRIORITY_BATCH, get_llm_scheduler
 
 OLLAMA_ENDPOINT = f"{config.OLLAMA_BASE_URL.rstrip('/')}/api/generate"
-MODEL = config.MODEL_NAME
+MODEL = config.GENERATION_MODEL_NAME
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DOM_DIFFS_DIR = os.path.join(BASE_DIR, "dom_diffs")
 
+BASE_INSTRUCTION = (
+  "You are an expert Visual Regression Testing (VRT) analysis bot. "
+  "Based on the following change, provide a concise, one-line code snippet or action "
+  "to revert the change to its original state. Output ONLY the fix, with no explanation."
+)
+GROUP_SELECTORS_SHOWN = 5
+NTH_OF_TYPE = re.compile(r":nth-of-type\(\d+\)")
+
+# description of a change group -> fix, shared across runs (identical diffs are not re-asked)
+_fix_cache = OrderedDict()
+_fix_cache_lock = threading.Lock()
+
 
 def log(message: str, level="INFO"):
   print(f"[{level}] {message}", file=sys.stderr)
@@ -36,7 +56,7 @@ def format_change_for_display(change: dict) -> str:
       base_val = f"\"{changes['text_content']['base_value']}\""
       test_val = f"\"{changes['text_content']['test_value']}\""
       details_list.append(f"- Text content changed from {base_val} to {test_val}.")
-  elif change['type'] == 'css_rule_modified':
+  elif change['type'] in ('css_rule_modified', 'computed_style_modified'):
     prop_changes = change.get('property_changes', {})
     for prop, vals in prop_changes.items():
       base_val = vals.get('base_value', 'N/A')
@@ -44,6 +64,8 @@ def format_change_for_display(change: dict) -> str:
       details_list.append(f"- CSS property '{prop}' changed from '{base_val}' to '{test_val}'.")
   elif change['type'] in ('dom_addition', 'dom_deletion'):
     details_list.append(f"- Element HTML: {change.get('details', 'N/A')}")
+  elif change['type'] == 'dom_move':
+    details_list.append(f"- Moved from {change.get('from_selector', 'N/A')}: {change.get('details', 'N/A')}")
   elif change['type'] in ('css_rule_added', 'css_rule_deleted'):
     properties = json.dumps(change.get('properties', {}))
     details_list.append(f"- Rule properties: {properties}")
@@ -86,14 +108,9 @@ def load_diff_file(label: str) -> list:
     return json.load(f)
 
 
-def build_prompt(change: dict) -> str:
+def describe_change(change: dict) -> str:
   selector = change.get("selector", "N/A")
   change_type = change.get("type", "unknown")
-  base_instruction = (
-    "You are an expert Visual Regression Testing (VRT) analysis bot. "
-    "Based on the following change, provide a concise, one-line code snippet or action "
-    "to revert the change to its original state. Output ONLY the fix, with no explanation."
-  )
   prompt_details = ""
   if change_type == "dom_modification":
     changes = change.get("changes", {})
@@ -107,29 +124,58 @@ def build_prompt(change: dict) -> str:
   elif change_type in ("dom_addition", "dom_deletion"):
     action = "added" if change_type == "dom_addition" else "deleted"
     prompt_details = f"A DOM element was {action} at selector `{selector}`.\n- The element's HTML is: `{change.get('details', '')}`."
-  elif change_type == "css_rule_modified":
+  elif change_type == "dom_move":
+    prompt_details = (f"A DOM element moved from `{change.get('from_selector', '')}` to `{selector}` without changing.\n"
+                      f"- The element is: `{change.get('details', '')}`.")
+  elif change_type in ("css_rule_modified", "computed_style_modified"):
     prop_changes = change.get("property_changes", {})
     changes_str = ", ".join(
         f"'{prop}' changed from '{vals.get('base_value', 'N/A')}' to '{vals.get('test_value', 'N/A')}'"
         for prop, vals in prop_changes.items()
     )
-    prompt_details = f"A CSS rule was modified for selector `{selector}`.\n- Changes: {changes_str}."
+    subject = "The computed style changed" if change_type == "computed_style_modified" else "A CSS rule was modified"
+    prompt_details = f"{subject} for selector `{selector}`.\n- Changes: {changes_str}."
   elif change_type in ("css_rule_added", "css_rule_deleted"):
     action = "added" if change_type == "css_rule_added" else "deleted"
     prompt_details = f"A CSS rule was {action} for selector `{selector}`.\n- The rule's properties are: {json.dumps(change.get('properties', {}))}."
   else:
     prompt_details = f"An unknown change was detected: {json.dumps(change)}"
-  return f"{base_instruction}\n\nCHANGE DETAILS:\n{prompt_details}"
+  return prompt_details
+
+
+def build_single_prompt(description: str) -> str:
+  return f"{BASE_INSTRUCTION}\n\nCHANGE DETAILS:\n{description}"
+
+
+def build_prompt(change: dict) -> str:
+  return build_single_prompt(describe_change(change))
+
+
+def build_batch_prompt(descriptions: list) -> str:
+  numbered = "\n\n".join(f"CHANGE {i + 1}:\n{description}" for i, description in enumerate(descriptions))
+  return (
+    "You are an expert Visual Regression Testing (VRT) analysis bot. "
+    "For each numbered change below, provide a concise, one-line code snippet or action "
+    "to revert the change to its original state.\n"
+    'Respond with JSON only, in the form {"fixes": [{"id": <change number>, "fix": "<one-line fix>"}]}, '
+    "with exactly one entry per change.\n\n"
+    f"{numbered}"
+  )
 
 
-def query_llama(prompt: str) -> str:
+def query_llama(prompt: str, json_format: bool = False, timeout: int = 60) -> str:
   log(" Querying Llama 3 for a direct fix...")
+  payload = {
+    "model": MODEL,
+    "prompt": prompt,
+    "stream": False,
+    "keep_alive": config.OLLAMA_KEEP_ALIVE,
+    "options": {"temperature": 0.0}
+  }
+  if json_format:
+    payload["format"] = "json"
   try:
-    response = requests.post(
-        OLLAMA_ENDPOINT,
-        json={"model": MODEL, "prompt": prompt, "stream": False, "options": {"temperature": 0.0}},
-        timeout=60
-    )
+    response = requests.post(OLLAMA_ENDPOINT, json=payload, timeout=timeout)
     response.raise_for_status()
     return response.json()["response"].strip()
   except requests.RequestException as e:
@@ -140,6 +186,158 @@ def query_llama(prompt: str) -> str:
     return "Error: Unexpected processing error"
 
 
+def build_analysis_output(label: str, analyzed_changes: list) -> dict:
+  return {
+    "label": label,
+    "ai_analysis": generate_text_report_string(analyzed_changes),
+    "changes": analyzed_changes,
+    "status": "success"
+  }
+
+
+def query_llama_scheduled(prompt: str, user_id: str = None, json_format: bool = False, timeout: int = 60) -> str:
+  # Each prompt holds a batch slot only for its own request, so interactive questions can slip in between
+  with get_llm_scheduler().slot(PRIORITY_BATCH, user_id, wait_when_full=True):
+    return query_llama(prompt, json_format, timeout)
+
+
+def change_group_key(change: dict) -> tuple:
+  """
+  Changes with the same type and payload under the same parent path (ignoring nth-of-type
+  indices and viewport) share one fix, e.g. every card in a list whose colour changed.
+  """
+  change_type = change.get("type", "unknown")
+  if change_type in ("css_rule_modified", "computed_style_modified"):
+    payload = change.get("property_changes", {})
+  elif change_type == "dom_modification":
+    payload = change.get("changes", {})
+  elif change_type in ("css_rule_added", "css_rule_deleted"):
+    payload = change.get("properties", {})
+  else:
+    payload = change.get("details", "")
+  parent = change.get("selector", "").rsplit(" > ", 1)[0]
+  return change_type, NTH_OF_TYPE.sub("", parent), json.dumps(payload, sort_keys=True, default=str)
+
+
+def group_changes(changes: list) -> list:
+  groups = OrderedDict()
+  for change in changes:
+    groups.setdefault(change_group_key(change), []).append(change)
+  return list(groups.values())
+
+
+def describe_group(group: list) -> str:
+  description = describe_change(group[0])
+  others = sorted({change.get("selector", "N/A") for change in group[1:]} - {group[0].get("selector", "N/A")})
+  if others:
+    shown = ", ".join(f"`{selector}`" for selector in others[:GROUP_SELECTORS_SHOWN])
+    more = f" and {len(others) - GROUP_SELECTORS_SHOWN} more" if len(others) > GROUP_SELECTORS_SHOWN else ""
+    description += f"\n- The same change also occurred on {shown}{more}."
+  return description
+
+
+def _cache_key(description: str) -> str:
+  return hashlib.md5(description.encode("utf-8")).hexdigest()
+
+
+def cached_fix(description: str):
+  with _fix_cache_lock:
+    key = _cache_key(description)
+    if key in _fix_cache:
+      _fix_cache.move_to_end(key)
+      return _fix_cache[key]
+  return None
+
+
+def cache_fix(description: str, fix: str):
+  if fix.startswith("Error:"):
+    return
+  with _fix_cache_lock:
+    _fix_cache[_cache_key(description)] = fix
+    while len(_fix_cache) > config.VRT_ANALYSIS_CACHE_SIZE:
+      _fix_cache.popitem(last=False)
+
+
+def parse_batch_fixes(response: str, count: int) -> dict:
+  """Map change number (1-based) -> fix from the model's JSON answer; malformed entries are dropped."""
+  try:
+    data = json.loads(response)
+  except ValueError:
+    match = re.search(r"\{.*\}", response, re.DOTALL)
+    try:
+      data = json.loads(match.group(0)) if match else {}
+    except ValueError:
+      data = {}
+  items = data.get("fixes", []) if isinstance(data, dict) else data
+  fixes = {}
+  for item in items if isinstance(items, list) else []:
+    try:
+      number = int(item["id"])
+      fix = str(item["fix"]).strip()
+    except (KeyError, TypeError, ValueError):
+      continue
+    if 1 <= number <= count and fix:
+      fixes[number] = fix
+  return fixes
+
+
+def analyze_batch(descriptions: list, user_id: str = None) -> list:
+  """Fixes for several change descriptions from one JSON prompt; unanswered ones are retried singly."""
+  if len(descriptions) == 1:
+    return [query_llama_scheduled(build_single_prompt(descriptions[0]), user_id)]
+  response = query_llama_scheduled(build_batch_prompt(descriptions), user_id, json_format=True,
+                                   timeout=60 + 15 * len(descriptions))
+  if response.startswith("Error:"):
+    return [response] * len(descriptions)
+  fixes = parse_batch_fixes(response, len(descriptions))
+  return [
+    fixes.get(i + 1) or query_llama_scheduled(build_single_prompt(description), user_id)
+    for i, description in enumerate(descriptions)
+  ]
+
+
+async def analyze_changes(label: str, changes: list, user_id: str = None, on_fixes=None) -> dict:
+  """
+  In-process enrichment: attach an AI fix suggestion to each change and return the report object.
+
+  Identical changes are grouped and asked about once, previously answered groups come from the
+  fix cache, and the rest go out several per prompt with a few prompts in flight at a time.
+  `on_fixes(changes)`, if given, is awaited with each set of changes as their fixes arrive.
+  """
+  groups = group_changes(changes)
+  descriptions = [describe_group(group) for group in groups]
+  fixes = [cached_fix(description) for description in descriptions]
+  pending = [i for i, fix in enumerate(fixes) if fix is None]
+  log(f" Found {len(changes)} VRT changes for label '{label}': {len(groups)} distinct, "
+      f"{len(groups) - len(pending)} cached.")
+
+  batch_size = max(1, config.VRT_ANALYSIS_BATCH_SIZE)
+  batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+  semaphore = asyncio.Semaphore(max(1, config.VRT_ANALYSIS_CONCURRENCY))
+
+  async def apply_fixes(group_indexes: list):
+    answered = []
+    for i in group_indexes:
+      for change in groups[i]:
+        change["ai_fix_suggestion"] = fixes[i]
+        answered.append(change)
+    if on_fixes is not None and answered:
+      await on_fixes(answered)
+
+  async def run_batch(number: int, batch: list):
+    async with semaphore:
+      log(f"--- Analyzing batch {number + 1}/{len(batches)} ({len(batch)} change group(s)) ---")
+      batch_fixes = await run_in_threadpool(analyze_batch, [descriptions[i] for i in batch], user_id)
+    for i, fix in zip(batch, batch_fixes):
+      fixes[i] = fix
+      cache_fix(descriptions[i], fix)
+    await apply_fixes(batch)
+
+  await apply_fixes([i for i, fix in enumerate(fixes) if fix is not None])
+  await asyncio.gather(*(run_batch(number, batch) for number, batch in enumerate(batches)))
+  return build_analysis_output(label, changes)
+
+
 def main(label: str):
   try:
     diff_data = load_diff_file(label)
@@ -147,25 +345,8 @@ def main(label: str):
     log(str(e), level="ERROR")
     sys.exit(1)
 
-  analyzed_differences = []
-  log(f" Found {len(diff_data)} VRT changes to analyze for label '{label}'.")
-
-  for i, change in enumerate(diff_data):
-    log(f"--- Analyzing change {i + 1}/{len(diff_data)} ---")
-    prompt = build_prompt(change)
-    fix_suggestion = query_llama(prompt)
-    change["ai_fix_suggestion"] = fix_suggestion
-    analyzed_differences.append(change)
-
   # Prepare output
-  text_report_string = generate_text_report_string(analyzed_differences)
-
-  final_output_object = {
-    "label": label,
-    "ai_analysis": text_report_string,
-    "changes": analyzed_differences,
-    "status": "success"
-  }
+  final_output_object = asyncio.run(analyze_changes(label, diff_data))
 
   # Optional save to file
   try:
@@ -3,6 +3,7 @@ import time
 import threading
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from app.qa import answer_question_stream
+from app.llm_scheduler import PRIORITY_BACKGROUND
 from app.utils import detect_project_type
 
 def load_prompts_from_file(file_path: str) -> list:
@@ -36,7 +37,9 @@ def generate_and_cache_answer(project_id: str, question: str, question_num: int)
         
         # Collect the streamed response
         full_response = ""
-        for token in answer_question_stream(project_id, question, max_docs=5, prompt_type="code_prompt"):
+        # Background priority: only runs when no interactive or batch generation is waiting
+        for token in answer_question_stream(project_id, question, max_docs=5, prompt_type="code_prompt",
+                                            priority=PRIORITY_BACKGROUND, user_id=f"background:{project_id}"):
             full_response += str(token)
         
         print(f"✅ Completed answer {question_num}: {question[:30]}...")
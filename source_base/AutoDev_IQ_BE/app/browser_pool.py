@@ -0,0 +1,192 @@
+import asyncio
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from playwright.async_api import async_playwright
+
+from config import config
+
+DEFAULT_VIEWPORT = {"label": "desktop", "width": 1366, "height": 768}
+BROWSER_ARGS = ["--no-sandbox", "--disable-setuid-sandbox"]
+STYLE_PROPERTIES = [prop.strip() for prop in config.VRT_STYLE_PROPERTIES.split(",") if prop.strip()]
+
+# Runs in the page: walks the DOM once, building the same selectors as dom.build_selector_index,
+# and returns {selector: [value per property]} for rendered elements, or null for display:none
+# subtrees (which are not descended into). Zero-size and visibility:hidden elements are skipped.
+COMPUTED_STYLES_SCRIPT = """
+({properties, maxElements}) => {
+  const skipped = new Set(['script', 'style', 'noscript', 'template', 'head']);
+  const styles = {};
+  let recorded = 0;
+  const visit = (parent, parentPath) => {
+    const children = Array.from(parent.children);
+    const tagCounts = {};
+    for (const child of children) tagCounts[child.localName] = (tagCounts[child.localName] || 0) + 1;
+    const tagSeen = {};
+    for (const child of children) {
+      const tag = child.localName;
+      tagSeen[tag] = (tagSeen[tag] || 0) + 1;
+      let path;
+      if (child.id) {
+        path = '#' + child.id;
+      } else {
+        let part = tag;
+        const classes = (child.getAttribute('class') || '').trim();
+        if (classes) part += '.' + classes.split(/\\s+/).join('.');
+        if (tagCounts[tag] > 1) part += ':nth-of-type(' + tagSeen[tag] + ')';
+        path = parentPath ? parentPath + ' > ' + part : part;
+      }
+      if (skipped.has(tag)) continue;
+      if (recorded >= maxElements) return;
+      const computed = getComputedStyle(child);
+      if (computed.display === 'none') {
+        styles[path] = null;
+        continue;
+      }
+      const rect = child.getBoundingClientRect();
+      if (computed.visibility !== 'hidden' && rect.width > 0 && rect.height > 0) {
+        styles[path] = properties.map(prop => computed.getPropertyValue(prop));
+        recorded++;
+      }
+      visit(child, path);
+    }
+  };
+  visit(document.documentElement, '');
+  return styles;
+}
+"""
+
+_pool = None
+
+
+@dataclass
+class PageCapture:
+  url: str
+  viewport: Dict
+  html: str
+  screenshot: bytes
+  # selector -> computed values in `style_properties` order (None for display:none elements)
+  styles: Dict[str, Optional[List[str]]] = field(default_factory=dict)
+  style_properties: List[str] = field(default_factory=list)
+  from_baseline: bool = False  # loaded from the baseline store rather than captured now
+
+
+class BrowserPool:
+  """
+  One long-lived headless Chromium shared by every VRT run.
+
+  Browser contexts are kept per viewport and reused across runs (cookies are cleared between
+  uses); at most `max_pages` pages are open at once. Each capture visits a URL once and returns
+  the rendered DOM, the computed styles of its visible elements and a full-page screenshot.
+  """
+
+  def __init__(self, max_pages: int = config.BROWSER_POOL_SIZE):
+    self.max_pages = max(1, max_pages)
+    self._semaphore = asyncio.Semaphore(self.max_pages)
+    self._lock = asyncio.Lock()
+    self._playwright = None
+    self._browser = None
+    self._idle_contexts: Dict[Tuple[int, int], List] = {}
+    self.stats_counters = {"launches": 0, "captures": 0, "contexts_created": 0, "contexts_reused": 0}
+
+  async def _ensure_browser(self):
+    async with self._lock:
+      if self._browser is not None and self._browser.is_connected():
+        return self._browser
+      if self._playwright is None:
+        self._playwright = await async_playwright().start()
+      self._browser = await self._playwright.chromium.launch(args=BROWSER_ARGS)
+      self._idle_contexts = {}
+      self.stats_counters["launches"] += 1
+      print("🌐 Launched shared Chromium for VRT captures")
+      return self._browser
+
+  async def _checkout_context(self, viewport: Dict):
+    browser = await self._ensure_browser()
+    key = (viewport["width"], viewport["height"])
+    idle = self._idle_contexts.get(key)
+    if idle:
+      self.stats_counters["contexts_reused"] += 1
+      return idle.pop()
+    self.stats_counters["contexts_created"] += 1
+    return await browser.new_context(viewport={"width": viewport["width"], "height": viewport["height"]})
+
+  async def _checkin_context(self, viewport: Dict, context):
+    try:
+      await context.clear_cookies()
+    except Exception:
+      return  # context died with its browser; let it go
+    self._idle_contexts.setdefault((viewport["width"], viewport["height"]), []).append(context)
+
+  async def capture(self, url: str, viewport: Optional[Dict] = None, wait_until: str = config.VRT_WAIT_UNTIL,
+                    wait_for_selector: Optional[str] = config.VRT_WAIT_FOR_SELECTOR,
+                    timeout_ms: int = config.BROWSER_NAVIGATION_TIMEOUT_MS) -> PageCapture:
+    """
+    Load `url` once and return its rendered HTML, computed styles and a full-page PNG screenshot.
+
+    `wait_until` is Playwright's navigation milestone ("domcontentloaded", "load", "networkidle");
+    SPAs that render after that can also name a `wait_for_selector` that must be visible first.
+    """
+    viewport = viewport or DEFAULT_VIEWPORT
+    async with self._semaphore:
+      context = await self._checkout_context(viewport)
+      page = await context.new_page()
+      try:
+        await page.goto(url, wait_until=wait_until, timeout=timeout_ms)
+        if wait_for_selector:
+          await page.wait_for_selector(wait_for_selector, state="visible", timeout=timeout_ms)
+        html = await page.content()
+        styles = await page.evaluate(
+            COMPUTED_STYLES_SCRIPT, {"properties": STYLE_PROPERTIES, "maxElements": config.VRT_STYLE_MAX_ELEMENTS}
+        )
+        screenshot = await page.screenshot(full_page=True)
+      finally:
+        await page.close()
+        await self._checkin_context(viewport, context)
+    self.stats_counters["captures"] += 1
+    return PageCapture(url=url, viewport=viewport, html=html, screenshot=screenshot,
+                       styles=styles, style_properties=STYLE_PROPERTIES)
+
+  async def close(self):
+    async with self._lock:
+      if self._browser is not None:
+        try:
+          await self._browser.close()
+        except Exception as e:
+          print(f"⚠️ Failed to close shared Chromium: {e}")
+      if self._playwright is not None:
+        await self._playwright.stop()
+      self._browser = None
+      self._playwright = None
+      self._idle_contexts = {}
+
+  def stats(self) -> dict:
+    return {
+      "connected": bool(self._browser and self._browser.is_connected()),
+      "max_pages": self.max_pages,
+      "idle_contexts": sum(len(contexts) for contexts in self._idle_contexts.values()),
+      **self.stats_counters
+    }
+
+
+def parse_viewports(spec: str) -> List[Dict]:
+  """Parse 'desktop:1366x768,mobile:375x812' into {label, width, height} viewport dicts."""
+  viewports = []
+  for item in filter(None, (part.strip() for part in spec.split(","))):
+    label, _, size = item.rpartition(":")
+    width, height = size.lower().split("x")
+    viewports.append({"label": label or f"{width}x{height}", "width": int(width), "height": int(height)})
+  return viewports or [DEFAULT_VIEWPORT]
+
+
+def get_browser_pool() -> BrowserPool:
+  global _pool
+  if _pool is None:
+    _pool = BrowserPool()
+  return _pool
+
+async def close_browser_pool():
+  global _pool
+  if _pool is not None:
+    await _pool.close()
+    _pool = None
@@ -0,0 +1,113 @@
+from difflib import SequenceMatcher
+from typing import Dict, List, Optional, Tuple
+
+from git import Repo, GitCommandError
+
+from config import config
+from app.utils import read_project_metadata
+from app.git_blobs import list_changed_paths, read_blobs
+
+CODE_EXTENSIONS = (".java", ".js", ".jsx", ".ts", ".tsx")
+
+
+def detect_default_branch(repo: Repo) -> str:
+    """Remote default branch from origin/HEAD, e.g. 'main' or 'master'."""
+    prefix = "refs/remotes/origin/"
+    default_ref = repo.git.symbolic_ref(f"{prefix}HEAD")
+    return default_ref[len(prefix):] if default_ref.startswith(prefix) else default_ref.split("/")[-1]
+
+
+def changed_line_ranges(old: Optional[str], new: str) -> List[Tuple[int, int]]:
+    """1-based inclusive line ranges of the new text that were inserted or replaced, or that border removed lines."""
+    old_lines = (old or "").splitlines()
+    new_lines = new.splitlines()
+    matcher = SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    ranges = []
+    for tag, _, _, j1, j2 in matcher.get_opcodes():
+        if tag in ("replace", "insert") and j2 > j1:
+            ranges.append((j1 + 1, j2))
+        elif tag == "delete" and new_lines:
+            ranges.append((max(1, j1), min(len(new_lines), j1 + 1)))
+    return ranges
+
+
+def expand_ranges(ranges: List[Tuple[int, int]], context: int, total_lines: int) -> List[Tuple[int, int]]:
+    """Pad each range with context lines and merge ranges that then overlap."""
+    merged = []
+    for start, end in sorted(ranges):
+        start, end = max(1, start - context), min(total_lines, end + context)
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class BranchDiffService:
+    """
+    Diffs a fetched feature branch against the project's recorded default branch.
+
+    The base branch comes from metadata.json (written by process_project), the merge base is
+    resolved once, and all file versions are read from git objects rather than a checkout.
+    """
+
+    def __init__(self, project_path: str, feature_branch: str, base_branch: Optional[str] = None):
+        self.repo = Repo(project_path)
+        self.base_branch = base_branch or self._resolve_base_branch(project_path)
+        self.base_ref = self._remote_or_local(self.base_branch)
+        self.feature_ref = self._remote_or_local(feature_branch)
+        self.merge_base = self.repo.git.merge_base(self.base_ref, self.feature_ref).strip()
+        print(f"🔀 Diffing {self.feature_ref} against {self.base_ref} (merge base {self.merge_base[:8]})")
+
+    def _resolve_base_branch(self, project_path: str) -> str:
+        main_branch = read_project_metadata(project_path).get("main_branch")
+        if main_branch:
+            return main_branch
+        try:
+            return detect_default_branch(self.repo)
+        except GitCommandError:
+            return "main"
+
+    def _remote_or_local(self, branch: str) -> str:
+        remote_ref = f"origin/{branch}"
+        try:
+            self.repo.git.rev_parse("--verify", "--quiet", remote_ref)
+            return remote_ref
+        except GitCommandError:
+            return branch
+
+    def changed_files(self, extensions: Tuple[str, ...] = CODE_EXTENSIONS) -> List[Dict]:
+        """Changes since the merge base as dicts with status (A/M/D), path and, for renames, old_path."""
+        changes = []
+        for status, path, old_path in list_changed_paths(self.repo, self.merge_base, self.feature_ref):
+            if not path.endswith(extensions):
+                continue
+            if status == "R":
+                changes.append({"status": "D", "path": old_path})
+                status = "A"
+            changes.append({"status": status, "path": path})
+        return changes
+
+    def load_changes(self, extensions: Tuple[str, ...] = CODE_EXTENSIONS) -> List[Dict]:
+        """Changed files with base/feature contents and the changed line ranges of the feature version."""
+        changes = self.changed_files(extensions)
+        paths = [c["path"] for c in changes]
+        base_contents = read_blobs(self.repo, self.merge_base, paths)
+        feature_contents = read_blobs(self.repo, self.feature_ref, [c["path"] for c in changes if c["status"] != "D"])
+
+        for change in changes:
+            change["base_content"] = base_contents.get(change["path"])
+            change["feature_content"] = feature_contents.get(change["path"])
+            if change["feature_content"] is not None:
+                change["changed_ranges"] = changed_line_ranges(change["base_content"], change["feature_content"])
+        return changes
+
+
+def hunk_windows(content: str, ranges: List[Tuple[int, int]],
+                 context: int = config.HUNK_CONTEXT_LINES) -> List[Tuple[int, int, str]]:
+    """(start_line, end_line, text) windows covering changed lines plus surrounding context."""
+    lines = content.splitlines()
+    return [
+        (start, end, "\n".join(lines[start - 1:end]))
+        for start, end in expand_ranges(ranges, context, len(lines))
+    ]
@@ -2,61 +2,69 @@ import asyncio
 import json
 import argparse
 import os
+import sys
 from pathlib import Path
-from itertools import zip_longest
+from typing import List, Optional
+from collections import Counter, deque
+from difflib import SequenceMatcher
 from urllib.parse import urlparse
-from playwright.async_api import async_playwright
-import cssutils
 from bs4 import BeautifulSoup, Tag
+from starlette.concurrency import run_in_threadpool
 
-cssutils.log.setLevel("CRITICAL")
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from config import config
+from app.browser_pool import close_browser_pool, get_browser_pool, parse_viewports
+from app.vrt_baselines import get_baseline_store
 
 TAGS_TO_IGNORE_IN_DOM_DIFF = ['style', 'script']
+SUMMARY_TEXT_CHARS = 120
 
 OUTPUT_DIR = os.path.join("app", "dom_diffs")
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-def extract_all_styles(soup: BeautifulSoup) -> dict:
-  styles_map = {}
-  for style_tag in soup.find_all('style'):
-    try:
-      sheet = cssutils.parseString(style_tag.string or '')
-      for rule in sheet.cssRules.rulesOfType(cssutils.css.CSSRule.STYLE_RULE):
-        selector = rule.selectorText
-        properties = {p.name: p.value for p in rule.style}
-        styles_map.setdefault(selector, {}).update(properties)
-    except Exception:
-      pass
-  for element in soup.find_all(style=True):
-    selector = generate_css_selector(element)
-    try:
-      style_declaration = cssutils.parseStyle(element['style'])
-      properties = {p.name: p.value for p in style_declaration}
-      styles_map.setdefault(selector, {}).update(properties)
-    except Exception:
-      pass
-  return styles_map
-
-def compare_css_rules(base_map: dict, test_map: dict) -> list:
-  css_differences = []
-  all_selectors = set(base_map.keys()) | set(test_map.keys())
-  for selector in sorted(all_selectors):
-    base_props = base_map.get(selector)
-    test_props = test_map.get(selector)
-    if not base_props:
-      css_differences.append({"type": "css_rule_added", "selector": selector, "properties": test_props})
-    elif not test_props:
-      css_differences.append({"type": "css_rule_deleted", "selector": selector, "properties": base_props})
-    elif base_props != test_props:
-      prop_changes = {}
-      for prop in set(base_props) | set(test_props):
-        if base_props.get(prop) != test_props.get(prop):
-          prop_changes[prop] = {"base_value": base_props.get(prop), "test_value": test_props.get(prop)}
-      if prop_changes:
-        css_differences.append({"type": "css_rule_modified", "selector": selector, "property_changes": prop_changes})
-  return css_differences
-
-def generate_css_selector(element: Tag) -> str:
+def _display_value(values: Optional[list], properties: List[str]) -> str:
+  if values is None:
+    return "none"
+  return values[properties.index("display")] if "display" in properties else "visible"
+
+def diff_computed_styles(pairs: list, selectors: dict, base_styles: dict, test_styles: dict,
+                         properties: List[str]) -> list:
+  """
+  Compare browser-computed styles of the base/test element pairs the DOM diff aligned, reporting
+  only the properties whose values changed. Each side's styles are looked up by its own selector,
+  so an insertion that shifts later siblings' nth-of-type indices doesn't mismatch them.
+  Elements on one page only are DOM additions/deletions.
+  """
+  style_differences = []
+  for base_element, test_element in pairs:
+    base_selector = selectors.get(id(base_element))
+    test_selector = selectors.get(id(test_element))
+    # Elements inside display:none subtrees or without a box were not captured
+    if base_selector not in base_styles or test_selector not in test_styles:
+      continue
+    base_values = base_styles[base_selector]
+    test_values = test_styles[test_selector]
+    if base_values == test_values:
+      continue
+    if base_values is None or test_values is None:
+      # display:none on one side only; the captured values would be meaningless to compare
+      prop_changes = {"display": {
+          "base_value": _display_value(base_values, properties),
+          "test_value": _display_value(test_values, properties)
+      }}
+    else:
+      prop_changes = {
+          prop: {"base_value": base_value, "test_value": test_value}
+          for prop, base_value, test_value in zip(properties, base_values, test_values)
+          if base_value != test_value
+      }
+    style_differences.append({"type": "computed_style_modified", "selector": test_selector, "property_changes": prop_changes})
+  return style_differences
+
+def generate_css_selector(element: Tag, selectors: Optional[dict] = None) -> str:
+  if selectors is not None and id(element) in selectors:
+    return selectors[id(element)]
   path = []
   current = element
   while current and isinstance(current, Tag) and current.name != 'html':
@@ -74,62 +82,259 @@ def generate_css_selector(element: Tag) -> str:
     current = current.parent
   return ' > '.join(path)
 
-def compare_elements(elem1: Tag, elem2: Tag, differences: list):
-  if elem1.name in TAGS_TO_IGNORE_IN_DOM_DIFF:
-    return
+def build_selector_index(soup: BeautifulSoup) -> dict:
+  """
+  Selector of every element (same format as generate_css_selector), keyed by id(element).
 
-  modifications = {}
-  base_attrs = elem1.attrs.copy(); base_attrs.pop('style', None)
-  test_attrs = elem2.attrs.copy(); test_attrs.pop('style', None)
+  One pre-order pass: each element extends its parent's already-built path, and nth-of-type
+  indices come from counting same-tag siblings once per parent.
+  """
+  selectors = {}
+  stack = [(soup, '')]
+  while stack:
+    parent, parent_path = stack.pop()
+    children = element_children(parent)
+    tag_counts = Counter(child.name for child in children)
+    tag_seen = Counter()
+    for child in children:
+      tag_seen[child.name] += 1
+      if child.get('id'):
+        path = f'#{child["id"]}'
+      elif child.name == 'html':
+        path = ''
+      else:
+        part = child.name
+        if child.get('class'):
+          part += '.' + '.'.join(child['class'])
+        if tag_counts[child.name] > 1:
+          part += f':nth-of-type({tag_seen[child.name]})'
+        path = f'{parent_path} > {part}' if parent_path else part
+      selectors[id(child)] = path
+      stack.append((child, path))
+  return selectors
 
-  if base_attrs != test_attrs:
-    modifications['attributes'] = {"base_value": base_attrs, "test_value": test_attrs}
+def direct_text(element: Tag) -> str:
+  return ''.join(s.strip() for s in element.find_all(string=True, recursive=False))
 
-  base_text = ''.join(s.strip() for s in elem1.find_all(string=True, recursive=False))
-  test_text = ''.join(s.strip() for s in elem2.find_all(string=True, recursive=False))
-  if base_text != test_text and (base_text or test_text):
-    modifications['text_content'] = {"base_value": base_text, "test_value": test_text}
+def element_children(element: Tag) -> list:
+  return [c for c in element.children if isinstance(c, Tag)]
 
-  if modifications:
-    differences.append({"type": "dom_modification", "selector": generate_css_selector(elem1), "changes": modifications})
+def subtree_hashes(root: Tag) -> dict:
+  """
+  Hash of every element's subtree (tag, attributes, own text, child hashes), keyed by id(element).
 
-  base_children = [c for c in elem1.children if isinstance(c, Tag)]
-  test_children = [c for c in elem2.children if isinstance(c, Tag)]
+  Post-order walk with an explicit stack, so generated pages nested thousands of levels deep
+  don't hit the recursion limit.
+  """
+  hashes = {}
+  stack = [(root, None)] if root is not None else []
+  while stack:
+    element, children = stack.pop()
+    if children is None:
+      children = element_children(element)
+      stack.append((element, children))
+      stack.extend((child, None) for child in children)
+      continue
+    attrs = tuple(sorted(
+        (name, ' '.join(value) if isinstance(value, list) else value) for name, value in element.attrs.items()
+    ))
+    child_hashes = tuple(hashes[id(child)] for child in children)
+    hashes[id(element)] = hash((element.name, attrs, direct_text(element), child_hashes))
+  return hashes
 
-  for child1, child2 in zip_longest(base_children, test_children):
-    if child1 and not child2:
-      differences.append({"type": "dom_deletion", "selector": generate_css_selector(child1), "details": str(child1).strip()})
-    elif not child1 and child2:
-      differences.append({"type": "dom_addition", "selector": generate_css_selector(child2), "details": str(child2).strip()})
-    elif child1.name != child2.name:
-      differences.append({"type": "dom_deletion", "selector": generate_css_selector(child1), "details": str(child1).strip()})
-      differences.append({"type": "dom_addition", "selector": generate_css_selector(child2), "details": str(child2).strip()})
+def element_key(element: Tag) -> tuple:
+  """Identity used to align siblings: the id if there is one, otherwise tag + classes + own-text hash."""
+  if element.get('id'):
+    return ('#', element['id'])
+  return (element.name, tuple(element.get('class', [])), hash(direct_text(element)))
+
+def summarize_element(element: Tag) -> str:
+  """Opening tag plus a text excerpt, instead of serializing the whole subtree."""
+  attrs = ''.join(
+      f' {name}="{" ".join(value) if isinstance(value, list) else value}"' for name, value in element.attrs.items()
+  )
+  text = ' '.join(element.get_text(' ', strip=True).split())
+  if len(text) > SUMMARY_TEXT_CHARS:
+    text = text[:SUMMARY_TEXT_CHARS] + '…'
+  descendants = sum(1 for _ in element.find_all(True))
+  summary = f'<{element.name}{attrs}>{text}'
+  return f'{summary} (+{descendants} nested elements)' if descendants else summary
+
+def _pair_replaced(base_block: list, test_block: list, pairs: list, deleted: list, inserted: list):
+  """Within a replaced run of siblings, pair elements of the same tag in order; the rest are edits."""
+  test_by_name = {}
+  for child in test_block:
+    test_by_name.setdefault(child.name, deque()).append(child)
+  paired = set()
+  for child in base_block:
+    candidates = test_by_name.get(child.name)
+    if candidates:
+      match = candidates.popleft()
+      paired.add(id(match))
+      pairs.append((child, match))
     else:
-      compare_elements(child1, child2, differences)
+      deleted.append(child)
+  inserted.extend(child for child in test_block if id(child) not in paired)
 
-async def get_dom_and_css_diff(base_url: str, test_url: str) -> list:
-  try:
-    async with async_playwright() as p:
-      browser = await p.chromium.launch()
-      page = await browser.new_page()
-      await page.goto(base_url, wait_until="domcontentloaded")
-      base_html = await page.content()
-      await page.goto(test_url, wait_until="domcontentloaded")
-      test_html = await page.content()
-      await browser.close()
-  except Exception as e:
-    print("Playwright error:", e)
-    return []
+def _pair_identical(elem1: Tag, elem2: Tag, matched: list):
+  """Pair every element of two subtrees with equal hashes (hence the same shape) position by position."""
+  stack = [(elem1, elem2)]
+  while stack:
+    base_element, test_element = stack.pop()
+    matched.append((base_element, test_element))
+    stack.extend(zip(element_children(base_element), element_children(test_element)))
+
+def compare_elements(elem1: Tag, elem2: Tag, differences: list, hashes: dict, selectors: dict,
+                     matched: Optional[list] = None):
+  """
+  Diff two aligned elements and their key-aligned descendants, depth first. Every base/test element
+  pair found along the way, including those inside identical subtrees, is appended to `matched`.
+  Uses an explicit stack rather than recursion, so very deep pages are diffed too.
+  """
+  stack = [(elem1, elem2)]
+  while stack:
+    elem1, elem2 = stack.pop()
+    if elem1.name in TAGS_TO_IGNORE_IN_DOM_DIFF:
+      continue
+    if hashes.get(id(elem1)) == hashes.get(id(elem2)):
+      # Same markup can still render differently, so the pairs are kept for the style diff
+      if matched is not None:
+        _pair_identical(elem1, elem2, matched)
+      continue
+    if matched is not None:
+      matched.append((elem1, elem2))
+
+    modifications = {}
+    base_attrs = elem1.attrs.copy(); base_attrs.pop('style', None)
+    test_attrs = elem2.attrs.copy(); test_attrs.pop('style', None)
+
+    if base_attrs != test_attrs:
+      modifications['attributes'] = {"base_value": base_attrs, "test_value": test_attrs}
+
+    base_text = direct_text(elem1)
+    test_text = direct_text(elem2)
+    if base_text != test_text and (base_text or test_text):
+      modifications['text_content'] = {"base_value": base_text, "test_value": test_text}
+
+    if modifications:
+      differences.append({"type": "dom_modification", "selector": generate_css_selector(elem1, selectors), "changes": modifications})
+
+    base_children = element_children(elem1)
+    test_children = element_children(elem2)
 
+    # Align siblings by key so one insertion doesn't shift every following pair out of step
+    matcher = SequenceMatcher(None, [element_key(c) for c in base_children],
+                              [element_key(c) for c in test_children], autojunk=False)
+    pairs, deleted, inserted = [], [], []
+    for op, i1, i2, j1, j2 in matcher.get_opcodes():
+      if op == 'equal':
+        pairs.extend(zip(base_children[i1:i2], test_children[j1:j2]))
+      elif op == 'replace':
+        _pair_replaced(base_children[i1:i2], test_children[j1:j2], pairs, deleted, inserted)
+      elif op == 'delete':
+        deleted.extend(base_children[i1:i2])
+      else:
+        inserted.extend(test_children[j1:j2])
+
+    for child in deleted:
+      if child.name not in TAGS_TO_IGNORE_IN_DOM_DIFF:
+        differences.append({"type": "dom_deletion", "selector": generate_css_selector(child, selectors),
+                            "details": summarize_element(child), "_hash": hashes[id(child)]})
+    for child in inserted:
+      if child.name not in TAGS_TO_IGNORE_IN_DOM_DIFF:
+        differences.append({"type": "dom_addition", "selector": generate_css_selector(child, selectors),
+                            "details": summarize_element(child), "_hash": hashes[id(child)]})
+    # Reversed so pairs pop in document order, as the recursive version visited them
+    stack.extend(reversed(pairs))
+
+def collapse_moves(differences: list) -> list:
+  """Turn a deletion and an addition of identical subtrees (anywhere in the page) into one move."""
+  additions = {}
+  for diff in differences:
+    if diff["type"] == "dom_addition":
+      additions.setdefault(diff["_hash"], deque()).append(diff)
+
+  moved_additions = set()
+  result = []
+  for diff in differences:
+    if diff["type"] == "dom_deletion" and additions.get(diff["_hash"]):
+      addition = additions[diff["_hash"]].popleft()
+      moved_additions.add(id(addition))
+      result.append({"type": "dom_move", "selector": addition["selector"],
+                     "from_selector": diff["selector"], "details": diff["details"]})
+    else:
+      result.append(diff)
+  result = [diff for diff in result if id(diff) not in moved_additions]
+  for diff in result:
+    diff.pop("_hash", None)
+  return result
+
+def diff_html(base_html: str, test_html: str, base_styles: Optional[dict] = None,
+              test_styles: Optional[dict] = None, style_properties: Optional[List[str]] = None) -> list:
   base_soup = BeautifulSoup(base_html, 'html.parser')
   test_soup = BeautifulSoup(test_html, 'html.parser')
-  dom_diffs = []
-  compare_elements(base_soup.html, test_soup.html, dom_diffs)
-  css_diffs = compare_css_rules(
-      extract_all_styles(base_soup),
-      extract_all_styles(test_soup)
-  )
-  return dom_diffs + css_diffs
+  hashes = {**subtree_hashes(base_soup.html), **subtree_hashes(test_soup.html)}
+  selectors = {**build_selector_index(base_soup), **build_selector_index(test_soup)}
+  dom_diffs, matched = [], []
+  compare_elements(base_soup.html, test_soup.html, dom_diffs, hashes, selectors, matched)
+  style_diffs = diff_computed_styles(matched, selectors, base_styles or {}, test_styles or {}, style_properties or [])
+  return collapse_moves(dom_diffs) + style_diffs
+
+async def capture_pages(base_url: str, test_url: str, viewports: Optional[List[dict]] = None,
+                        wait_until: str = config.VRT_WAIT_UNTIL, wait_for_selector: Optional[str] = None,
+                        baseline_version: Optional[str] = None, refresh_baseline: bool = False) -> dict:
+  """
+  Capture base and test pages for every viewport concurrently, each in its own browser context.
+
+  Base captures come from the baseline store when one matches `baseline_version` (or, without
+  one, the current fingerprint of `base_url`); otherwise they are captured and stored.
+  """
+  pool = get_browser_pool()
+  store = get_baseline_store()
+  viewports = viewports or parse_viewports(config.VRT_VIEWPORTS)
+  wait_for_selector = wait_for_selector or config.VRT_WAIT_FOR_SELECTOR
+  version = baseline_version or await run_in_threadpool(store.fingerprint, base_url)
+
+  async def capture_base(viewport: dict):
+    key = store.key(base_url, viewport, wait_until, wait_for_selector, version) if version else None
+    if key and not refresh_baseline:
+      baseline = await run_in_threadpool(store.load, key, viewport)
+      if baseline is not None:
+        return baseline
+    capture = await pool.capture(base_url, viewport, wait_until, wait_for_selector)
+    if key:
+      await run_in_threadpool(store.save, key, capture, version)
+    return capture
+
+  captures = await asyncio.gather(*[
+      capture
+      for viewport in viewports
+      for capture in (capture_base(viewport), pool.capture(test_url, viewport, wait_until, wait_for_selector))
+  ])
+  return {
+      viewport["label"]: (captures[2 * i], captures[2 * i + 1])
+      for i, viewport in enumerate(viewports)
+  }
+
+def diff_captures(captures: dict) -> list:
+  """DOM and computed-style diffs of every viewport's base/test capture, each tagged with its viewport label."""
+  diffs = []
+  for label, (base_capture, test_capture) in captures.items():
+    for diff in diff_html(base_capture.html, test_capture.html, base_capture.styles,
+                          test_capture.styles, base_capture.style_properties):
+      diff["viewport"] = label
+      diffs.append(diff)
+  return diffs
+
+async def get_dom_and_css_diff(base_url: str, test_url: str, viewports: Optional[List[dict]] = None,
+                               wait_until: str = config.VRT_WAIT_UNTIL, wait_for_selector: Optional[str] = None) -> list:
+  try:
+    captures = await capture_pages(base_url, test_url, viewports, wait_until, wait_for_selector)
+    return diff_captures(captures)
+  except Exception as e:
+    # An empty list would read as "no changes"; let the caller see the failure instead
+    print(f"❌ DOM/CSS diff failed: {e}")
+    raise
 
 async def main():
   parser = argparse.ArgumentParser()
@@ -139,7 +344,10 @@ async def main():
   args = parser.parse_args()
 
   print(f"Running diff for label: {args.label}")
-  diffs = await get_dom_and_css_diff(args.base_url, args.test_url)
+  try:
+    diffs = await get_dom_and_css_diff(args.base_url, args.test_url)
+  finally:
+    await close_browser_pool()
 
   label_file = os.path.join(OUTPUT_DIR, f"{args.label}.json")
   with open(label_file, "w", encoding="utf-8") as f:
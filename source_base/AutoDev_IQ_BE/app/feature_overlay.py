@@ -0,0 +1,189 @@
+import os
+import json
+from typing import Dict, List, Optional
+
+from config import config
+from app.vector_store import get_project_store, get_store_registry
+
+OVERLAY_DIR = "overlays"
+OVERLAY_COLLECTION_PREFIX = "overlay__"
+
+
+def branch_key(branch: str) -> str:
+    return branch.replace("/", "_")
+
+def make_feature_id(project_id: str, branch: str) -> str:
+    return f"{project_id}__{branch_key(branch)}"
+
+def parse_feature_id(feature_id: str) -> tuple:
+    """Split 'project__branch_key' into its parts; the branch key is None for plain project ids."""
+    if "__" not in feature_id:
+        return feature_id, None
+    project_id, key = feature_id.split("__", 1)
+    return project_id, key
+
+
+class FeatureOverlay:
+    """
+    Delta index for a feature branch on top of its base project.
+
+    Only changed chunks are embedded, into an `overlay__<branch>` collection that lives on the
+    base project's Chroma client. A manifest records the changed files and tombstones (base
+    file paths/hashes the branch replaces) so searches can merge base and overlay results. Files
+    are identified by their repo-relative path, which every chunk carries as `path` metadata.
+    """
+
+    def __init__(self, project_id: str, key: str):
+        self.project_id = project_id
+        self.branch_key = key
+        self.collection_name = f"{OVERLAY_COLLECTION_PREFIX}{key}"
+        self.manifest_path = os.path.join(config.CHROMA_DIR, project_id, OVERLAY_DIR, f"{key}.json")
+        self.manifest = self._load_manifest()
+
+    @classmethod
+    def from_feature_id(cls, feature_id: str) -> Optional["FeatureOverlay"]:
+        project_id, key = parse_feature_id(feature_id)
+        if key is None:
+            return None
+        return cls(project_id, key)
+
+    @property
+    def feature_id(self) -> str:
+        return f"{self.project_id}__{self.branch_key}"
+
+    def _load_manifest(self) -> Dict:
+        if os.path.isfile(self.manifest_path):
+            try:
+                with open(self.manifest_path, "r", encoding="utf-8") as f:
+                    manifest = json.load(f)
+                # Older manifests tombstoned base names, which can't tell same-named files apart;
+                # they are dropped and recomputed on the next upload
+                manifest["tombstones"].setdefault("paths", [])
+                manifest["tombstones"].pop("sources", None)
+                return manifest
+            except Exception as e:
+                print(f"⚠️ Failed to load overlay manifest {self.manifest_path}: {e}")
+        return {"branch_key": self.branch_key, "files": [], "tombstones": {"paths": [], "hashes": []}, "replaced": {}}
+
+    def exists(self) -> bool:
+        return os.path.isfile(self.manifest_path)
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.manifest_path), exist_ok=True)
+        with open(self.manifest_path, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, indent=2)
+
+    @property
+    def store(self):
+        return get_project_store(self.project_id, self.collection_name)
+
+    @property
+    def base_store(self):
+        return get_project_store(self.project_id)
+
+    def record_files(self, rel_paths: List[str]):
+        self.manifest["files"] = sorted(set(rel_paths))
+
+    def add_tombstones(self, paths: List[str] = (), hashes: List[str] = ()):
+        tombstones = self.manifest["tombstones"]
+        tombstones["paths"] = sorted(set(tombstones["paths"]) | set(paths))
+        tombstones["hashes"] = sorted(set(tombstones["hashes"]) | set(hashes))
+
+    def reset_tombstones(self):
+        """Tombstones are recomputed from the full branch diff on every upload."""
+        self.manifest["tombstones"] = {"paths": [], "hashes": []}
+        self.manifest["replaced"] = {}
+
+    def record_replaced(self, rel_path: str, names: List[str]):
+        """Remember which base methods/components a changed file replaces or removes."""
+        self.manifest.setdefault("replaced", {})[rel_path] = sorted(set(names))
+
+    def base_chunks_for(self, rel_path: str, base_content: str) -> List[tuple]:
+        """(text, metadata) of the base chunks that belong to `rel_path`."""
+        # Indexes built before chunks carried a path key Java chunks by file name and React chunks
+        # by their clone path; a file-name match only counts if the code is in this very file
+        clone_path = os.path.join(config.CHROMA_DIR, self.project_id, rel_path)
+        base_chunks = self.base_store.get(where={"$or": [
+            {"path": rel_path},
+            {"source": {"$in": [os.path.basename(rel_path), clone_path]}}
+        ]})
+        chunks = []
+        for text, meta in zip(base_chunks["documents"], base_chunks["metadatas"]):
+            meta = meta or {}
+            if "path" in meta:
+                if meta["path"] == rel_path:
+                    chunks.append((text, meta))
+            elif meta.get("source") == clone_path or text.split("Code:\n", 1)[-1].strip() in base_content:
+                chunks.append((text, meta))
+        return chunks
+
+    def tombstone_changed_base_chunks(self, rel_path: str, feature_content: str, base_content: str) -> int:
+        """Hide base chunks of a modified or deleted file whose code no longer appears in the feature version."""
+        hashes = set()
+        for text, meta in self.base_chunks_for(rel_path, base_content):
+            code = text.split("Code:\n", 1)[-1]
+            if code.strip() and code.strip() not in feature_content and meta.get("hash"):
+                hashes.add(meta["hash"])
+        self.add_tombstones(hashes=sorted(hashes))
+        return len(hashes)
+
+    def prune_paths(self, keep_paths: List[str]):
+        """Remove overlay chunks of files that are no longer changed on the branch."""
+        existing = self.store.get()
+        stale_ids = [
+            doc_id for doc_id, meta in zip(existing["ids"], existing["metadatas"])
+            if (meta or {}).get("path") not in keep_paths
+        ]
+        if stale_ids:
+            self.store.delete(ids=stale_ids)
+            print(f"🧹 Pruned {len(stale_ids)} overlay chunk(s) of files no longer changed")
+
+    def is_tombstoned(self, metadata: Dict) -> bool:
+        tombstones = self.manifest["tombstones"]
+        return metadata.get("path") in tombstones["paths"] or metadata.get("hash") in tombstones["hashes"]
+
+    def drop_stale_chunks(self, rel_path: str, content_hash: str) -> bool:
+        """Remove overlay chunks of a file embedded from an older revision; True if current chunks remain."""
+        existing = self.store.get(where={"path": rel_path})
+        # Method/component chunks carry their own body hash, so the file revision lives in file_hash
+        stale_ids = [
+            doc_id for doc_id, meta in zip(existing["ids"], (meta or {} for meta in existing["metadatas"]))
+            if meta.get("file_hash", meta.get("hash")) != content_hash
+        ]
+        if stale_ids:
+            self.store.delete(ids=stale_ids)
+            print(f"🧹 Dropped {len(stale_ids)} stale overlay chunk(s) for {rel_path}")
+        return len(existing["ids"]) > len(stale_ids)
+
+    def similarity_search_by_vector_with_relevance_scores(self, embedding: List[float], k: int = 4) -> List[tuple]:
+        """Search overlay and base with one query embedding, hide tombstoned base chunks, merge by distance."""
+        overlay_results = self.store.similarity_search_by_vector_with_relevance_scores(embedding, k=k)
+        # Over-fetch from base to make up for chunks hidden by tombstones
+        base_results = self.base_store.similarity_search_by_vector_with_relevance_scores(embedding, k=k * 2)
+        base_results = [(doc, score) for doc, score in base_results if not self.is_tombstoned(doc.metadata)]
+
+        merged = sorted(overlay_results + base_results, key=lambda pair: pair[1])
+        return merged[:k]
+
+    def similarity_search(self, query: str, k: int = 4) -> List:
+        from app.qa import get_embeddings
+
+        embedding = get_embeddings().embed_query(query)
+        return [doc for doc, _ in self.similarity_search_by_vector_with_relevance_scores(embedding, k=k)]
+
+    def drop(self):
+        """Delete the overlay collection and its manifest."""
+        get_store_registry().drop_collection(self.project_id, self.collection_name)
+        if os.path.isfile(self.manifest_path):
+            os.remove(self.manifest_path)
+        print(f"🗑️ Dropped feature overlay: {self.feature_id}")
+
+
+def list_feature_overlays(project_id: str) -> List[str]:
+    overlay_dir = os.path.join(config.CHROMA_DIR, project_id, OVERLAY_DIR)
+    if not os.path.isdir(overlay_dir):
+        return []
+    return sorted(
+        f"{project_id}__{name[:-len('.json')]}"
+        for name in os.listdir(overlay_dir) if name.endswith(".json")
+    )
@@ -0,0 +1,38 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from git import Repo
+
+
+def list_changed_paths(repo: Repo, base_rev: str, feature_rev: str) -> List[Tuple[str, str, str]]:
+    """(status, path, old_path) for files changed on `feature_rev` since it forked from `base_rev`."""
+    output = repo.git.diff(f"{base_rev}...{feature_rev}", name_status=True)
+    changes = []
+    for line in output.splitlines():
+        parts = line.split("\t")
+        if len(parts) < 2:
+            continue
+        status = parts[0][:1]
+        changes.append((status, parts[-1].strip(), parts[1].strip()))
+    return changes
+
+
+def read_blobs(repo: Repo, rev: str, paths: Iterable[str]) -> Dict[str, Optional[str]]:
+    """
+    Read file contents at `rev` for many paths in one stream.
+
+    GitPython keeps a single `git cat-file --batch` process open per Repo, so this costs one
+    request/response round trip per path instead of one `git show` process per file.
+    Paths that do not exist at `rev` (or are not blobs) map to None.
+    """
+    contents = {}
+    for path in paths:
+        try:
+            _, obj_type, _, data = repo.git.get_object_data(f"{rev}:{path}")
+        except ValueError:
+            contents[path] = None
+            continue
+        if isinstance(obj_type, bytes):
+            obj_type = obj_type.decode()
+        contents[path] = data.decode("utf-8", errors="replace") if obj_type == "blob" else None
+    return contents
+
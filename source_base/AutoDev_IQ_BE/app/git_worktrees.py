@@ -0,0 +1,81 @@
+import os
+import threading
+
+from git import Repo
+
+from config import config
+from app.feature_overlay import branch_key
+
+# Kept outside the project clones so ingestion walks and /projects never see them
+WORKTREE_ROOT = os.path.join(config.CHROMA_DIR, ".worktrees")
+
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+def _named_lock(name: str) -> threading.Lock:
+    with _locks_guard:
+        if name not in _locks:
+            _locks[name] = threading.Lock()
+        return _locks[name]
+
+def get_repo_lock(project_path: str) -> threading.Lock:
+    """Serializes operations that touch a clone's shared .git metadata (fetch, worktree add/prune)."""
+    return _named_lock(os.path.abspath(project_path))
+
+def get_branch_lock(project_path: str, branch: str) -> threading.Lock:
+    """Serializes work inside one branch's worktree; different branches proceed in parallel."""
+    return _named_lock(f"{os.path.abspath(project_path)}::{branch}")
+
+
+def fetch_origin(project_path: str):
+    with get_repo_lock(project_path):
+        Repo(project_path).remotes.origin.fetch()
+
+
+def worktree_path(project_path: str, branch: str) -> str:
+    project_id = os.path.basename(os.path.normpath(project_path))
+    return os.path.join(WORKTREE_ROOT, project_id, branch_key(branch))
+
+
+def _release_branch(repo: Repo, branch: str):
+    """
+    Detach the shared clone's HEAD if it has `branch` checked out, since git refuses a second checkout.
+
+    The clone is on the default branch after cloning (and older versions checked feature branches
+    out there); detaching keeps the same commit and files, and nothing reads the clone's branch.
+    """
+    try:
+        active = repo.active_branch.name
+    except TypeError:
+        return
+    if active == branch:
+        print(f"↩️ Detaching shared clone from {branch} so it can get its own worktree")
+        repo.git.checkout("--detach")
+
+
+def ensure_worktree(project_path: str, branch: str) -> str:
+    """Return a cached worktree checked out on `branch`, creating it (and the local branch) if needed."""
+    path = worktree_path(project_path, branch)
+    if os.path.exists(os.path.join(path, ".git")):
+        return path
+
+    with get_repo_lock(project_path):
+        if os.path.exists(os.path.join(path, ".git")):
+            return path
+
+        repo = Repo(project_path)
+        repo.git.worktree("prune")
+        _release_branch(repo, branch)
+
+        remote_refs = {ref.name for ref in repo.remotes.origin.refs}
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if branch in repo.heads:
+            repo.git.worktree("add", path, branch)
+        elif f"origin/{branch}" in remote_refs:
+            repo.git.worktree("add", "-b", branch, path, f"origin/{branch}")
+        else:
+            repo.git.worktree("add", "-b", branch, path)
+        print(f"🌿 Created worktree for {branch} at {path}")
+    return path
+
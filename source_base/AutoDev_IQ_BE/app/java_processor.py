@@ -2,7 +2,7 @@ import os
 import hashlib
 import shutil
 from pathlib import Path
-from typing import List, Dict
+from typing import List, Dict, Optional
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import javalang
@@ -11,20 +11,20 @@ import matplotlib.pyplot as plt
 
 from langchain_core.documents import Document
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import Chroma
-from langchain_ollama import OllamaEmbeddings
+from app.vector_store import DEFAULT_COLLECTION, get_project_store
+from app.symbol_catalogue import SymbolCatalogue, extract_java_symbols
+from app.utils import project_relative_path
 from config import config
 
 
 class JavaProjectProcessor:
-    def __init__(self, project_id: str, persist_base_dir: str = config.CHROMA_DIR):
+    def __init__(self, project_id: str, persist_base_dir: str = config.CHROMA_DIR,
+                 collection_name: str = DEFAULT_COLLECTION):
         self.project_id = project_id
+        self.collection_name = collection_name
         self.persist_dir = os.path.join(persist_base_dir, project_id, "chroma")
         self.graph_image_path = os.path.join(persist_base_dir, project_id, "call_graph.png")
-        self.vectorstore = Chroma(
-            persist_directory=self.persist_dir,
-            embedding_function=OllamaEmbeddings(model=config.MODEL_NAME, base_url=config.OLLAMA_BASE_URL)
-        )
+        self.vectorstore = get_project_store(project_id, collection_name)
         self.existing_hashes = self._load_existing_hashes()
 
     def _hash_text(self, text: str) -> str:
@@ -36,9 +36,10 @@ class JavaProjectProcessor:
         except Exception:
             return set()
 
-    def parse_java_methods(self, file_path: str, file_content: str) -> List[Dict]:
+    def parse_java_methods(self, file_path: str, file_content: str, tree=None) -> List[Dict]:
         try:
-            tree = javalang.parse.parse(file_content)
+            if tree is None:
+                tree = javalang.parse.parse(file_content)
             lines = file_content.splitlines()
             methods = []
 
@@ -122,47 +123,67 @@ class JavaProjectProcessor:
         plt.close()
         print(f"📷 Saved call graph image to {self.graph_image_path}")
 
+    def method_document(self, file_name: str, rel_path: str, method: Dict) -> Document:
+        calls_str = "; ".join(method['calls']) if method['calls'] else "None"
+        return Document(
+            page_content=(
+                f"Method: {method['signature']}\n"
+                f"File: {file_name}\n"
+                f"Calls: {calls_str}\n"
+                f"Code:\n{method['body']}"
+            ),
+            metadata={
+                "source": file_name,
+                "path": rel_path,
+                "method": method['name'],
+                "signature": method['signature'],
+                "num_calls": len(method['calls']),
+                "start_line": method["start_line"],
+                "hash": method["hash"]
+            }
+        )
+
     def prepare_documents(self, enhanced_docs: List[Dict]) -> List[Document]:
         documents = []
         for doc in enhanced_docs:
             file_name = os.path.basename(doc["file"])
+            rel_path = project_relative_path(self.project_id, doc["file"])
             for method in doc["methods"]:
                 if method["hash"] in self.existing_hashes:
                     continue  # 🚫 Skip duplicate
-                calls_str = "; ".join(method['calls']) if method['calls'] else "None"
-                documents.append(Document(
-                    page_content=(
-                        f"Method: {method['signature']}\n"
-                        f"File: {file_name}\n"
-                        f"Calls: {calls_str}\n"
-                        f"Code:\n{method['body']}"
-                    ),
-                    metadata={
-                        "source": file_name,
-                        "method": method['name'],
-                        "signature": method['signature'],
-                        "num_calls": len(method['calls']),
-                        "hash": method["hash"]
-                    }
-                ))
+                documents.append(self.method_document(file_name, rel_path, method))
         return documents
 
     def process(self, java_file_paths: List[str]):
         print("🧠 Parsing Java files in parallel...")
         enhanced_docs = []
 
+        symbols = []
+
         def parse_worker(file_path):
             with open(file_path, "r", encoding="utf-8") as f:
                 content = f.read()
-            return {"file": file_path, "methods": self.parse_java_methods(file_path, content)}
+            try:
+                tree = javalang.parse.parse(content)
+            except Exception as e:
+                print(f"❌ Error parsing {file_path}: {e}")
+                return {"file": file_path, "methods": [], "symbols": []}
+            return {
+                "file": file_path,
+                "methods": self.parse_java_methods(file_path, content, tree),
+                "symbols": extract_java_symbols(self.project_id, file_path, tree)
+            }
 
         with ThreadPoolExecutor(max_workers=os.cpu_count() or 4) as executor:
             futures = [executor.submit(parse_worker, f) for f in java_file_paths]
             for future in as_completed(futures):
                 result = future.result()
+                symbols.extend(result["symbols"])
                 if result["methods"]:
                     enhanced_docs.append(result)
 
+        SymbolCatalogue(self.project_id).replace(symbols)
+
         call_graph = self.build_call_graph(enhanced_docs)
         print(f"✅ Built call graph with {len(call_graph.nodes)} methods")
         self.save_call_graph_image(call_graph)
@@ -178,23 +199,56 @@ class JavaProjectProcessor:
         self.vectorstore.add_documents(chunks)
         print(f"🚀 Embedded {len(chunks)} new code chunks into Chroma DB")
 
-    def process_full_file(self, file_path: str, content: str):
-        print(f"\n📥 Processing full file: {file_path}")
+    def _parse_or_none(self, file_path: str, content: str) -> Optional[List[Dict]]:
+        try:
+            tree = javalang.parse.parse(content)
+        except Exception as e:
+            print(f"❌ Error parsing {file_path}: {e}")
+            return None
+        return self.parse_java_methods(file_path, content, tree)
+
+    def process_changed_file(self, file_path: str, content: str, base_content: Optional[str] = None) -> Optional[Dict]:
+        """
+        Embed only the methods of a changed file whose body differs from the base version.
+
+        Returns the signatures of changed methods plus the hashes and signatures of the base
+        methods they replace or remove, or None if either version fails to parse.
+        """
+        methods = self._parse_or_none(file_path, content)
+        base_methods = [] if base_content is None else self._parse_or_none(file_path, base_content)
+        if methods is None or base_methods is None:
+            return None
+
+        base_hashes = {m["hash"] for m in base_methods}
+        feature_hashes = {m["hash"] for m in methods}
+        base_by_signature = {m["signature"]: m for m in base_methods}
+        changed = [m for m in methods if m["hash"] not in base_hashes]
+        replaced = [m for m in base_methods if m["hash"] not in feature_hashes]
+
         file_name = os.path.basename(file_path)
         file_hash = self._hash_text(content)
-
-        if file_hash in self.existing_hashes:
-            print(f"⏭️ Skipping {file_name}, already embedded.")
-            return
-
-        document = Document(
-            page_content=content,
-            metadata={"source": file_name, "hash": file_hash}
-        )
-
-        splitter = RecursiveCharacterTextSplitter(chunk_size=1024, chunk_overlap=10)
-        chunks = splitter.split_documents([document])
-        print(f"🪓 Split into {len(chunks)} chunk(s)")
-
-        self.vectorstore.add_documents(chunks)
-        print(f"🚀 Embedded and stored: {file_path}")
+        documents = []
+        for method in changed:
+            if method["hash"] in self.existing_hashes:
+                continue
+            document = self.method_document(file_name, file_path, method)
+            base_method = base_by_signature.get(method["signature"])
+            document.metadata.update({"file_hash": file_hash, "change": "modified" if base_method else "added"})
+            if base_method:
+                document.metadata["replaces"] = base_method["hash"]
+            documents.append(document)
+
+        if documents:
+            splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
+            chunks = splitter.split_documents(documents)
+            self.vectorstore.add_documents(chunks)
+            self.existing_hashes.update(m["hash"] for m in changed)
+            print(f"🚀 {file_name}: embedded {len(documents)} changed method(s) as {len(chunks)} chunk(s)")
+        else:
+            print(f"⏭️ {file_name}: no new method bodies to embed")
+
+        return {
+            "changed": [m["signature"] for m in changed],
+            "replaced": [m["signature"] for m in replaced],
+            "replaced_hashes": sorted({m["hash"] for m in replaced})
+        }
@@ -0,0 +1,173 @@
+import time
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from config import config
+
+# Lower value = served first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+PRIORITY_BACKGROUND = 2
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_BATCH: "batch", PRIORITY_BACKGROUND: "background"}
+
+ANONYMOUS_USER = "anonymous"
+
+_scheduler = None
+
+
+class QueueFullError(Exception):
+    """Raised when a request would wait behind more than LLM_MAX_QUEUE requests of its priority or higher."""
+
+    def __init__(self, priority: int, depth: int):
+        super().__init__(f"LLM queue is full ({depth} {PRIORITY_NAMES[priority]}-or-higher requests waiting)")
+        self.priority = priority
+        self.depth = depth
+
+
+class _Ticket:
+    def __init__(self, priority: int, user_id: str):
+        self.priority = priority
+        self.user_id = user_id
+        self.enqueued_at = time.time()
+        self.granted = False
+
+
+class LLMScheduler:
+    """
+    Admission control for every LLM generation call in the backend.
+
+    At most `max_concurrency` generations run at once. Waiting requests are served by priority
+    class (interactive before batch before background) and round-robin across users within a
+    class, so one user's 200-change VRT or 30-file batch cannot starve everyone else's questions.
+    A request is rejected with QueueFullError when `max_queue` requests of its priority or higher
+    are already waiting, unless the caller asks to wait regardless (background work).
+    """
+
+    def __init__(self, max_concurrency: int = config.LLM_MAX_CONCURRENCY, max_queue: int = config.LLM_MAX_QUEUE):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max_queue
+        self._cond = threading.Condition()
+        self._active: Dict[int, int] = {priority: 0 for priority in PRIORITY_NAMES}
+        # priority -> user -> waiting tickets; OrderedDict order is the round-robin rotation
+        self._waiting: Dict[int, "OrderedDict[str, deque]"] = {priority: OrderedDict() for priority in PRIORITY_NAMES}
+        self.counters = {"granted": 0, "rejected": 0, "cancelled": 0, "completed": 0}
+        self._wait_totals = {priority: [0, 0.0] for priority in PRIORITY_NAMES}  # count, seconds
+
+    def _active_count(self) -> int:
+        return sum(self._active.values())
+
+    def _depth(self, max_priority: int) -> int:
+        return sum(
+            len(tickets)
+            for priority, users in self._waiting.items() if priority <= max_priority
+            for tickets in users.values()
+        )
+
+    def _dispatch(self):
+        """Grant free slots to the next waiting tickets; caller holds the lock."""
+        granted_any = False
+        while self._active_count() < self.max_concurrency:
+            priority = next((p for p in sorted(self._waiting) if self._waiting[p]), None)
+            if priority is None:
+                break
+            users = self._waiting[priority]
+            user_id, tickets = next(iter(users.items()))
+            ticket = tickets.popleft()
+            users.pop(user_id)
+            if tickets:
+                users[user_id] = tickets  # back of the rotation
+            ticket.granted = True
+            self._active[priority] += 1
+            self.counters["granted"] += 1
+            wait_total = self._wait_totals[priority]
+            wait_total[0] += 1
+            wait_total[1] += time.time() - ticket.enqueued_at
+            granted_any = True
+        if granted_any:
+            self._cond.notify_all()
+
+    def _remove(self, ticket: _Ticket):
+        users = self._waiting[ticket.priority]
+        tickets = users.get(ticket.user_id)
+        if tickets is not None and ticket in tickets:
+            tickets.remove(ticket)
+            if not tickets:
+                users.pop(ticket.user_id)
+
+    def check_admission(self, priority: int = PRIORITY_INTERACTIVE):
+        """Raise QueueFullError if a request of this priority would be rejected right now."""
+        with self._cond:
+            if self._active_count() < self.max_concurrency:
+                return
+            depth = self._depth(priority)
+            if depth >= self.max_queue:
+                self.counters["rejected"] += 1
+                raise QueueFullError(priority, depth)
+
+    def acquire(self, priority: int = PRIORITY_INTERACTIVE, user_id: Optional[str] = None,
+                cancel_event=None, wait_when_full: bool = False) -> Optional[_Ticket]:
+        """Block until a generation slot is granted; returns None if `cancel_event` is set while waiting."""
+        ticket = _Ticket(priority, user_id or ANONYMOUS_USER)
+        with self._cond:
+            if not wait_when_full and self._active_count() >= self.max_concurrency:
+                depth = self._depth(priority)
+                if depth >= self.max_queue:
+                    self.counters["rejected"] += 1
+                    raise QueueFullError(priority, depth)
+
+            self._waiting[priority].setdefault(ticket.user_id, deque()).append(ticket)
+            self._dispatch()
+            while not ticket.granted:
+                if cancel_event is not None and cancel_event.is_set():
+                    self._remove(ticket)
+                    self.counters["cancelled"] += 1
+                    return None
+                self._cond.wait(timeout=0.5)
+        return ticket
+
+    def release(self, ticket: _Ticket):
+        with self._cond:
+            self._active[ticket.priority] -= 1
+            self.counters["completed"] += 1
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, priority: int = PRIORITY_INTERACTIVE, user_id: Optional[str] = None,
+             cancel_event=None, wait_when_full: bool = False):
+        """Hold a generation slot for the duration of the block; yields None if cancelled while queued."""
+        ticket = self.acquire(priority, user_id, cancel_event, wait_when_full)
+        try:
+            yield ticket
+        finally:
+            if ticket is not None:
+                self.release(ticket)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "max_concurrency": self.max_concurrency,
+                "max_queue": self.max_queue,
+                "active": {PRIORITY_NAMES[p]: n for p, n in self._active.items()},
+                "queue_depth": {
+                    PRIORITY_NAMES[p]: sum(len(tickets) for tickets in users.values())
+                    for p, users in self._waiting.items()
+                },
+                "waiting_by_user": {
+                    PRIORITY_NAMES[p]: {user_id: len(tickets) for user_id, tickets in users.items()}
+                    for p, users in self._waiting.items() if users
+                },
+                "avg_wait_seconds": {
+                    PRIORITY_NAMES[p]: round(total / count, 3) if count else 0.0
+                    for p, (count, total) in self._wait_totals.items()
+                },
+                **self.counters
+            }
+
+
+def get_llm_scheduler() -> LLMScheduler:
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = LLMScheduler()
+    return _scheduler
@@ -0,0 +1,95 @@
+import threading
+import time
+from typing import Dict, List
+
+import requests
+
+from config import config
+
+OLLAMA_URL = config.OLLAMA_BASE_URL.rstrip("/")
+
+_warmup_state = {"started_at": None, "finished_at": None, "results": {}}
+
+
+def _warm_generation_model(model: str) -> dict:
+    # An empty prompt makes Ollama load the model without generating anything
+    response = requests.post(
+        f"{OLLAMA_URL}/api/generate",
+        json={"model": model, "prompt": "", "stream": False, "keep_alive": config.OLLAMA_KEEP_ALIVE},
+        timeout=300
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+def _warm_embedding_model(model: str) -> dict:
+    response = requests.post(
+        f"{OLLAMA_URL}/api/embed",
+        json={"model": model, "input": "warm-up", "keep_alive": config.OLLAMA_KEEP_ALIVE},
+        timeout=300
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+def warm_up_models() -> Dict[str, dict]:
+    """Load the configured embedding and generation models into Ollama memory."""
+    _warmup_state["started_at"] = time.time()
+    targets = [
+        ("embedding", config.EMBEDDING_MODEL_NAME, _warm_embedding_model),
+        ("generation", config.GENERATION_MODEL_NAME, _warm_generation_model),
+    ]
+
+    results = {}
+    for role, model, warm in targets:
+        start = time.time()
+        try:
+            warm(model)
+            results[role] = {"model": model, "status": "ready", "load_seconds": round(time.time() - start, 2)}
+            print(f"🔥 Warmed {role} model {model} in {time.time() - start:.1f}s")
+        except Exception as e:
+            results[role] = {"model": model, "status": "error", "error": str(e)}
+            print(f"⚠️ Could not warm {role} model {model}: {e}")
+
+    _warmup_state["results"] = results
+    _warmup_state["finished_at"] = time.time()
+    return results
+
+
+def start_model_warmup():
+    """Warm models in a daemon thread so server startup is not blocked on model loads."""
+    thread = threading.Thread(target=warm_up_models, daemon=True)
+    thread.start()
+    print("🔄 Started Ollama model warm-up")
+
+
+def list_loaded_models() -> List[dict]:
+    response = requests.get(f"{OLLAMA_URL}/api/ps", timeout=10)
+    response.raise_for_status()
+    return response.json().get("models", [])
+
+
+def get_model_residency() -> dict:
+    """Report whether the configured models are currently loaded in Ollama and until when."""
+    loaded = {m.get("name"): m for m in list_loaded_models()}
+
+    def describe(model: str) -> dict:
+        info = loaded.get(model)
+        if info is None:
+            return {"model": model, "loaded": False}
+        return {
+            "model": model,
+            "loaded": True,
+            "size": info.get("size"),
+            "size_vram": info.get("size_vram"),
+            "expires_at": info.get("expires_at"),
+        }
+
+    return {
+        "embedding": describe(config.EMBEDDING_MODEL_NAME),
+        "generation": describe(config.GENERATION_MODEL_NAME),
+        "keep_alive_seconds": config.OLLAMA_KEEP_ALIVE,
+        "other_loaded_models": [name for name in loaded
+                                if name not in (config.EMBEDDING_MODEL_NAME, config.GENERATION_MODEL_NAME)],
+        "warmup": _warmup_state,
+    }
@@ -0,0 +1,218 @@
+import io
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from config import config
+
+# Largest possible YIQ colour delta (black vs white); tolerances are fractions of it, as in pixelmatch
+MAX_YIQ_DELTA = 35215.0
+
+NEIGHBOUR_OFFSETS = [(dy, dx) for dy in (-1, 0, 1) for dx in (-1, 0, 1) if (dy, dx) != (0, 0)]
+
+CHANGED_COLOUR = (255, 0, 0)
+ANTIALIASED_COLOUR = (255, 255, 0)
+REGION_OUTLINE_COLOUR = (255, 0, 255)
+
+
+@dataclass
+class PixelDiffResult:
+  width: int
+  height: int
+  dimensions_match: bool
+  changed_pixels: int
+  antialiased_pixels: int
+  mismatch_percentage: float
+  passed: bool
+  regions: List[Dict] = field(default_factory=list)
+  diff_image: bytes = b""
+
+  def to_dict(self) -> dict:
+    """JSON-friendly summary; the diff image travels separately as PNG bytes."""
+    return {
+      "width": self.width,
+      "height": self.height,
+      "dimensions_match": self.dimensions_match,
+      "changed_pixels": self.changed_pixels,
+      "antialiased_pixels": self.antialiased_pixels,
+      "mismatch_percentage": self.mismatch_percentage,
+      "passed": self.passed,
+      "regions": self.regions
+    }
+
+
+def load_rgb(png: bytes, height: int = None, width: int = None) -> np.ndarray:
+  """Decode a PNG, composite it over white and pad it (with white) to height × width."""
+  rgba = np.asarray(Image.open(io.BytesIO(png)).convert("RGBA"), dtype=np.float32)
+  alpha = rgba[..., 3:4] / 255.0
+  rgb = 255.0 + (rgba[..., :3] - 255.0) * alpha
+  if height is None:
+    return rgb
+  padded = np.full((height, width, 3), 255.0, dtype=np.float32)
+  padded[:rgb.shape[0], :rgb.shape[1]] = rgb
+  return padded
+
+
+def yiq(rgb: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+  r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+  y = r * 0.29889531 + g * 0.58662247 + b * 0.11448223
+  i = r * 0.59597799 - g * 0.27417610 - b * 0.32180189
+  q = r * 0.21147017 - g * 0.52261711 + b * 0.31114694
+  return y, i, q
+
+
+def _edge_profile(luma: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+  """
+  Per pixel: whether it sits between a darker and a brighter neighbour with fewer than three
+  equal neighbours (pixelmatch's anti-aliasing precondition), plus its 3×3 luminance range.
+  """
+  equal = np.zeros(luma.shape, dtype=np.uint8)
+  darker = np.zeros(luma.shape, dtype=bool)
+  brighter = np.zeros(luma.shape, dtype=bool)
+  low, high = luma.copy(), luma.copy()
+  # Edge-padded once; each neighbour is then a shifted view, repeating edge pixels at the border
+  padded = np.pad(luma, 1, mode="edge")
+  h, w = luma.shape
+  for dy, dx in NEIGHBOUR_OFFSETS:
+    neighbour = padded[1 + dy:1 + dy + h, 1 + dx:1 + dx + w]
+    equal += neighbour == luma
+    darker |= neighbour < luma
+    brighter |= neighbour > luma
+    np.minimum(low, neighbour, out=low)
+    np.maximum(high, neighbour, out=high)
+  return (equal < 3) & darker & brighter, low, high
+
+
+def antialiasing_mask(base_luma: np.ndarray, test_luma: np.ndarray, changed: np.ndarray) -> np.ndarray:
+  """
+  Changed pixels that look like anti-aliasing: an intermediate edge pixel in one image whose value
+  in the other image still lies within that image's local 3×3 range (i.e. a sub-pixel edge shift).
+  """
+  base_edge, base_low, base_high = _edge_profile(base_luma)
+  test_edge, test_low, test_high = _edge_profile(test_luma)
+  test_within_base = (test_luma >= base_low) & (test_luma <= base_high)
+  base_within_test = (base_luma >= test_low) & (base_luma <= test_high)
+  return changed & ((base_edge & test_within_base) | (test_edge & base_within_test))
+
+
+def changed_regions(mask: np.ndarray, block: int = config.PIXEL_DIFF_REGION_BLOCK,
+                    max_regions: int = config.PIXEL_DIFF_MAX_REGIONS) -> List[Dict]:
+  """
+  Bounding boxes of connected changed areas, largest first.
+
+  Pixels are grouped into `block`-sized cells first, so changes less than a block apart merge into
+  one region and the flood fill runs over cells rather than pixels.
+  """
+  h, w = mask.shape
+  grid_h, grid_w = -(-h // block), -(-w // block)
+  padded = np.zeros((grid_h * block, grid_w * block), dtype=bool)
+  padded[:h, :w] = mask
+  grid = padded.reshape(grid_h, block, grid_w, block).any(axis=(1, 3))
+
+  seen = np.zeros_like(grid)
+  regions = []
+  for start_y, start_x in zip(*np.nonzero(grid)):
+    if seen[start_y, start_x]:
+      continue
+    seen[start_y, start_x] = True
+    queue = deque([(start_y, start_x)])
+    y0 = y1 = start_y
+    x0 = x1 = start_x
+    while queue:
+      cy, cx = queue.popleft()
+      y0, y1, x0, x1 = min(y0, cy), max(y1, cy), min(x0, cx), max(x1, cx)
+      for dy, dx in NEIGHBOUR_OFFSETS:
+        ny, nx = cy + dy, cx + dx
+        if 0 <= ny < grid_h and 0 <= nx < grid_w and grid[ny, nx] and not seen[ny, nx]:
+          seen[ny, nx] = True
+          queue.append((ny, nx))
+
+    top, left = y0 * block, x0 * block
+    area = mask[top:min(h, (y1 + 1) * block), left:min(w, (x1 + 1) * block)]
+    rows = np.nonzero(area.any(axis=1))[0]
+    cols = np.nonzero(area.any(axis=0))[0]
+    regions.append({
+      "x": int(left + cols[0]),
+      "y": int(top + rows[0]),
+      "width": int(cols[-1] - cols[0] + 1),
+      "height": int(rows[-1] - rows[0] + 1),
+      "pixels": int(area.sum())
+    })
+
+  regions.sort(key=lambda region: region["pixels"], reverse=True)
+  return regions[:max_regions]
+
+
+def render_diff_image(base_luma: np.ndarray, changed: np.ndarray, antialiased: np.ndarray,
+                      regions: List[Dict]) -> bytes:
+  """Faded grayscale base with changed pixels in red, anti-aliasing in yellow and region outlines."""
+  faded = (255.0 + (base_luma - 255.0) * 0.1).clip(0, 255).astype(np.uint8)
+  canvas = np.repeat(faded[..., None], 3, axis=2)
+  canvas[antialiased] = ANTIALIASED_COLOUR
+  canvas[changed] = CHANGED_COLOUR
+
+  image = Image.fromarray(canvas, "RGB")
+  draw = ImageDraw.Draw(image)
+  for region in regions:
+    draw.rectangle(
+      [region["x"], region["y"], region["x"] + region["width"] - 1, region["y"] + region["height"] - 1],
+      outline=REGION_OUTLINE_COLOUR
+    )
+  buffer = io.BytesIO()
+  image.save(buffer, format="PNG")
+  return buffer.getvalue()
+
+
+def compare_screenshots(base_png: bytes, test_png: bytes, tolerance: float = config.PIXEL_DIFF_TOLERANCE,
+                        mismatch_threshold: float = config.PIXEL_DIFF_MISMATCH_THRESHOLD,
+                        ignore_antialiasing: bool = True) -> PixelDiffResult:
+  """
+  Compare two PNG screenshots pixel by pixel.
+
+  A pixel differs when its YIQ colour delta exceeds `tolerance` (0-1, fraction of the largest
+  possible delta). Screenshots of different sizes are compared on the larger canvas, so the
+  uncovered area counts as changed. The run passes when the mismatch percentage is at most
+  `mismatch_threshold` and the dimensions match.
+  """
+  base_size = Image.open(io.BytesIO(base_png)).size
+  test_size = Image.open(io.BytesIO(test_png)).size
+  width, height = max(base_size[0], test_size[0]), max(base_size[1], test_size[1])
+  base_rgb = load_rgb(base_png, height, width)
+  test_rgb = load_rgb(test_png, height, width)
+
+  base_y, base_i, base_q = yiq(base_rgb)
+  test_y, test_i, test_q = yiq(test_rgb)
+  delta = 0.5053 * (base_y - test_y) ** 2 + 0.299 * (base_i - test_i) ** 2 + 0.1957 * (base_q - test_q) ** 2
+  different = delta > MAX_YIQ_DELTA * tolerance * tolerance
+  # Canvas only one screenshot covers is a change even where the padding colour happens to match
+  uncovered = np.zeros_like(different)
+  uncovered[min(base_size[1], test_size[1]):, :] = True
+  uncovered[:, min(base_size[0], test_size[0]):] = True
+  different |= uncovered
+
+  if ignore_antialiasing:
+    antialiased = antialiasing_mask(base_y, test_y, different) & ~uncovered
+    changed = different & ~antialiased
+  else:
+    antialiased = np.zeros_like(different)
+    changed = different
+
+  changed_pixels = int(changed.sum())
+  mismatch_percentage = round(changed_pixels / float(width * height) * 100, 4)
+  dimensions_match = base_size == test_size
+  regions = changed_regions(changed)
+
+  return PixelDiffResult(
+    width=width,
+    height=height,
+    dimensions_match=dimensions_match,
+    changed_pixels=changed_pixels,
+    antialiased_pixels=int(antialiased.sum()),
+    mismatch_percentage=mismatch_percentage,
+    passed=dimensions_match and mismatch_percentage <= mismatch_threshold,
+    regions=regions,
+    diff_image=render_diff_image(base_y, changed, antialiased, regions)
+  )
@@ -1,17 +1,51 @@
 import os
 import json
-from difflib import unified_diff
-from typing import Dict
+import shutil
+import hashlib
+from typing import Dict, List, Tuple
 
 from git import Repo
-from app.utils import detect_project_type
+from langchain_core.documents import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from config import config
+from app.utils import detect_project_type, get_project_embedding_model, needs_reembed, read_project_metadata
 from app.react_processor import ReactProjectProcessor
 from app.java_processor import JavaProjectProcessor
+from app.vector_store import invalidate_project_store, refresh_project_store
+from app.feature_overlay import OVERLAY_DIR, FeatureOverlay, list_feature_overlays
+from app.diff_service import detect_default_branch, hunk_windows
+
+
+def babel_script_path() -> str:
+    path = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "babelParser.js"))
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"❌ babelParser.js not found at: {path}")
+    return path
+
+
+def reset_project_vectors(project_id: str):
+    """
+    Delete a project's Chroma data. Feature overlay collections live in it too, so their manifests
+    are removed with it; otherwise the overlays would look present while serving base-only context.
+    """
+    overlays = list_feature_overlays(project_id)
+    invalidate_project_store(project_id)
+    shutil.rmtree(os.path.join(config.CHROMA_DIR, project_id, "chroma"), ignore_errors=True)
+    shutil.rmtree(os.path.join(config.CHROMA_DIR, project_id, OVERLAY_DIR), ignore_errors=True)
+    if overlays:
+        print(f"🗑️ Dropped {len(overlays)} feature overlay(s) of {project_id}; upload the branches again to rebuild them")
+
+
+def process_project(project_path: str, git_url: str, project_id: str, rebuild: bool = False):
+    # Vectors from another embedding model live in a different space; drop them so everything is re-embedded
+    if needs_reembed(project_path):
+        print(f"♻️ Embedding model changed ({get_project_embedding_model(project_path)} → "
+              f"{config.EMBEDDING_MODEL_NAME}), re-embedding {project_id}")
+        rebuild = True
+    # Ingestion skips hashes already stored, so chunk metadata is only rewritten from scratch
+    if rebuild:
+        reset_project_vectors(project_id)
 
-
-from git import Repo
-
-def process_project(project_path: str, git_url: str, project_id: str):
     print(f"\n🔍 Detecting project type in: {project_path}")
     project_type = detect_project_type(project_path)
     print(f"📦 Detected project type: {project_type}")
@@ -32,15 +66,9 @@ def process_project(project_path: str, git_url: str, project_id: str):
         print("✅ Java project processed.")
 
     elif project_type == "react":
-        babel_script_path = os.path.abspath(
-            os.path.join(os.path.dirname(__file__), "..", "babelParser.js")
-        )
-        if not os.path.exists(babel_script_path):
-            raise FileNotFoundError(f"❌ babelParser.js not found at: {babel_script_path}")
-
         processor = ReactProjectProcessor(
             project_id=project_id,
-            babel_script_path=babel_script_path
+            babel_script_path=babel_script_path()
         )
         processor.process(react_project_path=project_path)
         print("✅ React project processed.")
@@ -48,11 +76,11 @@ def process_project(project_path: str, git_url: str, project_id: str):
     else:
         raise Exception(f"❌ Unsupported project type in: {project_path}")
 
+    refresh_project_store(project_id)
+
     # 🔍 Detect remote default branch from origin/HEAD
     try:
-        repo = Repo(project_path)
-        default_ref = repo.git.symbolic_ref("refs/remotes/origin/HEAD")
-        main_branch = default_ref.split("/")[-1]  # e.g., 'main' or 'master'
+        main_branch = detect_default_branch(Repo(project_path))  # e.g., 'main' or 'master'
     except Exception as e:
         print(f"⚠️ Could not detect remote default branch: {e}")
         main_branch = "main"
@@ -62,59 +90,128 @@ def process_project(project_path: str, git_url: str, project_id: str):
 
 
 
-def get_file_diff(repo: Repo, file_path: str) -> str:
-    try:
-        full_path = os.path.abspath(file_path)
-        rel_path = os.path.relpath(full_path, repo.working_tree_dir).replace("\\", "/")
-        print(f"⚠️ Changed File: {rel_path}")
-
-        try:
-            old = repo.git.show(f"main:{rel_path}").splitlines(keepends=True)
-        except Exception:
-            print(f"⚠️ File {rel_path} not in 'main' branch. Treating as new file.")
-            old = []
-
-        with open(full_path, encoding="utf-8") as f:
-            new = f.read().splitlines(keepends=True)
-
-        diff = list(unified_diff(old, new, fromfile=f"main/{rel_path}", tofile=f"feature/{rel_path}"))
-        return "".join(diff)
-
-    except Exception as e:
-        print(f"❌ Failed to generate diff for {file_path}: {e}")
-        return ""
-
-
-def process_project_diff(file_content_map: Dict[str, str], project_id: str):
-    java_files = {f: c for f, c in file_content_map.items() if f.endswith(".java")}
-    react_files = {f: c for f, c in file_content_map.items() if f.endswith((".js", ".jsx", ".ts", ".tsx"))}
-
-    if java_files:
-        print(f"🔍 Java files changed: {len(java_files)}")
-        processor = JavaProjectProcessor(project_id=project_id)
-        for file_path, content in java_files.items():
-            print(f"📄 Embedding Java: {file_path}")
-            processor.process_full_file(file_path, content)
-
-    if react_files:
-        print(f"🔍 React files changed: {len(react_files)}")
-        babel_script_path = os.path.abspath(
-            os.path.join(os.path.dirname(__file__), "..", "babelParser.js")
+def embed_hunk_windows(overlay: FeatureOverlay, rel_path: str, content: str, ranges: List[Tuple[int, int]]):
+    """Embed only the changed regions of a modified file, each padded with surrounding lines."""
+    file_name = os.path.basename(rel_path)
+    content_hash = hashlib.sha256(content.encode("utf-8")).hexdigest()
+    documents = [
+        Document(
+            page_content=f"File: {file_name}\nChanged lines {start}-{end}:\n{text}",
+            metadata={"source": file_name, "path": rel_path, "hash": content_hash, "file_hash": content_hash,
+                      "start_line": start, "end_line": end, "kind": "hunk"}
         )
-        if not os.path.exists(babel_script_path):
-            raise FileNotFoundError(f"babelParser.js not found at {babel_script_path}")
-
-        processor = ReactProjectProcessor(project_id=project_id, babel_script_path=babel_script_path)
-        for file_path, content in react_files.items():
-            print(f"📄 Embedding React: {file_path}")
-            processor.process_full_file(file_path, content)
+        for start, end, text in hunk_windows(content, ranges)
+    ]
+    if not documents:
+        return
+
+    splitter = RecursiveCharacterTextSplitter(chunk_size=1024, chunk_overlap=10)
+    chunks = splitter.split_documents(documents)
+    overlay.store.add_documents(chunks)
+    print(f"🚀 Embedded {len(chunks)} hunk chunk(s) for {rel_path}")
+
+
+def process_project_diff(changes: List[Dict], feature_id: str):
+    """
+    Embed a feature branch's changes into its overlay on top of the base project index.
+
+    `changes` comes from BranchDiffService.load_changes. Added and modified files are parsed into
+    methods/components and only those whose body hash differs from the base version are embedded;
+    the base methods they replace are tombstoned by hash. Files that fail to parse, or whose
+    changes touch no method/component body, fall back to hunk windows, and deleted files are
+    tombstoned by repo-relative path.
+    """
+    overlay = FeatureOverlay.from_feature_id(feature_id)
+    if overlay is None:
+        raise ValueError(f"Not a feature id: {feature_id}")
+    overlay.reset_tombstones()
+
+    # Drop chunks of files no longer changed and of older revisions first, so the processors'
+    # known hashes reflect what stays
+    changed_paths = [change["path"] for change in changes if change["status"] != "D"]
+    overlay.prune_paths(changed_paths)
+    already_embedded = {}
+    for change in changes:
+        if change["status"] != "D":
+            content_hash = hashlib.sha256(change["feature_content"].encode("utf-8")).hexdigest()
+            already_embedded[change["path"]] = overlay.drop_stale_chunks(change["path"], content_hash)
+
+    processors = {}
+
+    def processor_for(rel_path: str):
+        kind = "java" if rel_path.endswith(".java") else "react"
+        if kind not in processors:
+            if kind == "java":
+                processors[kind] = JavaProjectProcessor(project_id=overlay.project_id,
+                                                        collection_name=overlay.collection_name)
+            else:
+                processors[kind] = ReactProjectProcessor(
+                    project_id=overlay.project_id,
+                    babel_script_path=babel_script_path(),
+                    collection_name=overlay.collection_name
+                )
+        return processors[kind]
+
+    deleted_paths = []
+    for change in changes:
+        rel_path = change["path"]
+        if change["status"] == "D":
+            deleted_paths.append(rel_path)
+            # The path tombstone hides chunks that carry a path; older indexes are matched by hash
+            if change["base_content"] is not None:
+                overlay.tombstone_changed_base_chunks(rel_path, "", change["base_content"])
+            continue
+
+        content, base_content = change["feature_content"], change["base_content"]
+        print(f"📄 Embedding changed units of {rel_path}")
+        result = processor_for(rel_path).process_changed_file(rel_path, content, base_content)
+
+        if result is not None:
+            overlay.add_tombstones(hashes=result["replaced_hashes"])
+            overlay.record_replaced(rel_path, result["replaced"])
+            print(f"🪦 {rel_path}: {len(result['changed'])} changed, {len(result['replaced'])} base unit(s) replaced")
+            if result["changed"]:
+                continue
+            # Field, import or annotation edits (and interfaces, DTOs, enums...) change no method or
+            # component body, so the changed lines themselves are what the file contributes
+            print(f"ℹ️ {rel_path}: no method/component body changed, embedding hunk windows")
+        else:
+            print(f"⚠️ Could not parse {rel_path}, falling back to hunk windows")
+            if base_content is not None:
+                removed = overlay.tombstone_changed_base_chunks(rel_path, content, base_content)
+                print(f"🪦 {rel_path}: {removed} base chunk(s) replaced")
+
+        if already_embedded[rel_path]:
+            print(f"⏭️ Skipping {rel_path}, already embedded.")
+        else:
+            embed_hunk_windows(overlay, rel_path, content, change["changed_ranges"])
+
+    overlay.record_files(changed_paths)
+    overlay.add_tombstones(paths=deleted_paths)
+    overlay.save()
+    refresh_project_store(overlay.project_id)
+
+
+def reembed_project(project_id: str):
+    """
+    Rebuild a project's vectors with the configured embedding model from its existing clone.
+
+    Always starts from an empty collection, so chunks also get metadata added since they were
+    embedded (e.g. repo-relative paths). Feature overlays are dropped and need a new upload.
+    """
+    project_path = os.path.join(config.CHROMA_DIR, project_id)
+    metadata = read_project_metadata(project_path)
+    if not metadata:
+        raise FileNotFoundError(f"No metadata.json found for project: {project_id}")
+    process_project(project_path, metadata.get("git_url", "unknown"), project_id, rebuild=True)
 
 
 def write_project_metadata(project_path: str, git_url: str, project_type: str, main_branch: str):
     metadata = {
         "git_url": git_url,
         "project_type": project_type,
-        "main_branch": main_branch
+        "main_branch": main_branch,
+        "embedding_model": config.EMBEDDING_MODEL_NAME
     }
     with open(os.path.join(project_path, "metadata.json"), "w", encoding="utf-8") as f:
         json.dump(metadata, f, indent=2)
@@ -2,17 +2,22 @@ import os
 import re
 import concurrent.futures
 from functools import lru_cache
-from typing import List
+from typing import List, Optional
 import time
 
 from langchain.prompts import PromptTemplate
 from langchain.chains import RetrievalQA
 from langchain_core.callbacks import StreamingStdOutCallbackHandler
-from langchain_community.vectorstores import Chroma
+from langchain_core.documents import Document
 from langchain_ollama import OllamaEmbeddings, OllamaLLM
+from app.vector_store import get_project_store, get_source_documents
+from app.symbol_catalogue import answer_listing_question, catalogue_context
+from app.feature_overlay import FeatureOverlay
+from app.llm_scheduler import PRIORITY_BATCH, PRIORITY_INTERACTIVE, QueueFullError, get_llm_scheduler
 from config import config
 
 PROMPT_DIR = "./prompts"
+PARTIAL_ANSWER_NOTE = "\n\n_(Answer truncated: generation was cancelled.)_"
 
 def clean_mermaid_response(response: str) -> str:
     """Remove markdown code block formatting from mermaid responses using regex."""
@@ -68,6 +73,60 @@ def smart_document_retrieval(question: str, max_docs: int) -> int:
     
     return min(max_docs, max(18, int(max_docs * 0.6)))
 
+def find_relevance_cutoff(distances: List[float]) -> tuple:
+    """Return (index, reason) where similarity falls off, or (None, None) if scores stay close together."""
+    if len(distances) < 2:
+        return None, None
+
+    best = max(distances[0], 1e-6)
+    for i in range(1, len(distances)):
+        if distances[i] > best * config.ADAPTIVE_SCORE_RATIO:
+            return i, "score_threshold"
+        if distances[i] - distances[i - 1] > best * config.ADAPTIVE_SCORE_GAP:
+            return i, "score_gap"
+    return None, None
+
+def adaptive_document_retrieval(db, question: str) -> tuple:
+    """
+    Fetch candidates in growing batches until similarity drops off.
+
+    Chroma returns distances (lower is closer), so the cut happens where a distance
+    jumps relative to the best match. Returns the kept documents and retrieval stats.
+    """
+    query_embedding = get_embeddings().embed_query(question)
+    min_docs = config.ADAPTIVE_MIN_DOCS
+    max_docs = config.ADAPTIVE_MAX_DOCS
+
+    k = min(config.ADAPTIVE_BATCH_SIZE, max_docs)
+    rounds = 0
+    while True:
+        rounds += 1
+        results = db.similarity_search_by_vector_with_relevance_scores(query_embedding, k=k)
+        distances = [score for _, score in results]
+
+        cutoff, stop_reason = find_relevance_cutoff(distances)
+        if cutoff is not None:
+            used = max(cutoff, min(min_docs, len(results)))
+            break
+        if len(results) < k:
+            used, stop_reason = len(results), "exhausted"
+            break
+        if k >= max_docs:
+            used, stop_reason = len(results), "max_docs"
+            break
+        k = min(k * 2, max_docs)
+
+    stats = {
+        "mode": "adaptive",
+        "rounds": rounds,
+        "candidates_fetched": len(results),
+        "docs_used": used,
+        "stop_reason": stop_reason,
+        "best_distance": round(distances[0], 4) if distances else None,
+        "cutoff_distance": round(distances[used - 1], 4) if used else None,
+    }
+    return [doc for doc, _ in results[:used]], stats
+
 def optimize_context_for_question(question: str, retrieved_docs: List, max_context_docs: int = None) -> List:
     """Filter and rank retrieved documents for better accuracy."""
     if not retrieved_docs or len(retrieved_docs) <= 10:
@@ -107,8 +166,20 @@ def optimize_context_for_question(question: str, retrieved_docs: List, max_conte
     
     return [doc for doc, score in scored_docs]
 
+def ensure_current_embeddings(project_id: str):
+    """Refuse to query a project whose vectors came from a different embedding model."""
+    from app.utils import get_project_embedding_model, needs_reembed
+
+    project_path = os.path.join(config.CHROMA_DIR, project_id)
+    if needs_reembed(project_path):
+        raise ValueError(
+            f"Project {project_id} was embedded with {get_project_embedding_model(project_path)} "
+            f"but {config.EMBEDDING_MODEL_NAME} is configured. Call /reembed to migrate it."
+        )
+
 def prepare_components_parallel(project_id: str, prompt_type: str, question: str, max_docs: int):
     """Prepare components in parallel for faster processing."""
+    ensure_current_embeddings(project_id)
     with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
         prompt_future = executor.submit(load_prompt_template, prompt_type)
         db_future = executor.submit(get_chroma_db, project_id)
@@ -116,11 +187,18 @@ def prepare_components_parallel(project_id: str, prompt_type: str, question: str
         prompt = prompt_future.result()
         db = db_future.result()
     
-    optimal_docs = smart_document_retrieval(question, max_docs)
-    retriever = db.as_retriever(search_kwargs={"k": optimal_docs})
     llm = get_llm(streaming=True)
     
-    return prompt, retriever, llm, optimal_docs
+    return prompt, db, llm
+
+def retrieve_documents(db, question: str, max_docs: int, retrieval_mode: str) -> tuple:
+    """Retrieve context documents plus stats describing how many were used."""
+    if retrieval_mode == "adaptive":
+        return adaptive_document_retrieval(db, question)
+
+    optimal_docs = smart_document_retrieval(question, max_docs)
+    docs = db.similarity_search(question, k=optimal_docs)
+    return docs, {"mode": "fixed", "candidates_fetched": len(docs), "docs_used": len(docs)}
 
 @lru_cache(maxsize=10)
 def load_prompt_template(prompt_type: str) -> PromptTemplate:
@@ -133,54 +211,113 @@ def load_prompt_template(prompt_type: str) -> PromptTemplate:
 
 @lru_cache(maxsize=1)
 def get_embeddings():
-    return OllamaEmbeddings(model=config.MODEL_NAME)
+    return OllamaEmbeddings(
+        model=config.EMBEDDING_MODEL_NAME,
+        base_url=config.OLLAMA_BASE_URL,
+        keep_alive=config.OLLAMA_KEEP_ALIVE
+    )
 
-@lru_cache(maxsize=20)
 def get_chroma_db(project_id: str):
-    return Chroma(
-        persist_directory=f"{config.CHROMA_DIR}/{project_id}/chroma",
-        embedding_function=get_embeddings()
-    )
+    """Vector store for a project, or the merged base + overlay view for a feature id."""
+    overlay = FeatureOverlay.from_feature_id(project_id)
+    if overlay is not None and overlay.exists():
+        return overlay
+    return get_project_store(project_id)
 
 @lru_cache(maxsize=2)
 def get_llm(streaming: bool = False):
     if streaming:
         return OllamaLLM(
-            model=config.MODEL_NAME,
+            model=config.GENERATION_MODEL_NAME,
+            base_url=config.OLLAMA_BASE_URL,
+            keep_alive=config.OLLAMA_KEEP_ALIVE,
             temperature=config.TEMPERATURE,
             streaming=True,
             callbacks=[StreamingStdOutCallbackHandler()]
         )
     return OllamaLLM(
-        model=config.MODEL_NAME,
+        model=config.GENERATION_MODEL_NAME,
+        base_url=config.OLLAMA_BASE_URL,
+        keep_alive=config.OLLAMA_KEEP_ALIVE,
         temperature=config.TEMPERATURE
     )
 
-def answer_question_stream(project_id, question, max_docs, prompt_type):
-    """Core Q&A function with caching integration."""
+def llm_slot(priority: int = PRIORITY_INTERACTIVE, user_id: str = None, cancel_event=None):
+    """Scheduler slot for one generation; interactive requests are rejected when the queue is full, others wait."""
+    return get_llm_scheduler().slot(priority, user_id, cancel_event, wait_when_full=priority != PRIORITY_INTERACTIVE)
+
+
+def stream_llm(llm, prompt: str, cancel_event=None, priority: int = PRIORITY_INTERACTIVE, user_id: str = None):
+    """Yield tokens from `llm.stream` inside a scheduler slot, closing the Ollama request once `cancel_event` is set."""
+    with llm_slot(priority, user_id, cancel_event) as ticket:
+        if ticket is None:
+            print("🛑 Generation cancelled while queued for the LLM")
+            return
+        stream = llm.stream(prompt)
+        try:
+            for token in stream:
+                if cancel_event is not None and cancel_event.is_set():
+                    print("🛑 Generation cancelled, closing LLM stream")
+                    return
+                yield token
+        finally:
+            stream.close()
+
+
+def answer_question_stream(project_id, question, max_docs, prompt_type, retrieval_mode="adaptive", stats=None,
+                           cancel_event=None, priority=PRIORITY_INTERACTIVE, user_id=None):
+    """
+    Core Q&A function with caching integration.
+
+    If a ``stats`` dict is passed it is filled with retrieval stats before the first token is yielded.
+    Setting ``cancel_event`` stops generation at the next token; whether the partial answer is
+    cached is governed by config.CACHE_PARTIAL_ANSWERS. Generation is admitted through the LLM
+    scheduler under ``priority`` on behalf of ``user_id``.
+    """
+    if stats is None:
+        stats = {}
     start_time = time.time()
     
     from app.utils import check_cache, store_cache_response
+
+    # Enumeration questions ("List all REST API endpoints") are answered from the symbol catalogue
+    if prompt_type != "flowchart_prompt":
+        listing_answer = answer_listing_question(project_id, question)
+        if listing_answer:
+            stats.update({"mode": "catalogue", "docs_used": 0})
+            print(f"📋 Response time: {time.time() - start_time:.3f}s (symbol catalogue)")
+            yield listing_answer
+            return
     
     cached_response = check_cache(project_id, question)
     if cached_response:
+        stats.update({"mode": "cached", "docs_used": 0})
         print(f"📋 Response time: {time.time() - start_time:.3f}s (cached)")
         yield from stream_cached_response(cached_response)
         return
 
-    prompt, retriever, llm, optimal_docs = prepare_components_parallel(
+    prompt, db, llm = prepare_components_parallel(
         project_id, prompt_type, question, max_docs
     )
 
-    retrieved_docs = retriever.get_relevant_documents(question)
+    retrieved_docs, retrieval_stats = retrieve_documents(db, question, max_docs, retrieval_mode)
     optimized_docs = optimize_context_for_question(question, retrieved_docs)
+    symbol_listing = catalogue_context(project_id, question)
+    if symbol_listing:
+        optimized_docs = [Document(page_content=symbol_listing, metadata={"source": "symbol_catalogue"})] + optimized_docs
+    retrieval_stats["docs_in_context"] = len(optimized_docs)
+    stats.update(retrieval_stats)
+    print(f"🔎 Retrieval stats: {retrieval_stats}")
 
     context = optimized_docs
     formatted_prompt = prompt.format(context=context, question=question)
 
     if prompt_type == "flowchart_prompt":
         # Get complete response
-        response = llm(formatted_prompt)
+        with llm_slot(priority, user_id, cancel_event) as ticket:
+            if ticket is None:
+                return
+            response = llm(formatted_prompt)
         
         # ✅ Clean mermaid response using regex
         response = clean_mermaid_response(response)
@@ -194,42 +331,51 @@ def answer_question_stream(project_id, question, max_docs, prompt_type):
 
     # For streaming prompts - collect response while streaming
     full_response = []
-    for chunk in llm.stream(formatted_prompt):
-        full_response.append(chunk)
-        yield chunk
-    
+    tokens = stream_llm(llm, formatted_prompt, cancel_event, priority, user_id)
+    cancelled = False
+    try:
+        for chunk in tokens:
+            full_response.append(chunk)
+            yield chunk
+    except GeneratorExit:
+        # Closed mid-stream by the consumer (e.g. after a client disconnect): nothing after the loop runs
+        cancelled = True
+        raise
+    finally:
+        tokens.close()
+        cancelled = cancelled or (cancel_event is not None and cancel_event.is_set())
+        if cancelled:
+            # A cut-off answer would be served verbatim to later askers, so it is only cached when opted in
+            if config.CACHE_PARTIAL_ANSWERS and full_response:
+                store_cache_response(project_id, question, "".join(full_response) + PARTIAL_ANSWER_NOTE)
+            print(f"🛑 Answer cancelled after {time.time() - start_time:.3f}s ({len(full_response)} chunk(s))")
+
+    if cancelled:
+        return
+
     # Cache the complete streamed response
     final_response = "".join(full_response)
     store_cache_response(project_id, question, final_response)
     print(f"📋 Response time: {time.time() - start_time:.3f}s (generated - streamed)")
 
-def generate_unit_tests_from_feature(feature_id: str, target_filename: str) -> List[dict]:
-    # Generate unit tests from feature comparison for a specific file (optimized)."""
-    
-    start_time = time.time()
-    
-    from app.utils import check_cache, store_cache_response
-
-    cached_response = check_cache(feature_id, target_filename)
-    if cached_response:
-        print(f"📋 Unit test response time: {time.time() - start_time:.3f}s (cached)")
-        return [{"file": target_filename, "unit_test": cached_response}]
-    
-    base_id = feature_id.split("__", 1)[0]
-    feature_vs = get_chroma_db(feature_id)
-    base_vs = get_chroma_db(base_id)
+def build_unit_test_prompt(feature_id: str, target_filename: str) -> Optional[str]:
+    """Unit-test prompt for one changed file, or None when the base project has no chunks for it."""
+    overlay = FeatureOverlay.from_feature_id(feature_id)
+    if overlay is None or not overlay.exists():
+        raise FileNotFoundError(f"No feature index found for: {feature_id}")
+    ensure_current_embeddings(overlay.project_id)
 
-    # Get only relevant metadata from Chroma (faster than retrieving everything)
-    feature_docs = feature_vs.similarity_search(target_filename, k=100)
+    # Exact per-file fetch by repo-relative path: no query embedding, no chunks from other files
+    feature_docs = get_source_documents(overlay.project_id, target_filename, overlay.collection_name)
     if not feature_docs:
         raise FileNotFoundError(f"No embedded feature chunks found for: {target_filename}")
 
     # Gather all chunk content
     feature_doc = "\n".join([doc.page_content for doc in feature_docs])
-    base_docs = base_vs.similarity_search(target_filename, k=10)
+    base_docs = get_source_documents(overlay.project_id, target_filename)
     if not base_docs:
         print(f"⚠️ No base chunks found for {target_filename}")
-        return []
+        return None
 
     base_doc = "\n".join([doc.page_content for doc in base_docs])
 
@@ -240,23 +386,150 @@ def generate_unit_tests_from_feature(feature_id: str, target_filename: str) -> L
         prompt_template = load_prompt_template("unit_test_react_prompt")
     else:
         prompt_template = load_prompt_template("unit_test_prompt")  # default / fallback
+
+    return prompt_template.format(feature_code=feature_doc, base_code=base_doc)
+
+
+def generate_unit_test_text(feature_id: str, target_filename: str, priority: int = PRIORITY_INTERACTIVE,
+                            user_id: str = None, cancel_event=None) -> Optional[str]:
+    """
+    Run the LLM on one file's unit-test prompt without touching the cache.
+
+    With a `cancel_event` the test is streamed so that setting the event gives up the scheduler
+    slot (or the place in its queue) and closes the LLM request at the next token; None is returned.
+    """
+    prompt = build_unit_test_prompt(feature_id, target_filename)
+    if prompt is None:
+        return None
+    if cancel_event is None:
+        with llm_slot(priority, user_id):
+            return get_llm().invoke(prompt).strip()
+
+    tokens = list(stream_llm(get_llm(streaming=True), prompt, cancel_event, priority, user_id))
+    if cancel_event.is_set():
+        return None
+    return "".join(tokens).strip()
+
+
+def generate_unit_tests_from_feature(feature_id: str, target_filename: str, user_id: str = None) -> List[dict]:
+    # Generate unit tests from feature comparison for a specific file (optimized)."""
     
-    prompt = prompt_template.format(feature_code=feature_doc, base_code=base_doc)
+    start_time = time.time()
+    
+    from app.utils import check_cache, store_cache_response
 
-    llm = get_llm()
+    cached_response = check_cache(feature_id, target_filename, exact=True)
+    if cached_response:
+        print(f"📋 Unit test response time: {time.time() - start_time:.3f}s (cached)")
+        return [{"file": target_filename, "unit_test": cached_response}]
 
     try:
-        response = llm.invoke(prompt)
-        generated_test = response.strip()
-        
-        # Cache the generated unit test
-        store_cache_response(feature_id, target_filename, generated_test)
-        print(f"📋 Unit test response time: {time.time() - start_time:.3f}s (generated)")
-        
-        return [{"file": target_filename, "unit_test": generated_test}]
+        generated_test = generate_unit_test_text(feature_id, target_filename, user_id=user_id)
+    except (FileNotFoundError, QueueFullError):
+        raise
     except Exception as e:
         print(f"❌ Error generating test for {target_filename}: {e}")
         return []
+    if generated_test is None:
+        return []
+
+    # Cache the generated unit test
+    store_cache_response(feature_id, target_filename, generated_test)
+    print(f"📋 Unit test response time: {time.time() - start_time:.3f}s (generated)")
+
+    return [{"file": target_filename, "unit_test": generated_test}]
+
+
+def stream_unit_test_from_feature(feature_id: str, target_filename: str, cancel_event=None, user_id: str = None):
+    """
+    Token stream of one file's unit test, cached under the same key as generate_unit_tests_from_feature.
+
+    Setting `cancel_event` (e.g. on client disconnect) stops generation at the next token; an
+    unfinished test is never cached.
+    """
+    start_time = time.time()
+
+    from app.utils import check_cache, store_cache_response
+
+    cached_response = check_cache(feature_id, target_filename, exact=True)
+    if cached_response:
+        print(f"📋 Unit test response time: {time.time() - start_time:.3f}s (cached)")
+        yield cached_response
+        return
+
+    prompt = build_unit_test_prompt(feature_id, target_filename)
+    if prompt is None:
+        raise FileNotFoundError(f"No base chunks found for: {target_filename}")
+
+    full_response = []
+    first_token_time = None
+    for token in stream_llm(get_llm(streaming=True), prompt, cancel_event, user_id=user_id):
+        if first_token_time is None:
+            first_token_time = time.time()
+            print(f"⏱️ Unit test first token after {first_token_time - start_time:.3f}s")
+        full_response.append(token)
+        yield token
+
+    if cancel_event is not None and cancel_event.is_set():
+        print(f"🛑 Unit test for {target_filename} cancelled after {len(full_response)} token(s); not cached")
+        return
+
+    store_cache_response(feature_id, target_filename, "".join(full_response).strip())
+    print(f"📋 Unit test response time: {time.time() - start_time:.3f}s (generated - streamed)")
+
+
+def generate_unit_tests_for_feature(feature_id: str, file_names: Optional[List[str]] = None,
+                                    max_workers: int = config.UNIT_TEST_CONCURRENCY, user_id: str = None,
+                                    cancel_event=None):
+    """
+    Generate unit tests for the changed files of a feature, yielding one result dict per file as it finishes.
+
+    Cached files are yielded first; the rest run on at most `max_workers` concurrent LLM calls, queued
+    in the scheduler's batch class behind interactive requests. The cache is read and written only
+    from the consuming thread, and closing the generator cancels files that have not started yet.
+    Setting `cancel_event` (e.g. on client disconnect) also stops queued and running generations.
+    """
+    from app.utils import check_cache, store_cache_response
+
+    overlay = FeatureOverlay.from_feature_id(feature_id)
+    if overlay is None or not overlay.exists():
+        raise FileNotFoundError(f"No feature index found for: {feature_id}")
+
+    pending = []
+    for file_name in file_names or overlay.manifest["files"]:
+        cached_response = check_cache(feature_id, file_name, exact=True)
+        if cached_response:
+            yield {"file": file_name, "status": "success", "unit_test": cached_response, "cached": True}
+        else:
+            pending.append(file_name)
+
+    if not pending:
+        return
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, max_workers))
+    try:
+        futures = {
+            executor.submit(generate_unit_test_text, feature_id, name, PRIORITY_BATCH, user_id, cancel_event): name
+            for name in pending
+        }
+        for future in concurrent.futures.as_completed(futures):
+            if cancel_event is not None and cancel_event.is_set():
+                print(f"🛑 Unit test batch for {feature_id} cancelled")
+                return
+            file_name = futures[future]
+            try:
+                generated_test = future.result()
+            except Exception as e:
+                print(f"❌ Error generating test for {file_name}: {e}")
+                yield {"file": file_name, "status": "error", "error": str(e)}
+                continue
+            if generated_test is None:
+                yield {"file": file_name, "status": "skipped", "error": "No base chunks found for this file"}
+                continue
+            store_cache_response(feature_id, file_name, generated_test)
+            yield {"file": file_name, "status": "success", "unit_test": generated_test, "cached": False}
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
 
 
 # Increase or decrease the chunk_size or delay for streaming purpose
@@ -4,19 +4,24 @@ import json
 import time
 import hashlib
 import shutil
+import tempfile
+from typing import Dict, Optional
 import networkx as nx
 import matplotlib.pyplot as plt
 from shutil import which
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from langchain_core.documents import Document
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import Chroma
-from langchain_ollama import OllamaEmbeddings
+from app.vector_store import DEFAULT_COLLECTION, get_project_store
+from app.symbol_catalogue import SymbolCatalogue, extract_react_symbols
+from app.utils import project_relative_path
 from config import config
 
 class ReactProjectProcessor:
-    def __init__(self, project_id: str, babel_script_path: str, persist_base_dir: str = config.CHROMA_DIR):
+    def __init__(self, project_id: str, babel_script_path: str, persist_base_dir: str = config.CHROMA_DIR,
+                 collection_name: str = DEFAULT_COLLECTION):
         self.project_id = project_id
+        self.collection_name = collection_name
         self.babel_script_path = babel_script_path
         self.persist_dir = os.path.join(persist_base_dir, project_id, "chroma")
         self.graph_image_path = os.path.join(persist_base_dir, project_id, "component_graph.png")
@@ -40,23 +45,28 @@ class ReactProjectProcessor:
 
     def extract_components(self, ast, file_content):
         results = []
+        def line_of(offset):
+            return file_content.count("\n", 0, offset) + 1
         def walk(node):
             if isinstance(node, dict):
                 if node.get("type") == "FunctionDeclaration" and node.get("id"):
                     name = node["id"]["name"]
                     body = file_content[node["start"]:node["end"]]
-                    results.append({"name": name, "type": "function", "body": body})
+                    results.append({"name": name, "type": "function", "body": body,
+                                    "start_line": line_of(node["start"])})
                 elif node.get("type") == "VariableDeclaration":
                     for decl in node.get("declarations", []):
                         init = decl.get("init", {})
                         if init.get("type") == "ArrowFunctionExpression":
                             name = decl["id"]["name"]
                             body = file_content[decl["start"]:decl["end"]]
-                            results.append({"name": name, "type": "arrow_function", "body": body})
+                            results.append({"name": name, "type": "arrow_function", "body": body,
+                                            "start_line": line_of(decl["start"])})
                 elif node.get("type") == "ClassDeclaration" and node.get("id"):
                     name = node["id"]["name"]
                     body = file_content[node["start"]:node["end"]]
-                    results.append({"name": name, "type": "class_component", "body": body})
+                    results.append({"name": name, "type": "class_component", "body": body,
+                                    "start_line": line_of(node["start"])})
                 for child in node.values():
                     walk(child)
             elif isinstance(node, list):
@@ -65,6 +75,22 @@ class ReactProjectProcessor:
         walk(ast)
         return results
 
+    def component_document(self, source, rel_path, comp, body_hash):
+        return Document(
+            page_content=f"Component: {comp['name']}\nFile: {os.path.basename(rel_path)}\nCode:\n{comp['body']}",
+            metadata={
+                "source": source,
+                "path": rel_path,
+                "component": comp["name"],
+                "type": comp["type"],
+                "start_line": comp.get("start_line", 1),
+                "hash": body_hash
+            }
+        )
+
+    def _component_hash(self, body):
+        return hashlib.md5(body.encode("utf-8")).hexdigest()
+
     def parallel_embed_documents(self, docs):
         splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
 
@@ -81,13 +107,8 @@ class ReactProjectProcessor:
             self.log("⚠️ No chunks to embed.")
             return
 
-        vectordb = Chroma.from_documents(
-            documents=chunks,
-            embedding=OllamaEmbeddings(model=config.MODEL_NAME, base_url=config.OLLAMA_BASE_URL),
-            persist_directory=self.persist_dir,
-            collection_metadata={"source_type": "react"}
-        )
-        vectordb.persist()
+        vectordb = get_project_store(self.project_id, self.collection_name)
+        vectordb.add_documents(chunks)
         self.log("🎉 Parallel embedding complete and persisted to disk")
 
     def parallel_parse_files(self, file_paths):
@@ -112,9 +133,10 @@ class ReactProjectProcessor:
         docs = []
         component_defs = {}
         jsx_usages = {}
+        self.symbols = []
         existing_hashes = set()
         try:
-            db = Chroma(persist_directory=self.persist_dir, embedding_function=OllamaEmbeddings(model=config.MODEL_NAME))
+            db = get_project_store(self.project_id, self.collection_name)
             all_docs = db.get()
             existing_hashes = {m.get("hash") for m in all_docs["metadatas"] if "hash" in m}
         except Exception:
@@ -129,24 +151,16 @@ class ReactProjectProcessor:
                 continue
             jsx_usages[path] = ast.get("__jsxTags", [])
             components = self.extract_components(ast, code)
+            self.symbols.extend(extract_react_symbols(self.project_id, path, ast, components))
             self.log(f"📄 {os.path.basename(path)}: {len(components)} component(s) extracted")
             for comp in components:
                 comp_name = comp["name"]
                 component_defs[comp_name] = path
-                body_hash = hashlib.md5(comp["body"].encode("utf-8")).hexdigest()
+                body_hash = self._component_hash(comp["body"])
                 if body_hash in existing_hashes:
                     self.log(f"⏩ Skipping unchanged component: {comp_name}")
                     continue
-                doc = Document(
-                    page_content=f"Component: {comp_name}\nFile: {os.path.basename(path)}\nCode:\n{comp['body']}",
-                    metadata={
-                        "source": path,
-                        "component": comp_name,
-                        "type": comp["type"],
-                        "hash": body_hash
-                    }
-                )
-                docs.append(doc)
+                docs.append(self.component_document(path, project_relative_path(self.project_id, path), comp, body_hash))
         return docs, component_defs, jsx_usages
 
     def build_component_call_graph(self, component_defs, jsx_usages):
@@ -187,6 +201,7 @@ class ReactProjectProcessor:
         self.log("🧠 Parsing & extracting components and JSX tags...")
         docs, component_defs, jsx_usages = self.build_documents(react_files)
         self.log(f"✅ Extracted {len(docs)} components")
+        SymbolCatalogue(self.project_id).replace(self.symbols)
         self.log("📊 Building JSX-based component graph...")
         graph = self.build_component_call_graph(component_defs, jsx_usages)
         self.save_component_graph_image(graph)
@@ -198,41 +213,73 @@ class ReactProjectProcessor:
 
     def _load_existing_hashes(self) -> set:
         try:
-            db = Chroma(
-                persist_directory=self.persist_dir,
-                embedding_function=OllamaEmbeddings(model=config.MODEL_NAME, base_url=config.OLLAMA_BASE_URL)
-            )
+            db = get_project_store(self.project_id, self.collection_name)
             return {meta.get("hash") for meta in db.get()["metadatas"] if "hash" in meta}
         except Exception:
             return set()
 
-    def process_full_file(self, file_path: str, content: str):
-        print(f"\n📥 Processing full file: {file_path}")
-        file_name = os.path.basename(file_path)
+    def parse_source(self, file_path: str, content: str):
+        """Babel reads from disk, so in-memory file versions are parsed through a temp file."""
+        suffix = os.path.splitext(file_path)[1]
+        fd, tmp_path = tempfile.mkstemp(suffix=suffix)
+        try:
+            with os.fdopen(fd, "w", encoding="utf8") as fp:
+                fp.write(content)
+            return self.parse_with_babel(tmp_path)
+        finally:
+            os.remove(tmp_path)
+
+    def _components_or_none(self, file_path: str, content: str):
+        ast = self.parse_source(file_path, content)
+        if not ast:
+            return None
+        return self.extract_components(ast, content)
 
-        # Ensure existing_hashes is loaded
+    def process_changed_file(self, file_path: str, content: str, base_content: Optional[str] = None) -> Optional[Dict]:
+        """
+        Embed only the components of a changed file whose body differs from the base version.
+
+        Returns the names of changed components plus the hashes and names of the base components
+        they replace or remove, or None if either version fails to parse.
+        """
         if not hasattr(self, "existing_hashes"):
             self.existing_hashes = self._load_existing_hashes()
 
-        file_hash = self._hash_text(content)
+        components = self._components_or_none(file_path, content)
+        base_components = [] if base_content is None else self._components_or_none(file_path, base_content)
+        if components is None or base_components is None:
+            return None
 
-        if file_hash in self.existing_hashes:
-            print(f"⏭️ Skipping {file_name}, already embedded.")
-            return
+        for comp in components + base_components:
+            comp["hash"] = self._component_hash(comp["body"])
+        base_hashes = {c["hash"] for c in base_components}
+        feature_hashes = {c["hash"] for c in components}
+        base_by_name = {c["name"]: c for c in base_components}
+        changed = [c for c in components if c["hash"] not in base_hashes]
+        replaced = [c for c in base_components if c["hash"] not in feature_hashes]
 
-        document = Document(
-            page_content=content,
-            metadata={"source": file_name, "hash": file_hash}
-        )
-
-        splitter = RecursiveCharacterTextSplitter(chunk_size=1024, chunk_overlap=10)
-        chunks = splitter.split_documents([document])
-        print(f"🪓 Split into {len(chunks)} chunk(s)")
+        file_name = os.path.basename(file_path)
+        file_hash = self._hash_text(content)
+        docs = []
+        for comp in changed:
+            if comp["hash"] in self.existing_hashes:
+                continue
+            doc = self.component_document(file_name, file_path, comp, comp["hash"])
+            base_comp = base_by_name.get(comp["name"])
+            doc.metadata.update({"file_hash": file_hash, "change": "modified" if base_comp else "added"})
+            if base_comp:
+                doc.metadata["replaces"] = base_comp["hash"]
+            docs.append(doc)
 
-        vectordb = Chroma(
-            persist_directory=self.persist_dir,
-            embedding_function=OllamaEmbeddings(model=config.MODEL_NAME, base_url=config.OLLAMA_BASE_URL)
-        )
-        vectordb.add_documents(chunks)
-        print(f"🚀 Embedded and stored: {file_path}")
+        if docs:
+            self.parallel_embed_documents(docs)
+            self.existing_hashes.update(c["hash"] for c in changed)
+            self.log(f"🚀 {file_name}: embedded {len(docs)} changed component(s)")
+        else:
+            self.log(f"⏭️ {file_name}: no new component bodies to embed")
 
+        return {
+            "changed": [c["name"] for c in changed],
+            "replaced": [c["name"] for c in replaced],
+            "replaced_hashes": sorted({c["hash"] for c in replaced})
+        }
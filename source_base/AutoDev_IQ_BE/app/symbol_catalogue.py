@@ -0,0 +1,396 @@
+import os
+import re
+import sqlite3
+from typing import Dict, List, Optional
+
+import javalang
+
+from config import config
+from app.utils import project_relative_path
+
+CATALOGUE_FILE = "symbols.db"
+MAX_CONTEXT_SYMBOLS = 200
+
+MAPPING_ANNOTATIONS = {
+    "GetMapping": "GET",
+    "PostMapping": "POST",
+    "PutMapping": "PUT",
+    "DeleteMapping": "DELETE",
+    "PatchMapping": "PATCH",
+    "RequestMapping": None,
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS symbols (
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    file TEXT NOT NULL,
+    parent TEXT,
+    signature TEXT,
+    annotations TEXT,
+    http_method TEXT,
+    path TEXT,
+    line INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_symbols_kind ON symbols(kind);
+"""
+
+COLUMNS = ("kind", "name", "file", "parent", "signature", "annotations", "http_method", "path", "line")
+
+LISTING_VERBS = re.compile(
+    r"^\s*(?:please\s+)?(?:list|enumerate|show\s+me|give\s+me|display|what\s+are|which\s+are)\b"
+)
+EXPLANATION_WORDS = re.compile(r"\b(?:how|why|explain|describe|difference|compare)\b")
+# "endpoints that call X" / "the class which handles Y" need the code, not a catalogue dump
+FILTER_WORDS = re.compile(r"\b(?:that|which|whose|where|handl\w*|call\w*|used\s+by|related\s+to)\b")
+QUANTIFIER = r"\b(?:all|every|each)\s+(?:of\s+)?(?:the\s+)?(?:rest\s+|api\s+|react\s+|spring\s+)*"
+# (target, plural form, singular form); a singular only counts after all/every/each
+LISTING_TARGETS = [
+    ("endpoints", r"end\s?points", r"end\s?point"),
+    ("routes", r"routes", r"route"),
+    ("components", r"components", r"component"),
+    ("controllers", r"controllers", r"controller"),
+    ("services", r"services", r"service"),
+    ("repositories", r"repositories", r"repository"),
+    ("classes", r"classes", r"class"),
+]
+LISTING_TARGET_PATTERNS = [
+    (target, re.compile(rf"\b{plural}\b|{QUANTIFIER}{singular}\b"))
+    for target, plural, singular in LISTING_TARGETS
+]
+
+
+# ---------- Java extraction ----------
+
+def _literal_values(element) -> List[str]:
+    if element is None:
+        return []
+    if isinstance(element, javalang.tree.Literal):
+        return [element.value.strip('"')]
+    if isinstance(element, javalang.tree.ElementArrayValue):
+        return [v for value in element.values for v in _literal_values(value)]
+    if isinstance(element, javalang.tree.MemberReference):
+        return [element.member]
+    return []
+
+
+def _annotation_arguments(annotation) -> Dict[str, List[str]]:
+    """Map annotation arguments to literal values; a bare value is stored under 'value'."""
+    element = annotation.element
+    if element is None:
+        return {}
+    if isinstance(element, list):
+        return {pair.name: _literal_values(pair.value) for pair in element}
+    return {"value": _literal_values(element)}
+
+
+def _mapping_paths(annotation) -> List[str]:
+    args = _annotation_arguments(annotation)
+    return args.get("value") or args.get("path") or [""]
+
+
+def _join_paths(prefix: str, path: str) -> str:
+    joined = "/".join(part.strip("/") for part in (prefix, path) if part and part.strip("/"))
+    return "/" + joined
+
+
+def _type_methods(type_decl) -> list:
+    # Enum bodies are not plain lists, so javalang's `methods` property can fail on them
+    try:
+        return list(type_decl.methods or [])
+    except Exception:
+        return []
+
+
+def extract_java_symbols(project_id: str, file_path: str, tree) -> List[Dict]:
+    """Classes, methods and Spring request mappings declared in one parsed Java file."""
+    symbols = []
+    rel_path = project_relative_path(project_id, file_path)
+
+    for _, type_decl in tree.filter(javalang.tree.TypeDeclaration):
+        annotations = [a.name for a in (type_decl.annotations or [])]
+        class_prefixes = [""]
+        for annotation in type_decl.annotations or []:
+            if annotation.name == "RequestMapping":
+                class_prefixes = _mapping_paths(annotation)
+
+        symbols.append({
+            "kind": "class",
+            "name": type_decl.name,
+            "file": rel_path,
+            "annotations": ",".join(annotations),
+            "line": type_decl.position.line if type_decl.position else None,
+        })
+
+        for method in _type_methods(type_decl):
+            params = ", ".join(f"{p.type.name} {p.name}" for p in method.parameters)
+            return_type = method.return_type.name if method.return_type else "void"
+            method_annotations = [a.name for a in (method.annotations or [])]
+            line = method.position.line if method.position else None
+            symbols.append({
+                "kind": "method",
+                "name": method.name,
+                "file": rel_path,
+                "parent": type_decl.name,
+                "signature": f"{return_type} {method.name}({params})",
+                "annotations": ",".join(method_annotations),
+                "line": line,
+            })
+
+            for annotation in method.annotations or []:
+                if annotation.name not in MAPPING_ANNOTATIONS:
+                    continue
+                http_methods = [MAPPING_ANNOTATIONS[annotation.name]]
+                if http_methods == [None]:
+                    http_methods = _annotation_arguments(annotation).get("method") or ["ANY"]
+                for prefix in class_prefixes:
+                    for path in _mapping_paths(annotation):
+                        for http_method in http_methods:
+                            symbols.append({
+                                "kind": "endpoint",
+                                "name": method.name,
+                                "file": rel_path,
+                                "parent": type_decl.name,
+                                "signature": f"{return_type} {method.name}({params})",
+                                "annotations": annotation.name,
+                                "http_method": http_method,
+                                "path": _join_paths(prefix, path),
+                                "line": line,
+                            })
+    return symbols
+
+
+# ---------- React extraction ----------
+
+def _jsx_name(node) -> Optional[str]:
+    if not isinstance(node, dict):
+        return None
+    if node.get("type") == "JSXElement":
+        return _jsx_name(node.get("openingElement", {}).get("name"))
+    if node.get("type") in ("JSXIdentifier", "Identifier"):
+        return node.get("name")
+    if node.get("type") == "JSXMemberExpression":
+        return _jsx_name(node.get("property"))
+    if node.get("type") == "JSXExpressionContainer":
+        return _jsx_name(node.get("expression"))
+    return None
+
+
+def _string_value(node) -> Optional[str]:
+    if isinstance(node, dict) and node.get("type") == "JSXExpressionContainer":
+        node = node.get("expression")
+    if isinstance(node, dict) and node.get("type") == "StringLiteral":
+        return node.get("value")
+    return None
+
+
+def _line(node) -> Optional[int]:
+    return (node.get("loc") or {}).get("start", {}).get("line")
+
+
+def extract_react_symbols(project_id: str, file_path: str, ast: dict, components: List[Dict]) -> List[Dict]:
+    """Components (capitalised definitions) and router routes found in one Babel AST."""
+    rel_path = project_relative_path(project_id, file_path)
+    symbols = [
+        {"kind": "component", "name": comp["name"], "file": rel_path, "signature": comp["type"]}
+        for comp in components
+        if comp["name"][:1].isupper()
+    ]
+
+    def walk(node):
+        if isinstance(node, dict):
+            node_type = node.get("type")
+            if node_type == "JSXElement" and _jsx_name(node) == "Route":
+                attrs = {
+                    attr.get("name", {}).get("name"): attr.get("value")
+                    for attr in node.get("openingElement", {}).get("attributes", [])
+                    if attr.get("type") == "JSXAttribute"
+                }
+                path = _string_value(attrs.get("path"))
+                if path is not None or "index" in attrs:
+                    target = _jsx_name(attrs.get("element")) or _jsx_name(attrs.get("component"))
+                    symbols.append({"kind": "route", "name": target or "", "file": rel_path,
+                                    "path": path or "(index)", "line": _line(node)})
+            elif node_type == "ObjectExpression":
+                props = {
+                    (prop.get("key") or {}).get("name"): prop.get("value")
+                    for prop in node.get("properties", [])
+                    if prop.get("type") == "ObjectProperty"
+                }
+                path = _string_value(props.get("path"))
+                if path is not None and ("element" in props or "component" in props):
+                    target = _jsx_name(props.get("element")) or _jsx_name(props.get("component"))
+                    symbols.append({"kind": "route", "name": target or "", "file": rel_path,
+                                    "path": path, "line": _line(node)})
+            for value in node.values():
+                walk(value)
+        elif isinstance(node, list):
+            for item in node:
+                walk(item)
+
+    walk(ast)
+    return symbols
+
+
+# ---------- Storage ----------
+
+class SymbolCatalogue:
+    """Per-project SQLite table of symbols extracted during ingestion."""
+
+    def __init__(self, project_id: str):
+        self.project_id = project_id
+        self.db_path = os.path.join(config.CHROMA_DIR, project_id, CATALOGUE_FILE)
+
+    def exists(self) -> bool:
+        return os.path.isfile(self.db_path)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        conn.executescript(SCHEMA)
+        return conn
+
+    def replace(self, symbols: List[Dict]):
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM symbols")
+                conn.executemany(
+                    f"INSERT INTO symbols ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                    [tuple(symbol.get(col) for col in COLUMNS) for symbol in symbols]
+                )
+        finally:
+            conn.close()
+        print(f"📚 Stored {len(symbols)} symbols in catalogue for {self.project_id}")
+
+    def query(self, kind: str, name_suffix: Optional[str] = None, annotation: Optional[str] = None) -> List[Dict]:
+        if not self.exists():
+            return []
+        sql = "SELECT * FROM symbols WHERE kind = ?"
+        params = [kind]
+        if name_suffix or annotation:
+            clauses = []
+            if name_suffix:
+                clauses.append("name LIKE ?")
+                params.append(f"%{name_suffix}")
+            if annotation:
+                clauses.append("(',' || annotations || ',') LIKE ?")
+                params.append(f"%,{annotation},%")
+            sql += " AND (" + " OR ".join(clauses) + ")"
+        sql += " ORDER BY file, line"
+        conn = self._connect()
+        try:
+            return [dict(row) for row in conn.execute(sql, params)]
+        finally:
+            conn.close()
+
+    def methods_of(self, class_name: str) -> List[Dict]:
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT * FROM symbols WHERE kind = 'method' AND parent = ? ORDER BY line", (class_name,)
+            )
+            return [dict(row) for row in rows]
+        finally:
+            conn.close()
+
+
+# ---------- QA fast path ----------
+
+def match_listing_target(question: str) -> Optional[str]:
+    """Which catalogue target a question is about (endpoints, components, ...), if any."""
+    question_lower = question.lower()
+    for target, pattern in LISTING_TARGET_PATTERNS:
+        if pattern.search(question_lower):
+            return target
+    return None
+
+
+def is_listing_question(question: str) -> bool:
+    """
+    Pure enumeration requests only: an enumeration phrasing ("list", "what are", ...) about a plural
+    or all/every target, without explanation or filtering clauses ("Show me the Login component
+    code" and "List the classes that handle payments" go to the LLM).
+    """
+    question_lower = question.lower()
+    return (bool(LISTING_VERBS.search(question_lower))
+            and match_listing_target(question_lower) is not None
+            and not EXPLANATION_WORDS.search(question_lower)
+            and not FILTER_WORDS.search(question_lower))
+
+
+def lookup_symbols(catalogue: SymbolCatalogue, target: str) -> List[Dict]:
+    if target == "endpoints":
+        return catalogue.query("endpoint")
+    if target == "routes":
+        return catalogue.query("route")
+    if target == "components":
+        return catalogue.query("component")
+    if target == "controllers":
+        rest_controllers = catalogue.query("class", name_suffix="Controller", annotation="RestController")
+        seen = {(s["file"], s["name"]) for s in rest_controllers}
+        return rest_controllers + [s for s in catalogue.query("class", annotation="Controller")
+                                   if (s["file"], s["name"]) not in seen]
+    if target == "services":
+        return catalogue.query("class", name_suffix="Service", annotation="Service")
+    if target == "repositories":
+        return catalogue.query("class", name_suffix="Repository", annotation="Repository")
+    return catalogue.query("class")
+
+
+def _format_location(symbol: Dict) -> str:
+    return f"{symbol['file']}:{symbol['line']}" if symbol.get("line") else symbol["file"]
+
+
+def format_symbols(catalogue: SymbolCatalogue, target: str, symbols: List[Dict], include_methods: bool = False) -> str:
+    lines = []
+    for symbol in symbols:
+        if symbol["kind"] == "endpoint":
+            lines.append(f"- `{symbol['http_method']} {symbol['path']}` → "
+                         f"`{symbol['parent']}.{symbol['name']}()` ({_format_location(symbol)})")
+        elif symbol["kind"] == "route":
+            target_name = f" → `{symbol['name']}`" if symbol["name"] else ""
+            lines.append(f"- `{symbol['path']}`{target_name} ({_format_location(symbol)})")
+        elif symbol["kind"] == "class" and include_methods:
+            lines.append(f"- **{symbol['name']}** ({_format_location(symbol)})")
+            for method in catalogue.methods_of(symbol["name"]):
+                lines.append(f"  - `{method['signature']}`")
+        else:
+            lines.append(f"- `{symbol['name']}` ({_format_location(symbol)})")
+    return "\n".join(lines)
+
+
+def answer_listing_question(project_id: str, question: str) -> Optional[str]:
+    """Answer pure enumeration questions straight from the catalogue; None means use the LLM path."""
+    if not is_listing_question(question):
+        return None
+    catalogue = SymbolCatalogue(project_id)
+    if not catalogue.exists():
+        return None
+    target = match_listing_target(question)
+    if target is None:
+        return None
+    symbols = lookup_symbols(catalogue, target)
+    if not symbols:
+        return None
+
+    include_methods = "method" in question.lower()
+    body = format_symbols(catalogue, target, symbols, include_methods)
+    return f"Found {len(symbols)} {target} in this project:\n\n{body}\n"
+
+
+def catalogue_context(project_id: str, question: str) -> Optional[str]:
+    """Catalogue listing to add to the LLM context of enumeration questions the fast path didn't answer."""
+    if not is_listing_question(question):
+        return None
+    catalogue = SymbolCatalogue(project_id)
+    if not catalogue.exists():
+        return None
+    target = match_listing_target(question)
+    if target is None:
+        return None
+    symbols = lookup_symbols(catalogue, target)[:MAX_CONTEXT_SYMBOLS]
+    if not symbols:
+        return None
+    return f"Symbol catalogue ({target}):\n" + format_symbols(catalogue, target, symbols)
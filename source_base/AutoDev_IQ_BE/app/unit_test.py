@@ -3,6 +3,8 @@ import logging
 from typing import Optional, Dict, Any
 from git import Repo, GitCommandError
 
+from app.git_worktrees import ensure_worktree, get_branch_lock
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -133,22 +135,8 @@ class UnitTest:
         with open(test_file_path, 'w', encoding='utf-8') as f:
             f.write(final_content)
 
-        path_parts = test_file_path.split(os.sep)
-        try:
-            # Find the index of project_id in the path
-            project_index = path_parts.index(project_id)
-            # Get all parts after project_id
-            trimmed_parts = path_parts[project_index+1:]
-            # Join them back together
-            trimmed_path = os.sep.join(trimmed_parts)
-        except ValueError:
-            # If project_id not found, fall back to trimming from 'src'
-            try:
-                src_index = path_parts.index('src')
-                trimmed_path = os.sep.join(path_parts[src_index:])
-            except ValueError:
-                # If neither project_id nor 'src' found, return full path
-                trimmed_path = test_file_path
+        # Path relative to the checkout (the branch worktree), which is what Git operations expect
+        trimmed_path = os.path.relpath(test_file_path, project_path)
         
         logger.info(f"Created Java test file: {trimmed_path}")
         return trimmed_path
@@ -175,22 +163,8 @@ class UnitTest:
         
         logger.info(f"Created React test file: {test_file_path}")
         
-        path_parts = test_file_path.split(os.sep)
-        try:
-            # Find the index of project_id in the path
-            project_index = path_parts.index(project_id)
-            # Get all parts after project_id
-            trimmed_parts = path_parts[project_index+1:]
-            # Join them back together
-            trimmed_path = os.sep.join(trimmed_parts)
-        except ValueError:
-            # If project_id not found, fall back to trimming from 'src'
-            try:
-                src_index = path_parts.index('src')
-                trimmed_path = os.sep.join(path_parts[src_index:])
-            except ValueError:
-                # If neither project_id nor 'src' found, return full path
-                trimmed_path = test_file_path
+        # Path relative to the checkout (the branch worktree), which is what Git operations expect
+        trimmed_path = os.path.relpath(test_file_path, project_path)
         
         logger.info(f"Created React test file: {trimmed_path}")
         return trimmed_path
@@ -198,25 +172,15 @@ class UnitTest:
     async def perform_git_operations(self, project_path: str, test_file_path: str, 
                                    test_file_name: str, branch_name: str) -> str:
         
-        # Perform Git operations: checkout branch, add, commit, and push (Commented out right now)
+        # Perform Git operations inside the branch worktree: add, commit, and push
         try:
-            # Initialize Git repo
+            # Initialize Git repo (the worktree is already on branch_name)
             repo = Repo(project_path)
             
             # Ensure we have a clean working directory
             if repo.is_dirty():
                 logger.warning("Working directory is dirty, but proceeding...")
             
-            # Checkout or create the branch
-            logger.info(f"Checking out branch: {branch_name}")
-            try:
-                # Try to checkout existing branch
-                repo.git.checkout(branch_name)
-            except GitCommandError:
-                # Branch doesn't exist, create it
-                logger.info(f"Branch {branch_name} doesn't exist, creating it")
-                repo.git.checkout('-b', branch_name)
-            
             # Add the test file
             logger.info(f"Adding file to Git: {test_file_path}")
             repo.index.add([test_file_path])
@@ -267,27 +231,32 @@ class UnitTest:
         
         logger.info(f"Processing unit test creation for project: {project_id}")
         
-        # Detect project type
-        project_type = self.detect_project_type(project_path)
-        logger.info(f"Detected project type: {project_type}")
-        
-        # Create test file based on project type
-        if project_type == ProjectType.JAVA:
-            test_file_path = self.create_java_test_file(project_path, test_file_name, unit_test_content,project_id)
-        elif project_type == ProjectType.REACT:
-            test_file_path = self.create_react_test_file(project_path, test_file_name, unit_test_content,project_id)
-        else:
-            raise ValueError(f"Unsupported project type: {project_type}")
-        
-        # Perform Git operations
-        git_result = await self.perform_git_operations(
-            project_path, test_file_path, test_file_name, branch_name
-        )
+        # Write and commit in a worktree for the branch so the shared clone is never checked out
+        worktree_path = ensure_worktree(project_path, branch_name)
+        logger.info(f"Using worktree for {branch_name}: {worktree_path}")
+
+        with get_branch_lock(project_path, branch_name):
+            # Detect project type
+            project_type = self.detect_project_type(worktree_path)
+            logger.info(f"Detected project type: {project_type}")
+            
+            # Create test file based on project type
+            if project_type == ProjectType.JAVA:
+                test_file_path = self.create_java_test_file(worktree_path, test_file_name, unit_test_content,project_id)
+            elif project_type == ProjectType.REACT:
+                test_file_path = self.create_react_test_file(worktree_path, test_file_name, unit_test_content,project_id)
+            else:
+                raise ValueError(f"Unsupported project type: {project_type}")
+            
+            # Perform Git operations
+            git_result = await self.perform_git_operations(
+                worktree_path, test_file_path, test_file_name, branch_name
+            )
         
         return {
             "project_id": project_id,
             "project_type": project_type,
-            "test_file_path": os.path.relpath(test_file_path, project_path),
+            "test_file_path": test_file_path,
             "branch_name": branch_name,
             "git_result": git_result
         }
\ No newline at end of file
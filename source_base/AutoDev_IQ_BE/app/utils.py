@@ -6,7 +6,6 @@ from typing import Optional, Dict
 from collections import OrderedDict
 from pathlib import Path
 
-from langchain_ollama import OllamaEmbeddings
 from config import config
 
 _cache_manager = None
@@ -21,6 +20,37 @@ def detect_project_type(path: str) -> str:
                 return "react"
     return "unknown"
 
+def project_relative_path(project_id: str, file_path: str) -> str:
+    """Path of a file under the project's clone, relative to the repo root with '/' separators."""
+    project_root = os.path.join(config.CHROMA_DIR, project_id)
+    try:
+        return os.path.relpath(file_path, project_root).replace("\\", "/")
+    except ValueError:
+        return file_path
+
+def read_project_metadata(project_path: str) -> dict:
+    """Load metadata.json written during ingestion, or an empty dict if missing/broken."""
+    metadata_file = os.path.join(project_path, "metadata.json")
+    if not os.path.isfile(metadata_file):
+        return {}
+    try:
+        with open(metadata_file, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+def get_project_embedding_model(project_path: str) -> Optional[str]:
+    """Embedding model a project was indexed with (legacy projects used MODEL_NAME for everything)."""
+    metadata = read_project_metadata(project_path)
+    if not metadata:
+        return None
+    return metadata.get("embedding_model", config.MODEL_NAME)
+
+def needs_reembed(project_path: str) -> bool:
+    """True when the project's vectors were produced by a different embedding model than configured."""
+    embedding_model = get_project_embedding_model(project_path)
+    return embedding_model is not None and embedding_model != config.EMBEDDING_MODEL_NAME
+
 class PersistentProjectCacheManager:
     def __init__(self, max_cache_size_per_project: int = 300, max_total_embeddings: int = 3000):
         self.cache_dir = Path("./qa_cache_storage")
@@ -65,7 +95,9 @@ class PersistentProjectCacheManager:
         return self.qa_cache_dir / f"{project_id}_freq.json"
     
     def _get_embedding_cache_file(self) -> Path:
-        return self.embedding_cache_dir / "embeddings.pkl"
+        # Vectors from different embedding models are not comparable, so keep one file per model
+        model_key = config.EMBEDDING_MODEL_NAME.replace(":", "_").replace("/", "_")
+        return self.embedding_cache_dir / f"embeddings_{model_key}.pkl"
     
     def _load_cache_from_disk(self):
         if self._loaded_from_disk:
@@ -215,7 +247,7 @@ class PersistentProjectCacheManager:
                     
                     self.cache_stats["evictions"] += 1
     
-    def check_cache(self, project_id: str, question: str) -> Optional[str]:
+    def check_cache(self, project_id: str, question: str, exact: bool = False) -> Optional[str]:
         normalized_q = self._normalize_question(question)
         project_cache = self._get_project_cache(project_id)
         
@@ -227,7 +259,8 @@ class PersistentProjectCacheManager:
             print(f"⚡ EXACT MATCH - {project_id}")
             return response
         
-        if len(project_cache) < 5:
+        # Keys like file names must never be served another key's answer through semantic similarity
+        if exact or len(project_cache) < 5:
             self.cache_stats["misses"] += 1
             print(f"❌ CACHE MISS - {project_id}")
             return None
@@ -364,8 +397,8 @@ def clear_embedding_cache() -> bool:
 def clear_all_cache() -> bool:
     return get_cache_manager().clear_all_cache()
 
-def check_cache(project_id: str, question: str) -> Optional[str]:
-    return get_cache_manager().check_cache(project_id, question)
+def check_cache(project_id: str, question: str, exact: bool = False) -> Optional[str]:
+    return get_cache_manager().check_cache(project_id, question, exact)
 
 def store_cache_response(project_id: str, question: str, response: str):
     get_cache_manager().store_response(project_id, question, response)
@@ -0,0 +1,237 @@
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import chromadb
+from langchain_community.vectorstores import Chroma
+from langchain_core.documents import Document
+
+from config import config
+
+# Collection name langchain's Chroma wrapper uses when none is given; every existing index lives there
+DEFAULT_COLLECTION = "langchain"
+
+_registry = None
+
+
+class _ProjectEntry:
+    def __init__(self, client):
+        self.client = client
+        self.stores: Dict[str, Chroma] = {}
+        self.resident_vectors = 0
+        # Store handles created on this client that are still referenced somewhere (processors,
+        # overlays, in-flight searches); the client is only closed once this drops to zero
+        self.live_handles = 0
+        self.retired = False
+        self.closed = False
+
+
+def _close_client(client):
+    """
+    Stop a Chroma client's system and drop it from chromadb's process-wide client cache.
+
+    Only called once no store handle on the client is referenced any more (see ProjectStoreRegistry).
+    """
+    try:
+        client._system.stop()
+    except Exception as e:
+        print(f"⚠️ Failed to stop Chroma client: {e}")
+    try:
+        from chromadb.api.client import SharedSystemClient
+        SharedSystemClient._identifier_to_system.pop(client._identifier, None)
+    except Exception:
+        pass
+
+
+class ProjectStoreRegistry:
+    """
+    Owns exactly one Chroma client per project and hands out collection handles on it.
+
+    Memory is bounded by the number of vectors in resident collections rather than by
+    project count; least recently used projects are retired once the budget is exceeded.
+    A retired client is closed when the last store handle given out on it is garbage collected,
+    so eviction never stops a system under a caller that is still using it; asking for a retired
+    project before then revives its client instead of opening a second one on the same directory.
+    """
+
+    def __init__(self, base_dir: str = config.CHROMA_DIR, max_resident_vectors: int = config.MAX_RESIDENT_VECTORS):
+        self.base_dir = base_dir
+        self.max_resident_vectors = max_resident_vectors
+        self._entries: "OrderedDict[str, _ProjectEntry]" = OrderedDict()
+        self._retired: Dict[str, _ProjectEntry] = {}
+        self._lock = threading.RLock()
+        self.stats_counters = {"opened": 0, "evicted": 0, "invalidated": 0}
+
+    def _persist_dir(self, project_id: str) -> str:
+        return os.path.join(self.base_dir, project_id, "chroma")
+
+    def _open_entry(self, project_id: str) -> _ProjectEntry:
+        client = chromadb.PersistentClient(path=self._persist_dir(project_id))
+        self.stats_counters["opened"] += 1
+        return _ProjectEntry(client)
+
+    def get(self, project_id: str, collection_name: str = DEFAULT_COLLECTION) -> Chroma:
+        from app.qa import get_embeddings
+
+        with self._lock:
+            entry = self._resident_entry(project_id)
+            store = entry.stores.get(collection_name)
+            if store is None:
+                store = Chroma(
+                    client=entry.client,
+                    collection_name=collection_name,
+                    embedding_function=get_embeddings()
+                )
+                entry.live_handles += 1
+                weakref.finalize(store, self._release_handle, entry)
+                entry.stores[collection_name] = store
+                self._recount(entry)
+                self._enforce_budget(keep=project_id)
+            return store
+
+    def _resident_entry(self, project_id: str) -> _ProjectEntry:
+        """The project's entry, reviving a retired client that is still in use or opening a new one."""
+        entry = self._entries.get(project_id)
+        if entry is None:
+            entry = self._retired.pop(project_id, None)
+            if entry is not None and not entry.closed:
+                entry.retired = False
+            else:
+                entry = self._open_entry(project_id)
+            self._entries[project_id] = entry
+        self._entries.move_to_end(project_id)
+        return entry
+
+    def _release_handle(self, entry: _ProjectEntry):
+        with self._lock:
+            entry.live_handles -= 1
+            self._close_if_unused(entry)
+
+    def _close_if_unused(self, entry: _ProjectEntry):
+        if entry.retired and entry.live_handles <= 0 and not entry.closed:
+            entry.closed = True
+            _close_client(entry.client)
+            for project_id, retired in list(self._retired.items()):
+                if retired is entry:
+                    self._retired.pop(project_id)
+
+    def _retire(self, project_id: str, entry: _ProjectEntry, revivable: bool = True):
+        """Forget an entry's cached handles; its client closes now or when the last outside handle is dropped."""
+        entry.retired = True
+        if revivable:
+            self._retired[project_id] = entry
+        entry.stores.clear()  # may run finalizers (and close the client) right here
+        self._close_if_unused(entry)
+
+    def get_source_documents(self, project_id: str, rel_path: str,
+                             collection_name: str = DEFAULT_COLLECTION) -> List[Document]:
+        """
+        All chunks of one file (by repo-relative path) in file order, fetched by metadata filter.
+
+        Indexes built before chunks carried a path key Java chunks by file name and React chunks by
+        their clone path; those path-less chunks are matched that way until the project is re-embedded.
+        """
+        store = self.get(project_id, collection_name)
+        data = store._collection.get(where={"path": rel_path}, include=["documents", "metadatas"])
+        rows = list(zip(data["documents"], data["metadatas"]))
+        if not rows:
+            clone_path = os.path.join(self.base_dir, project_id, rel_path)
+            legacy = store._collection.get(
+                where={"source": {"$in": [os.path.basename(rel_path), clone_path]}},
+                include=["documents", "metadatas"]
+            )
+            rows = [(text, meta) for text, meta in zip(legacy["documents"], legacy["metadatas"])
+                    if "path" not in (meta or {})]
+            if rows:
+                print(f"⚠️ {project_id} predates path metadata; matched {rel_path} by source (POST /reembed to fix)")
+        rows.sort(key=lambda row: (row[1] or {}).get("start_line", 0))
+        return [Document(page_content=text, metadata=meta or {}) for text, meta in rows]
+
+    def refresh(self, project_id: str):
+        """Recount resident vectors and re-apply the budget (call after ingestion)."""
+        with self._lock:
+            entry = self._entries.get(project_id)
+            if entry is None:
+                return
+            self._recount(entry)
+            self._enforce_budget(keep=project_id)
+
+    def invalidate(self, project_id: str):
+        """Close and forget a project's client, e.g. before its Chroma directory is deleted or rebuilt."""
+        with self._lock:
+            entry = self._entries.pop(project_id, None)
+            retired = self._retired.pop(project_id, None)
+            if retired is not None:
+                self._close_if_unused(retired)
+            if entry is not None:
+                # Not revivable: the directory is about to be deleted or rebuilt
+                self._retire(project_id, entry, revivable=False)
+                self.stats_counters["invalidated"] += 1
+                print(f"🗑️ Closed vector store for: {project_id}")
+
+    def drop_collection(self, project_id: str, collection_name: str):
+        """Delete one collection of a project and forget its cached handle."""
+        with self._lock:
+            entry = self._resident_entry(project_id)
+            entry.stores.pop(collection_name, None)
+            try:
+                entry.client.delete_collection(collection_name)
+            except Exception as e:
+                print(f"⚠️ Could not delete collection {collection_name} of {project_id}: {e}")
+            self._recount(entry)
+
+    def _recount(self, entry: _ProjectEntry):
+        total = 0
+        for store in entry.stores.values():
+            try:
+                total += store._collection.count()
+            except Exception:
+                pass
+        entry.resident_vectors = total
+
+    def _enforce_budget(self, keep: Optional[str] = None):
+        while self.resident_vectors() > self.max_resident_vectors and len(self._entries) > 1:
+            oldest_id = next(iter(self._entries))
+            if oldest_id == keep:
+                self._entries.move_to_end(oldest_id)
+                oldest_id = next(iter(self._entries))
+                if oldest_id == keep:
+                    break
+            entry = self._entries.pop(oldest_id)
+            self._retire(oldest_id, entry)
+            self.stats_counters["evicted"] += 1
+            print(f"♻️ Evicted vector store for: {oldest_id} ({entry.resident_vectors} vectors)")
+
+    def resident_vectors(self) -> int:
+        return sum(entry.resident_vectors for entry in self._entries.values())
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "resident_projects": list(self._entries.keys()),
+                "retired_in_use": list(self._retired.keys()),
+                "resident_vectors": self.resident_vectors(),
+                "max_resident_vectors": self.max_resident_vectors,
+                **self.stats_counters
+            }
+
+
+def get_store_registry() -> ProjectStoreRegistry:
+    global _registry
+    if _registry is None:
+        _registry = ProjectStoreRegistry()
+    return _registry
+
+def get_project_store(project_id: str, collection_name: str = DEFAULT_COLLECTION) -> Chroma:
+    return get_store_registry().get(project_id, collection_name)
+
+def refresh_project_store(project_id: str):
+    get_store_registry().refresh(project_id)
+
+def invalidate_project_store(project_id: str):
+    get_store_registry().invalidate(project_id)
+
+def get_source_documents(project_id: str, rel_path: str, collection_name: str = DEFAULT_COLLECTION) -> List[Document]:
+    return get_store_registry().get_source_documents(project_id, rel_path, collection_name)
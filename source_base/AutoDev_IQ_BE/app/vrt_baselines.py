@@ -0,0 +1,165 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+from typing import Dict, Optional
+from urllib.parse import urljoin, urlparse
+
+import requests
+from bs4 import BeautifulSoup
+
+from config import config
+from app.browser_pool import STYLE_PROPERTIES, PageCapture
+
+FINGERPRINT_TIMEOUT = 10
+FINGERPRINT_MAX_ASSETS = 20
+
+_store = None
+
+
+class BaselineStore:
+  """
+  Base-side VRT captures (screenshot, HTML and computed styles) kept on disk across runs.
+
+  Entries are keyed by base URL, viewport size, capture options and a version: either one the
+  caller names explicitly, or a fingerprint of what the base URL serves (its HTML plus the
+  same-origin scripts and stylesheets it links). Comparing many test builds against an unchanged
+  baseline then only captures the test side, while a redeployed baseline is captured afresh.
+  """
+
+  def __init__(self, root: str = config.VRT_BASELINE_DIR, max_age_hours: float = config.VRT_BASELINE_MAX_AGE_HOURS,
+               max_entries: int = config.VRT_BASELINE_MAX_ENTRIES):
+    self.root = root
+    self.max_age_seconds = max_age_hours * 3600
+    self.max_entries = max(1, max_entries)
+    self.counters = {"hits": 0, "misses": 0, "stored": 0, "fingerprint_failures": 0}
+
+  def fingerprint(self, url: str) -> Optional[str]:
+    """Hash of the page's HTML and linked same-origin assets, or None if it can't be fetched."""
+    try:
+      response = requests.get(url, timeout=FINGERPRINT_TIMEOUT)
+      response.raise_for_status()
+    except requests.RequestException as e:
+      print(f"⚠️ Could not fingerprint baseline {url}: {e}")
+      self.counters["fingerprint_failures"] += 1
+      return None
+
+    digest = hashlib.sha256(response.content)
+    # Dev servers often serve the same HTML shell for every build, so the bundles count too
+    soup = BeautifulSoup(response.text, "html.parser")
+    origin = urlparse(url).netloc
+    assets = [tag.get("src") for tag in soup.find_all("script", src=True)]
+    assets += [tag.get("href") for tag in soup.find_all("link", href=True) if "stylesheet" in (tag.get("rel") or [])]
+    for asset in assets[:FINGERPRINT_MAX_ASSETS]:
+      asset_url = urljoin(url, asset)
+      if urlparse(asset_url).netloc != origin:
+        continue
+      try:
+        asset_response = requests.get(asset_url, timeout=FINGERPRINT_TIMEOUT)
+        digest.update(asset_url.encode("utf-8"))
+        digest.update(asset_response.content)
+      except requests.RequestException:
+        digest.update(f"unavailable:{asset_url}".encode("utf-8"))
+    return digest.hexdigest()
+
+  def key(self, url: str, viewport: Dict, wait_until: str, wait_for_selector: Optional[str], version: str) -> str:
+    raw = json.dumps([url, viewport["width"], viewport["height"], wait_until, wait_for_selector, STYLE_PROPERTIES, version])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+  def _entry_dir(self, key: str) -> str:
+    return os.path.join(self.root, key)
+
+  def load(self, key: str, viewport: Dict) -> Optional[PageCapture]:
+    entry_dir = self._entry_dir(key)
+    meta_path = os.path.join(entry_dir, "meta.json")
+    try:
+      with open(meta_path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+      if time.time() - meta["captured_at"] > self.max_age_seconds:
+        raise FileNotFoundError(meta_path)
+      with open(os.path.join(entry_dir, "page.html"), "r", encoding="utf-8") as f:
+        html = f.read()
+      with open(os.path.join(entry_dir, "styles.json"), "r", encoding="utf-8") as f:
+        styles = json.load(f)
+      with open(os.path.join(entry_dir, "screenshot.png"), "rb") as f:
+        screenshot = f.read()
+    except (OSError, ValueError, KeyError):
+      self.counters["misses"] += 1
+      return None
+
+    os.utime(meta_path)  # most recently used entries survive pruning
+    self.counters["hits"] += 1
+    return PageCapture(url=meta["url"], viewport=viewport, html=html, screenshot=screenshot,
+                       styles=styles, style_properties=meta["style_properties"], from_baseline=True)
+
+  def save(self, key: str, capture: PageCapture, version: str):
+    entry_dir = self._entry_dir(key)
+    staging_dir = f"{entry_dir}.{os.getpid()}.{time.time_ns()}.tmp"
+    os.makedirs(staging_dir)
+    with open(os.path.join(staging_dir, "page.html"), "w", encoding="utf-8") as f:
+      f.write(capture.html)
+    with open(os.path.join(staging_dir, "styles.json"), "w", encoding="utf-8") as f:
+      json.dump(capture.styles, f)
+    with open(os.path.join(staging_dir, "screenshot.png"), "wb") as f:
+      f.write(capture.screenshot)
+    # meta.json last: an entry without it is never loaded
+    with open(os.path.join(staging_dir, "meta.json"), "w", encoding="utf-8") as f:
+      json.dump({
+        "url": capture.url,
+        "viewport": capture.viewport,
+        "version": version,
+        "style_properties": capture.style_properties,
+        "captured_at": time.time()
+      }, f)
+    shutil.rmtree(entry_dir, ignore_errors=True)
+    os.replace(staging_dir, entry_dir)
+    self.counters["stored"] += 1
+    self.prune()
+
+  def _entries(self) -> list:
+    """(last used, entry dir) for every stored entry, oldest first."""
+    if not os.path.isdir(self.root):
+      return []
+    entries = []
+    for name in os.listdir(self.root):
+      entry_dir = os.path.join(self.root, name)
+      meta_path = os.path.join(entry_dir, "meta.json")
+      if os.path.isfile(meta_path):
+        entries.append((os.path.getmtime(meta_path), entry_dir))
+      elif name.endswith(".tmp") and time.time() - os.path.getmtime(entry_dir) > 3600:
+        shutil.rmtree(entry_dir, ignore_errors=True)  # left behind by an interrupted save
+    return sorted(entries)
+
+  def prune(self) -> int:
+    """Drop expired entries and the least recently used ones beyond `max_entries`."""
+    entries = self._entries()
+    now = time.time()
+    expired = [entry_dir for last_used, entry_dir in entries if now - last_used > self.max_age_seconds]
+    kept = [entry_dir for last_used, entry_dir in entries if now - last_used <= self.max_age_seconds]
+    removed = expired + kept[:max(0, len(kept) - self.max_entries)]
+    for entry_dir in removed:
+      shutil.rmtree(entry_dir, ignore_errors=True)
+    return len(removed)
+
+  def clear(self) -> int:
+    entries = self._entries()
+    for _, entry_dir in entries:
+      shutil.rmtree(entry_dir, ignore_errors=True)
+    return len(entries)
+
+  def stats(self) -> dict:
+    return {
+      "root": self.root,
+      "entries": len(self._entries()),
+      "max_entries": self.max_entries,
+      "max_age_hours": self.max_age_seconds / 3600,
+      **self.counters
+    }
+
+
+def get_baseline_store() -> BaselineStore:
+  global _store
+  if _store is None:
+    _store = BaselineStore()
+  return _store
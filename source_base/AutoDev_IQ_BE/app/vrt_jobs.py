@@ -0,0 +1,168 @@
+import asyncio
+import glob
+import os
+import shutil
+import time
+import uuid
+from collections import OrderedDict
+from typing import List, Optional
+
+from config import config
+from app.vrt_runner import run_visual_regression_test
+
+OUTPUT_DIR_PREFIX = "temp_output_"
+
+_registry = None
+
+
+def sweep_output_dirs(keep: set, max_age_hours: float = config.VRT_OUTPUT_MAX_AGE_HOURS) -> int:
+  """Delete temp_output_* directories older than `max_age_hours` that no known job still serves."""
+  removed = 0
+  cutoff = time.time() - max_age_hours * 3600
+  for path in glob.glob(f"{OUTPUT_DIR_PREFIX}*"):
+    if path in keep or not os.path.isdir(path) or os.path.getmtime(path) > cutoff:
+      continue
+    shutil.rmtree(path, ignore_errors=True)
+    removed += 1
+  if removed:
+    print(f"🧹 Removed {removed} expired VRT output director{'y' if removed == 1 else 'ies'}")
+  return removed
+
+
+class VRTJob:
+  """
+  One visual regression run executing in the background.
+
+  Every progress event is kept, so any number of clients can subscribe at any time and replay
+  the run from the start; images are served from `report_dir` by file name.
+  """
+
+  def __init__(self, base_url: str, test_url: str, user_id: Optional[str] = None):
+    self.id = uuid.uuid4().hex
+    self.base_url = base_url
+    self.test_url = test_url
+    self.user_id = user_id
+    self.label = f"vrt_{int(time.time())}_{self.id[:8]}"
+    self.output_dir = f"{OUTPUT_DIR_PREFIX}{self.label}"
+    self.report_dir = os.path.join(self.output_dir, "html_report")
+    self.status = "queued"
+    self.created_at = time.time()
+    self.finished_at = None
+    self.result = None
+    self.error = None
+    self.events: List[dict] = []
+    self._updated = asyncio.Condition()
+    self._task = None
+
+  @property
+  def done(self) -> bool:
+    return self.status in ("completed", "failed")
+
+  def image_url(self, name: str) -> str:
+    return f"/vrt/jobs/{self.id}/images/{name}"
+
+  def image_path(self, name: str) -> Optional[str]:
+    """Path of an image this job wrote, or None (also for anything that isn't a plain file name)."""
+    if os.path.basename(name) != name or not name.endswith(".png"):
+      return None
+    path = os.path.join(self.report_dir, name)
+    return path if os.path.isfile(path) else None
+
+  async def emit(self, event_type: str, content):
+    self.events.append({"type": event_type, "content": content, "timestamp": time.time()})
+    async with self._updated:
+      self._updated.notify_all()
+
+  async def run(self, **options):
+    self.status = "running"
+    await self.emit("start", {"job_id": self.id, "label": self.label,
+                              "base_url": self.base_url, "test_url": self.test_url})
+    try:
+      self.result = await run_visual_regression_test(
+          self.base_url, self.test_url, label=self.label, user_id=self.user_id,
+          emit=self.emit, image_url=self.image_url, report_dir=self.report_dir, **options
+      )
+      self.status = "completed"
+      self.finished_at = time.time()
+      await self.emit("complete", self.result)
+    except Exception as e:
+      print(f"❌ VRT job {self.id} failed: {e}")
+      self.error = str(e)
+      self.status = "failed"
+      self.finished_at = time.time()
+      await self.emit("error", self.error)
+
+  def start(self, **options):
+    self._task = asyncio.create_task(self.run(**options))
+
+  async def wait(self):
+    if self._task is not None:
+      await asyncio.shield(self._task)
+
+  async def stream_events(self, start: int = 0):
+    """Yield the job's events from index `start` on, waiting for new ones until the job is done."""
+    index = start
+    while True:
+      async with self._updated:
+        await self._updated.wait_for(lambda: len(self.events) > index or self.done)
+      while index < len(self.events):
+        yield self.events[index]
+        index += 1
+      if self.done and index >= len(self.events):
+        return
+
+  def summary(self) -> dict:
+    return {
+      "job_id": self.id,
+      "label": self.label,
+      "status": self.status,
+      "base_url": self.base_url,
+      "test_url": self.test_url,
+      "created_at": self.created_at,
+      "finished_at": self.finished_at,
+      "events": len(self.events),
+      "events_url": f"/vrt/jobs/{self.id}/events",
+      "result": self.result,
+      "error": self.error
+    }
+
+
+class VRTJobRegistry:
+  """
+  In-memory index of VRT jobs. Beyond `max_jobs` the oldest finished jobs are forgotten together
+  with their output directories, and stray output directories past their retention age are swept.
+  """
+
+  def __init__(self, max_jobs: int = config.VRT_MAX_JOBS):
+    self.max_jobs = max(1, max_jobs)
+    self._jobs: "OrderedDict[str, VRTJob]" = OrderedDict()
+
+  def start(self, base_url: str, test_url: str, user_id: Optional[str] = None, **options) -> VRTJob:
+    job = VRTJob(base_url, test_url, user_id)
+    self._jobs[job.id] = job
+    self._prune()
+    sweep_output_dirs({known.output_dir for known in self._jobs.values()})
+    job.start(**options)
+    return job
+
+  def get(self, job_id: str) -> Optional[VRTJob]:
+    return self._jobs.get(job_id)
+
+  def summaries(self) -> List[dict]:
+    return [
+      {key: value for key, value in job.summary().items() if key != "result"}
+      for job in reversed(self._jobs.values())
+    ]
+
+  def _prune(self):
+    finished = [job_id for job_id, job in self._jobs.items() if job.done]
+    while len(self._jobs) > self.max_jobs and finished:
+      job = self._jobs.pop(finished.pop(0))
+      shutil.rmtree(job.output_dir, ignore_errors=True)
+
+
+def get_vrt_jobs() -> VRTJobRegistry:
+  global _registry
+  if _registry is None:
+    _registry = VRTJobRegistry()
+  return _registry
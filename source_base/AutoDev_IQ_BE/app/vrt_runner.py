@@ -1,143 +1,140 @@
-import subprocess
+import io
 import os
-import json
-import sys
 import time
-import base64
 
-from fastapi import HTTPException
+from PIL import Image
+from starlette.concurrency import run_in_threadpool
+
+from config import config
+from app.browser_pool import parse_viewports
+from app.dom import capture_pages, diff_captures
+from app.pixel_diff import compare_screenshots
+from app.VisualLama import analyze_changes
+
+IMAGE_KINDS = ("base", "test", "diff")
+
+
+def make_thumbnail(png: bytes, width: int = config.VRT_THUMBNAIL_WIDTH) -> bytes:
+  """Downscaled PNG of a (usually tall, full-page) screenshot, keeping its aspect ratio."""
+  image = Image.open(io.BytesIO(png))
+  image.thumbnail((width, width * 8))
+  buffer = io.BytesIO()
+  image.save(buffer, format="PNG", optimize=True)
+  return buffer.getvalue()
+
+
+def write_viewport_images(report_dir, viewport_label, base_capture, test_capture, pixel_diff):
+  """Write a viewport's base/test/diff screenshots and their thumbnails; returns kind -> file name."""
+  os.makedirs(report_dir, exist_ok=True)
+  images = {"base": base_capture.screenshot, "test": test_capture.screenshot, "diff": pixel_diff.diff_image}
+  names = {}
+  for kind, data in images.items():
+    for suffix, content in (("", data), ("_thumbnail", make_thumbnail(data))):
+      name = f"{viewport_label}_{kind}{suffix}.png"
+      with open(os.path.join(report_dir, name), "wb") as f:
+        f.write(content)
+      names[f"{kind}{suffix}"] = name
+  return names
+
+
+def write_html_report(report_dir, label, pixel_diffs, image_names):
+  """Static report with each viewport's base/test/diff thumbnails (linking to full size) and mismatch summary."""
+  sections = []
+  for viewport_label, pixel_diff in pixel_diffs.items():
+    names = image_names[viewport_label]
+    status = "passed" if pixel_diff.passed else "failed"
+    sections.append(
+      f"<h2>{viewport_label}: {status} ({pixel_diff.mismatch_percentage}% mismatch, "
+      f"{len(pixel_diff.regions)} region(s))</h2>"
+      + "".join(f'<figure><a href="{names[kind]}"><img src="{names[kind + "_thumbnail"]}"></a>'
+                f'<figcaption>{kind}</figcaption></figure>'
+                for kind in IMAGE_KINDS)
+    )
+
+  report_path = os.path.join(report_dir, "index.html")
+  with open(report_path, "w", encoding="utf-8") as f:
+    f.write(f"<html><head><title>VRT {label}</title></head><body><h1>VRT {label}</h1>{''.join(sections)}</body></html>")
+  return report_path
+
 
+async def _no_emit(event_type, content):
+  return None
 
-def encode_image_to_base64(path):
-  if not path or not os.path.exists(path):
-    return None
-  with open(path, "rb") as image_file:
-    return base64.b64encode(image_file.read()).decode("utf-8")
 
+async def run_visual_regression_test(base_url, test_url, label=None, user_id=None, viewports=None,
+                                     wait_until=config.VRT_WAIT_UNTIL, wait_for_selector=None,
+                                     baseline_version=None, refresh_baseline=False,
+                                     emit=None, image_url=None, report_dir=None):
+  """
+  Capture, diff and analyze base vs test, reporting progress through `emit(event_type, content)`.
 
-async def run_visual_regression_test(base_url, test_url, label=None):
+  Screenshots are written to `report_dir` (full size and thumbnails) and referenced through
+  `image_url(file_name)` rather than inlined; by default that is the file's path on disk.
+  """
   timestamp = str(int(time.time()))
   label = label or f"vrt_{timestamp}"
-  temp_dir = f"temp_output_{timestamp}"
-  os.makedirs(temp_dir, exist_ok=True)
-
-  # 🧪 Backstop.js configuration with no-sandbox fix
-  backstop_config = {
-    "id": f"vrt_test_{timestamp}",
-    "viewports": [{"label": "desktop", "width": 1366, "height": 768}],
-    "scenarios": [{
-      "label": "Visual Test",
-      "url": test_url,
-      "referenceUrl": base_url,
-      "misMatchThreshold": 0.1,
-      "requireSameDimensions": True,
-      "engine": "puppeteer",
-      "engineOptions": {
-        "args": ["--no-sandbox", "--disable-setuid-sandbox"]
-      }
-    }],
-    "paths": {
-      "bitmaps_reference": f"{temp_dir}/backstop_data/bitmaps_reference",
-      "bitmaps_test": f"{temp_dir}/backstop_data/bitmaps_test",
-      "engine_scripts": f"{temp_dir}/backstop_data/engine_scripts",
-      "html_report": f"{temp_dir}/html_report",
-      "ci_report": f"{temp_dir}/backstop_data/ci_report"
-    },
-    "report": ["browser"],
-    "engine": "puppeteer",
-    "engineOptions": {
-      "args": ["--no-sandbox", "--disable-setuid-sandbox"]
-    }
-  }
-
-  config_path = os.path.join(temp_dir, "backstop.json")
-  with open(config_path, "w") as f:
-    json.dump(backstop_config, f, indent=2)
-
-  # Run Backstop reference creation
-  subprocess.run(f"npx backstop reference --configPath={config_path}", shell=True, check=True)
-  result = subprocess.run(f"npx backstop test --configPath={config_path} --no-open", shell=True, capture_output=True, text=True)
-
-  # 🎯 Extract screenshots
-  ref_dir = backstop_config["paths"]["bitmaps_reference"]
-  test_dir = backstop_config["paths"]["bitmaps_test"]
-  base_img = test_img = diff_img = None
-
-  for root, _, files in os.walk(test_dir):
-    for fname in files:
-      if fname.endswith(".png"):
-        if fname.startswith("failed_diff_"):
-          diff_img = os.path.join(root, fname)
-        elif "document_0_desktop.png" in fname:
-          test_img = os.path.join(root, fname)
-
-  for fname in os.listdir(ref_dir):
-    if fname.endswith(".png"):
-      base_img = os.path.join(ref_dir, fname)
-
-  # 🚀 Run DOM diff and capture JSON
-  try:
-    dom_script = os.path.join("app", "dom.py")
-    subprocess.run(
-        ["python", dom_script, base_url, test_url, label],
-        capture_output=True,
-        text=True,
-        encoding="utf-8",
-        check=True
-    )
-    print("DOM script executed successfully.")
-
-    output_path = os.path.join("app", "dom_diffs", f"{label}.json")
-    if not os.path.exists(output_path):
-      raise FileNotFoundError(f"Diff output file not found: {output_path}")
-
-    with open(output_path, "r", encoding="utf-8") as f:
-      dom_json_output = json.load(f)
-
-  except subprocess.CalledProcessError as e:
-    print(" DOM script failed:")
-    print("STDOUT:\n", e.stdout)
-    print("STDERR:\n", e.stderr)
-    raise RuntimeError(f"DOM diff script failed:\n{e.stderr}") from e
-
-  # 🧠 Pass DOM diff to LLaMA enrichment
-  try:
-    result = subprocess.run(
-        ["python", "VisualLama.py", label],
-        capture_output=True,
-        text=True,
-        cwd="app",  # adjust if your script is inside the `app/` folder
-        check=True
+  viewports = viewports or parse_viewports(config.VRT_VIEWPORTS)
+  report_dir = report_dir or os.path.join(f"temp_output_{timestamp}", "html_report")
+  emit = emit or _no_emit
+  image_url = image_url or (lambda name: os.path.join(report_dir, name))
+
+  # 🚀 One visit per URL and viewport yields screenshot, DOM and computed styles, all captured concurrently
+  await emit("stage", {"stage": "capture", "viewports": [viewport["label"] for viewport in viewports]})
+  captures = await capture_pages(base_url, test_url, viewports, wait_until, wait_for_selector,
+                                 baseline_version, refresh_baseline)
+  baseline_reused = [label for label, (base_capture, _) in captures.items() if base_capture.from_baseline]
+  if baseline_reused:
+    print(f"♻️ Reused stored baseline for {', '.join(baseline_reused)}")
+  await emit("baseline", {"reused": baseline_reused})
+
+  await emit("stage", {"stage": "dom_diff"})
+  dom_json_output = await run_in_threadpool(diff_captures, captures)
+  print(f"DOM diff found {len(dom_json_output)} change(s) across {len(captures)} viewport(s).")
+  await emit("dom_diff", {"changes": len(dom_json_output)})
+
+  # 🎯 Native pixel diff of the captured screenshots (NumPy work, kept off the event loop)
+  await emit("stage", {"stage": "pixel_diff"})
+  pixel_diffs = {}
+  image_names = {}
+  images = {}
+  for viewport_label, (base_capture, test_capture) in captures.items():
+    pixel_diff = await run_in_threadpool(compare_screenshots, base_capture.screenshot, test_capture.screenshot)
+    names = await run_in_threadpool(
+        write_viewport_images, report_dir, viewport_label, base_capture, test_capture, pixel_diff
     )
-    enriched_json = json.loads(result.stdout)  # ✅ map result to enriched_json
-
-  except subprocess.CalledProcessError as e:
-    print("❌ Subprocess failed.")
-    print("STDERR:", e.stderr)
-    print("STDOUT:", e.stdout)
-    return {
-      "label": label,
-      "error": "Subprocess failed while calling AI analysis.",
-      "stderr": e.stderr,
-      "stdout": e.stdout
-    }
-
-  except json.JSONDecodeError as e:
-    print("❌ Failed to parse JSON output.")
-    print("Raw output:", result.stdout)
-    return {
-      "label": label,
-      "error": "Invalid JSON returned from subprocess.",
-      "raw_output": result.stdout
-    }
+    pixel_diffs[viewport_label] = pixel_diff
+    image_names[viewport_label] = names
+    images[viewport_label] = {kind: image_url(name) for kind, name in names.items()}
+    print(f"🖼️ {viewport_label}: {pixel_diff.mismatch_percentage}% pixels changed")
+    await emit("pixel_diff", {"viewport": viewport_label, **pixel_diff.to_dict(), "images": images[viewport_label]})
+
+  # 🧠 Pass DOM diff to LLaMA enrichment; suggestions are reported as each batch comes back
+  await emit("stage", {"stage": "analysis"})
+
+  async def emit_suggestions(changes):
+    await emit("suggestions", changes)
+
+  enriched_json = await analyze_changes(label, dom_json_output, user_id, on_fixes=emit_suggestions)
+
+  await emit("stage", {"stage": "report"})
+  html_report = await run_in_threadpool(write_html_report, report_dir, label, pixel_diffs, image_names)
+
+  primary = viewports[0]["label"]
+  all_passed = all(pixel_diff.passed for pixel_diff in pixel_diffs.values())
 
   # ✅ Final return block with enriched_json now mapped
   return {
     "label": label,
-    "message": "VRT and AI completed." if result.returncode == 0 else "VRT done with visual mismatches.",
-    "html_report": f"{temp_dir}/html_report/index.html",
-    "base_image": encode_image_to_base64(base_img),
-    "test_image": encode_image_to_base64(test_img),
-    "diff_image": encode_image_to_base64(diff_img),
+    "message": "VRT and AI completed." if all_passed else "VRT done with visual mismatches.",
+    "html_report": html_report,
+    "base_image": images[primary]["base"],
+    "test_image": images[primary]["test"],
+    "diff_image": images[primary]["diff"],
+    "base_thumbnail": images[primary]["base_thumbnail"],
+    "test_thumbnail": images[primary]["test_thumbnail"],
+    "diff_thumbnail": images[primary]["diff_thumbnail"],
+    "images": images,
+    "baseline_reused": baseline_reused,
+    "pixel_diff": {viewport_label: pixel_diff.to_dict() for viewport_label, pixel_diff in pixel_diffs.items()},
     "llama_output": enriched_json  # ✅ mapped correctly
   }
@@ -4,11 +4,84 @@ import os
 class Config:
     def __init__(self):
         self.MODEL_NAME = os.getenv("MODEL_NAME", "llama3.2:latest")
+
+        # Embeddings and generation can run on different Ollama models; both fall back to MODEL_NAME.
+        # Projects indexed before this split were embedded with MODEL_NAME: pointing EMBEDDING_MODEL_NAME
+        # at another model (e.g. nomic-embed-text:latest) requires POST /reembed for each of them.
+        self.GENERATION_MODEL_NAME = os.getenv("GENERATION_MODEL_NAME", self.MODEL_NAME)
+        self.EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", self.MODEL_NAME)
+
         self.CHROMA_DIR = os.getenv("CHROMA_DIR", "./indexed_projects")
+        # Upper bound on vectors held by open Chroma clients before least recently used projects are closed
+        self.MAX_RESIDENT_VECTORS = int(os.getenv("MAX_RESIDENT_VECTORS", 200000))
 
         # Make Ollama host dynamic for Docker/local
         self.OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
 
+        # Seconds Ollama keeps a model resident after a call (-1 keeps it loaded indefinitely)
+        self.OLLAMA_KEEP_ALIVE = int(os.getenv("OLLAMA_KEEP_ALIVE", 1800))
+        self.WARM_UP_MODELS = os.getenv("WARM_UP_MODELS", "true").lower() == "true"
+
+        # Adaptive retrieval: grow k in batches until chunk distances jump away from the best match
+        self.ADAPTIVE_MIN_DOCS = int(os.getenv("ADAPTIVE_MIN_DOCS", 3))
+        self.ADAPTIVE_MAX_DOCS = int(os.getenv("ADAPTIVE_MAX_DOCS", 40))
+        self.ADAPTIVE_BATCH_SIZE = int(os.getenv("ADAPTIVE_BATCH_SIZE", 8))
+        self.ADAPTIVE_SCORE_RATIO = float(os.getenv("ADAPTIVE_SCORE_RATIO", 1.35))
+        self.ADAPTIVE_SCORE_GAP = float(os.getenv("ADAPTIVE_SCORE_GAP", 0.15))
+
+        # Lines of unchanged code embedded around each changed hunk of a feature branch file
+        self.HUNK_CONTEXT_LINES = int(os.getenv("HUNK_CONTEXT_LINES", 15))
+
+        # Answers abandoned mid-stream are discarded unless this is set; cached partials carry a truncation note
+        self.CACHE_PARTIAL_ANSWERS = os.getenv("CACHE_PARTIAL_ANSWERS", "false").lower() == "true"
+
+        # Generations admitted to Ollama at once (match OLLAMA_NUM_PARALLEL) and interactive requests allowed to queue
+        self.LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 2))
+        self.LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", 16))
+
+        # Files of one feature whose unit tests are generated concurrently by the batch endpoint
+        self.UNIT_TEST_CONCURRENCY = int(os.getenv("UNIT_TEST_CONCURRENCY", 2))
+
+        # Shared headless Chromium for VRT captures: concurrent pages and per-navigation timeout
+        self.BROWSER_POOL_SIZE = int(os.getenv("BROWSER_POOL_SIZE", 4))
+        self.BROWSER_NAVIGATION_TIMEOUT_MS = int(os.getenv("BROWSER_NAVIGATION_TIMEOUT_MS", 30000))
+
+        # VRT capture defaults: viewports as 'label:WxH,...', Playwright wait_until and an optional ready selector
+        self.VRT_VIEWPORTS = os.getenv("VRT_VIEWPORTS", "desktop:1366x768")
+        self.VRT_WAIT_UNTIL = os.getenv("VRT_WAIT_UNTIL", "domcontentloaded")
+        self.VRT_WAIT_FOR_SELECTOR = os.getenv("VRT_WAIT_FOR_SELECTOR") or None
+
+        # Computed styles captured per visible element and diffed between base and test (comma-separated)
+        self.VRT_STYLE_PROPERTIES = os.getenv(
+            "VRT_STYLE_PROPERTIES",
+            "display,position,top,left,right,bottom,width,height,margin,padding,border,border-radius,"
+            "box-shadow,color,background-color,background-image,font-family,font-size,font-weight,"
+            "font-style,line-height,letter-spacing,text-align,text-decoration,text-transform,opacity,"
+            "visibility,z-index,overflow,flex-direction,justify-content,align-items,gap,transform"
+        )
+        self.VRT_STYLE_MAX_ELEMENTS = int(os.getenv("VRT_STYLE_MAX_ELEMENTS", 5000))
+
+        # AI analysis of VRT changes: change groups per prompt, prompts in flight per run, cached fixes
+        self.VRT_ANALYSIS_BATCH_SIZE = int(os.getenv("VRT_ANALYSIS_BATCH_SIZE", 8))
+        self.VRT_ANALYSIS_CONCURRENCY = int(os.getenv("VRT_ANALYSIS_CONCURRENCY", 2))
+        self.VRT_ANALYSIS_CACHE_SIZE = int(os.getenv("VRT_ANALYSIS_CACHE_SIZE", 1000))
+
+        # VRT jobs: finished jobs kept for status/image requests, and thumbnail width of served screenshots
+        self.VRT_MAX_JOBS = int(os.getenv("VRT_MAX_JOBS", 50))
+        self.VRT_THUMBNAIL_WIDTH = int(os.getenv("VRT_THUMBNAIL_WIDTH", 320))
+
+        # Reused base-side captures (per base URL, viewport and fingerprint/version) and output retention
+        self.VRT_BASELINE_DIR = os.getenv("VRT_BASELINE_DIR", "vrt_baselines")
+        self.VRT_BASELINE_MAX_AGE_HOURS = float(os.getenv("VRT_BASELINE_MAX_AGE_HOURS", 24))
+        self.VRT_BASELINE_MAX_ENTRIES = int(os.getenv("VRT_BASELINE_MAX_ENTRIES", 100))
+        self.VRT_OUTPUT_MAX_AGE_HOURS = float(os.getenv("VRT_OUTPUT_MAX_AGE_HOURS", 72))
+
+        # Screenshot comparison: YIQ colour tolerance (0-1), allowed mismatch %, region grouping cell and cap
+        self.PIXEL_DIFF_TOLERANCE = float(os.getenv("PIXEL_DIFF_TOLERANCE", 0.1))
+        self.PIXEL_DIFF_MISMATCH_THRESHOLD = float(os.getenv("PIXEL_DIFF_MISMATCH_THRESHOLD", 0.1))
+        self.PIXEL_DIFF_REGION_BLOCK = int(os.getenv("PIXEL_DIFF_REGION_BLOCK", 16))
+        self.PIXEL_DIFF_MAX_REGIONS = int(os.getenv("PIXEL_DIFF_MAX_REGIONS", 50))
+
         self.TEMPERATURE = float(os.getenv("TEMPERATURE", 0.5))
         self.MAX_TOKENS = int(os.getenv("MAX_TOKENS", 1024))
 
@@ -1,6 +1,7 @@
 import subprocess
 
-from fastapi import FastAPI, HTTPException
+import threading
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import uvicorn
@@ -12,17 +13,26 @@ import stat
 import pathlib
 from typing import Optional, List
 from git import Repo, GitCommandError
-from starlette.responses import StreamingResponse
+from starlette.responses import FileResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 
 from config import config
-from app.processor import process_project, process_project_diff, get_file_diff
+from app.processor import process_project, process_project_diff, reembed_project
 from app.utils import get_cache_statistics, clear_project_cache, clear_embedding_cache, clear_all_cache
 from app.qa import answer_question_stream
-from app.qa import generate_unit_tests_from_feature
+from app.qa import generate_unit_tests_from_feature, generate_unit_tests_for_feature, stream_unit_test_from_feature
 from app.background_qa_generator import start_background_qa_generation
 from app.reactRunner import run_react_in_docker, stop_docker_container
 from app.unit_test import UnitTest
-from app.vrt_runner import run_visual_regression_test
+from app.vrt_jobs import get_vrt_jobs
+from app.vrt_baselines import get_baseline_store
+from app.browser_pool import close_browser_pool, get_browser_pool
+from app.model_warmup import start_model_warmup, get_model_residency
+from app.vector_store import get_store_registry, invalidate_project_store
+from app.feature_overlay import FeatureOverlay, list_feature_overlays, make_feature_id
+from app.git_worktrees import fetch_origin
+from app.diff_service import BranchDiffService
+from app.llm_scheduler import PRIORITY_BATCH, PRIORITY_INTERACTIVE, QueueFullError, get_llm_scheduler
 
 app = FastAPI()
 
@@ -34,6 +44,15 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+def warm_models_on_startup():
+  if config.WARM_UP_MODELS:
+    start_model_warmup()
+
+@app.on_event("shutdown")
+async def close_browsers_on_shutdown():
+  await close_browser_pool()
+
 # Directories
 
 PROJECTS_DIR = config.CHROMA_DIR
@@ -52,14 +71,28 @@ class QuestionRequest(BaseModel):
   question: str
   max_docs: int = 5
   prompt_type: str = "code_prompt"
+  retrieval_mode: str = "adaptive"  # "adaptive" (relevance cutoff) or "fixed" (max_docs heuristics)
+  user_id: Optional[str] = None  # fairness key for the LLM scheduler; defaults to the client address
+
+class ReembedRequest(BaseModel):
+  project_id: str
 
 class FeatureUploadRequest(BaseModel):
   project_id: str
   feature_branch: str
 
+class FeatureOverlayRequest(BaseModel):
+  feature_id: str
+
 class FeatureTestRequest(BaseModel):
   project_id: str
   file_name: str# e.g., "product-service__feature_price-update"
+  user_id: Optional[str] = None
+
+class FeatureBatchTestRequest(BaseModel):
+  feature_id: str
+  file_names: Optional[List[str]] = None  # repo-relative paths; defaults to every changed file of the feature
+  user_id: Optional[str] = None
 
 class ReactRunnerRequest(BaseModel):
   project_id: str
@@ -94,6 +127,12 @@ class UnitTestResponse(BaseModel):
 class URLPayload(BaseModel):
   base_url: str
   test_url: str
+  user_id: Optional[str] = None
+  viewports: Optional[List[dict]] = None  # [{"label": "mobile", "width": 375, "height": 812}, ...]
+  wait_until: str = config.VRT_WAIT_UNTIL  # "domcontentloaded", "load" or "networkidle"
+  wait_for_selector: Optional[str] = None  # wait until this selector is visible before capturing
+  baseline_version: Optional[str] = None  # reuse base captures stored under this version (default: content fingerprint)
+  refresh_baseline: bool = False  # capture the base side even if a stored baseline matches
 
 class CloneFeatureBranchRequest(BaseModel):
   git_url: str
@@ -101,6 +140,42 @@ class CloneFeatureBranchRequest(BaseModel):
 
 # Functions
 
+def request_user(user_id: Optional[str], request: Request) -> str:
+  return user_id or (request.client.host if request.client else "anonymous")
+
+def ensure_llm_capacity(priority: int = PRIORITY_INTERACTIVE):
+  """Reject with 429 up front, before a streaming response has committed to a 200 status."""
+  try:
+    get_llm_scheduler().check_admission(priority)
+  except QueueFullError as e:
+    raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "5"})
+
+async def iterate_until_disconnect(request: Request, iterator, cancel_event: threading.Event):
+  """
+  Pull items from a blocking iterator in the threadpool, one at a time, until the client goes away.
+
+  If the client disconnects (or the response is torn down) before the iterator is exhausted,
+  `cancel_event` is set so the producer stops at its next token instead of generating for nobody.
+  """
+  sentinel = object()
+  finished = False
+  try:
+    while not await request.is_disconnected():
+      item = await run_in_threadpool(next, iterator, sentinel)
+      if item is sentinel:
+        finished = True
+        return
+      yield item
+    print("🔌 Client disconnected, cancelling generation")
+  finally:
+    if not finished:
+      cancel_event.set()
+      # Release the producer (and its LLM slot) now; if it is mid-token in a worker thread it stops on its own
+      try:
+        iterator.close()
+      except ValueError:
+        pass
+
 def load_users() -> list:
     try:
         if not USERS_FILE.exists():
@@ -187,54 +262,72 @@ async def upload_feature(req: FeatureUploadRequest):
     if not os.path.exists(project_path):
       raise HTTPException(status_code=404, detail="Main project not uploaded yet.")
 
-    repo = Repo(project_path)
-    repo.remotes.origin.fetch()
+    await run_in_threadpool(fetch_origin, project_path)
 
-    # Checkout the feature branch
-    if req.feature_branch not in repo.heads:
-      repo.git.checkout("-b", req.feature_branch, f"origin/{req.feature_branch}")
-    else:
-      repo.git.checkout(req.feature_branch)
-
-    # Get list of changed files (JavaScript/Java)
-    changed_files_output = repo.git.diff("main...HEAD", name_only=True).splitlines()
-    changed_files = [
-      os.path.join(project_path, f.strip())
-      for f in changed_files_output
-      if f.endswith((".java", ".js", ".jsx", ".ts", ".tsx"))
-    ]
+    def load_branch_changes():
+      # Base branch comes from metadata.json; contents are read from git objects, nothing is checked out
+      diff_service = BranchDiffService(project_path, req.feature_branch)
+      return diff_service.load_changes()
 
-    if not changed_files:
+    changes = await run_in_threadpool(load_branch_changes)
+    if not changes:
       raise HTTPException(status_code=400, detail="No code files changed in feature branch.")
 
-    # Read full content of changed files
-    file_content_map = {}
-    filenames_only = []
-    for file_path in changed_files:
-      try:
-        with open(file_path, "r", encoding="utf-8") as f:
-          file_content_map[file_path] = f.read()
-          filenames_only.append(os.path.basename(file_path))
-      except Exception as e:
-        print(f"⚠️ Skipped unreadable file: {file_path}, error: {e}")
+    for change in changes:
+      if change["status"] != "D" and change["feature_content"] is None:
+        print(f"⚠️ Skipped unreadable file: {change['path']}")
+    changes = [c for c in changes if c["status"] == "D" or c["feature_content"] is not None]
+    # Repo-relative paths: same-named files in different directories stay distinct
+    changed_paths = [c["path"] for c in changes if c["status"] != "D"]
 
-    if not file_content_map:
+    if not changes:
       raise HTTPException(status_code=400, detail="No readable changed files.")
 
     # Construct feature_id and pass to processor
-    feature_id = f"{req.project_id}__{req.feature_branch.replace('/', '_')}"
-    process_project_diff(file_content_map, feature_id)
+    feature_id = make_feature_id(req.project_id, req.feature_branch)
+    await run_in_threadpool(process_project_diff, changes, feature_id)
 
     return {
       "status": "success",
-      "files_changed": len(file_content_map),
+      "files_changed": len(changed_paths),
       "feature_id": feature_id,
-      "file_names": filenames_only,
+      "file_names": changed_paths,
     }
 
   except Exception as e:
     raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/reembed")
+async def reembed(req: ReembedRequest):
+  try:
+    print(f"♻️ Re-embedding {req.project_id} with {config.EMBEDDING_MODEL_NAME}")
+    reembed_project(req.project_id)
+    return {"status": "success", "project_id": req.project_id, "embedding_model": config.EMBEDDING_MODEL_NAME}
+  except FileNotFoundError as e:
+    raise HTTPException(status_code=404, detail=str(e))
+  except Exception as e:
+    raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/feature-overlays")
+async def get_feature_overlays(project_id: str):
+  try:
+    return {"project_id": project_id, "feature_ids": list_feature_overlays(project_id)}
+  except Exception as e:
+    raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/feature-overlays/delete")
+async def delete_feature_overlay(req: FeatureOverlayRequest):
+  try:
+    overlay = FeatureOverlay.from_feature_id(req.feature_id)
+    if overlay is None or not overlay.exists():
+      raise HTTPException(status_code=404, detail=f"No feature overlay found for: {req.feature_id}")
+    overlay.drop()
+    return {"status": "success", "feature_id": req.feature_id}
+  except HTTPException:
+    raise
+  except Exception as e:
+    raise HTTPException(status_code=500, detail=str(e))
+
 @app.post("/clone-feature-branch")
 async def clone_feature_branch_and_run(req: CloneFeatureBranchRequest):
   try:
@@ -246,6 +339,7 @@ async def clone_feature_branch_and_run(req: CloneFeatureBranchRequest):
     target_path = os.path.join(PROJECTS_DIR, project_id)
 
     if os.path.exists(target_path):
+      invalidate_project_store(project_id)
       remove_directory(target_path)
 
     print(f"🔄 Cloning {req.git_url} (branch: {req.branch}) into {target_path}")
@@ -264,20 +358,39 @@ async def clone_feature_branch_and_run(req: CloneFeatureBranchRequest):
 
 
 @app.post("/askStream")
-async def ask_question_with_stream(req: QuestionRequest):
-  
-  def response_generator():
+async def ask_question_with_stream(req: QuestionRequest, request: Request):
+
+  ensure_llm_capacity(PRIORITY_INTERACTIVE)
+  user_id = request_user(req.user_id, request)
+  cancel_event = threading.Event()
+
+  async def response_generator():
     try:
       # Get the token stream from your QA function
+      retrieval_stats = {}
+      stats_sent = False
       token_stream = answer_question_stream(
           req.project_id,
           req.question,
           req.max_docs,
-          req.prompt_type
+          req.prompt_type,
+          req.retrieval_mode,
+          retrieval_stats,
+          cancel_event,
+          PRIORITY_INTERACTIVE,
+          user_id
       )
-      
-      # Stream each token as it arrives
-      for token in token_stream:
+
+      # Stream each token as it arrives; a disconnected client cancels the generation upstream
+      async for token in iterate_until_disconnect(request, token_stream, cancel_event):
+        if retrieval_stats and not stats_sent:
+          stats_sent = True
+          stats_data = {
+              "type": "retrieval_stats",
+              "content": retrieval_stats,
+              "timestamp": time.time()
+          }
+          yield f"data: {json.dumps(stats_data)}\n\n"
         if token:  # Only send non-empty tokens
           # Format as Server-Sent Events (SSE)
           data = {
@@ -286,7 +399,10 @@ async def ask_question_with_stream(req: QuestionRequest):
               "timestamp": time.time()
           }
           yield f"data: {json.dumps(data)}\n\n"
-      
+
+      if cancel_event.is_set():
+        return
+
       # Send completion signal
       completion_data = {
           "type": "complete",
@@ -326,7 +442,8 @@ async def ask_question_stream(req: QuestionRequest):
         req.project_id,
         req.question,
         req.max_docs,
-        req.prompt_type
+        req.prompt_type,
+        req.retrieval_mode
     )
     return StreamingResponse(token_generator, media_type="application/json")
   except Exception as e:
@@ -375,7 +492,8 @@ def list_all_projects():
             "project_id": project_id,
             "git_url": metadata.get("git_url", "unknown"),
             "project_type": metadata.get("project_type", "unknown"),
-            "main_branch": metadata.get("main_branch", "main")
+            "main_branch": metadata.get("main_branch", "main"),
+            "embedding_model": metadata.get("embedding_model", config.MODEL_NAME)
           })
       except Exception as e:
         continue  # Skip broken metadata files
@@ -383,15 +501,126 @@ def list_all_projects():
   return {"projects": projects}
 
 @app.post("/generate-unit-test")
-async def generate_unit_test(req: FeatureTestRequest):
+async def generate_unit_test(req: FeatureTestRequest, request: Request):
   try:
-    tests = generate_unit_tests_from_feature(req.project_id, req.file_name)
+    tests = await run_in_threadpool(
+        generate_unit_tests_from_feature, req.project_id, req.file_name, request_user(req.user_id, request)
+    )
     return {"status": "success", "tests": tests}
   except FileNotFoundError as e:
     raise HTTPException(status_code=404, detail=str(e))
+  except QueueFullError as e:
+    raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "5"})
   except Exception as e:
     raise HTTPException(status_code=500, detail=str(e))
   
+@app.post("/generate-unit-test/stream")
+async def generate_unit_test_stream(req: FeatureTestRequest, request: Request):
+  overlay = FeatureOverlay.from_feature_id(req.project_id)
+  if overlay is None or not overlay.exists():
+    raise HTTPException(status_code=404, detail=f"No feature index found for: {req.project_id}")
+
+  ensure_llm_capacity(PRIORITY_INTERACTIVE)
+  user_id = request_user(req.user_id, request)
+  cancel_event = threading.Event()
+
+  async def token_generator():
+    try:
+      token_stream = stream_unit_test_from_feature(req.project_id, req.file_name, cancel_event, user_id)
+      async for token in iterate_until_disconnect(request, token_stream, cancel_event):
+        if token:
+          data = {
+              "type": "token",
+              "content": str(token),
+              "timestamp": time.time()
+          }
+          yield f"data: {json.dumps(data)}\n\n"
+
+      if not cancel_event.is_set():
+        completion_data = {
+            "type": "complete",
+            "content": "",
+            "timestamp": time.time()
+        }
+        yield f"data: {json.dumps(completion_data)}\n\n"
+
+    except Exception as e:
+      error_data = {
+          "type": "error",
+          "content": str(e),
+          "timestamp": time.time()
+      }
+      yield f"data: {json.dumps(error_data)}\n\n"
+
+  return StreamingResponse(
+      token_generator(),
+      media_type="text/event-stream",
+      headers={
+          "Cache-Control": "no-cache",
+          "Connection": "keep-alive",
+          "Access-Control-Allow-Origin": "*",
+          "Access-Control-Allow-Headers": "*",
+      }
+  )
+
+@app.post("/generate-unit-tests")
+async def generate_unit_tests_batch(req: FeatureBatchTestRequest, request: Request):
+  overlay = FeatureOverlay.from_feature_id(req.feature_id)
+  if overlay is None or not overlay.exists():
+    raise HTTPException(status_code=404, detail=f"No feature index found for: {req.feature_id}")
+  ensure_llm_capacity(PRIORITY_BATCH)
+  file_names = req.file_names or overlay.manifest["files"]
+  user_id = request_user(req.user_id, request)
+
+  cancel_event = threading.Event()
+
+  async def results_generator():
+    try:
+      start_data = {
+          "type": "start",
+          "content": {"feature_id": req.feature_id, "file_names": file_names},
+          "timestamp": time.time()
+      }
+      yield f"data: {json.dumps(start_data)}\n\n"
+
+      # Each file is sent as soon as its test is generated (or found in the cache); a disconnect
+      # cancels the files still queued or generating so they give their scheduler slots back
+      results = generate_unit_tests_for_feature(req.feature_id, file_names, user_id=user_id, cancel_event=cancel_event)
+      async for result in iterate_until_disconnect(request, results, cancel_event):
+        data = {
+            "type": "unit_test",
+            "content": result,
+            "timestamp": time.time()
+        }
+        yield f"data: {json.dumps(data)}\n\n"
+
+      if not cancel_event.is_set():
+        completion_data = {
+            "type": "complete",
+            "content": "",
+            "timestamp": time.time()
+        }
+        yield f"data: {json.dumps(completion_data)}\n\n"
+
+    except Exception as e:
+      error_data = {
+          "type": "error",
+          "content": str(e),
+          "timestamp": time.time()
+      }
+      yield f"data: {json.dumps(error_data)}\n\n"
+
+  return StreamingResponse(
+      results_generator(),
+      media_type="text/event-stream",
+      headers={
+          "Cache-Control": "no-cache",
+          "Connection": "keep-alive",
+          "Access-Control-Allow-Origin": "*",
+          "Access-Control-Allow-Headers": "*",
+      }
+  )
+
 @app.post("/register")
 async def register_user(user: UserRegistration):
     users = load_users()
@@ -424,11 +653,22 @@ async def login_user(user: UserLogin):
     user_data.pop("password", None)
     return {"message": "Login successful", "user": user_data}
 
+@app.get("/models/status")
+async def models_status():
+  try:
+    return {"status": "success", "models": get_model_residency()}
+  except Exception as e:
+    raise HTTPException(status_code=502, detail=f"Could not reach Ollama: {e}")
+
+@app.get("/llm/scheduler")
+async def llm_scheduler_stats():
+  return {"status": "success", "scheduler": get_llm_scheduler().stats()}
+
 @app.get("/cache/stats")
 async def get_cache_stats(project_id: Optional[str] = None):
     try:
         stats = get_cache_statistics(project_id)
-        return {"status": "success", "stats": stats}
+        return {"status": "success", "stats": stats, "vector_stores": get_store_registry().stats()}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -572,13 +812,80 @@ def stop_container(container_name: str):
   except Exception as e:
     raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/run-vrt")
-async def run_vrt(payload: URLPayload, open_browser: bool = False):
-  try:
-    return await run_visual_regression_test(payload.base_url, payload.test_url, open_browser)
-  except Exception as e:
-    raise HTTPException(status_code=500, detail=str(e))
+@app.get("/vrt/browser-pool")
+async def browser_pool_stats():
+  return {"status": "success", "browser_pool": get_browser_pool().stats()}
+
+def start_vrt_job(payload: URLPayload, request: Request):
+  return get_vrt_jobs().start(
+      payload.base_url, payload.test_url, user_id=request_user(payload.user_id, request),
+      viewports=payload.viewports, wait_until=payload.wait_until, wait_for_selector=payload.wait_for_selector,
+      baseline_version=payload.baseline_version, refresh_baseline=payload.refresh_baseline
+  )
+
+def get_vrt_job_or_404(job_id: str):
+  job = get_vrt_jobs().get(job_id)
+  if job is None:
+    raise HTTPException(status_code=404, detail=f"VRT job not found: {job_id}")
+  return job
+
+@app.get("/vrt/baselines")
+async def vrt_baseline_stats():
+  return {"status": "success", "baselines": get_baseline_store().stats()}
+
+@app.post("/vrt/baselines/clear")
+async def clear_vrt_baselines():
+  removed = await run_in_threadpool(get_baseline_store().clear)
+  return {"status": "success", "message": f"Removed {removed} stored baseline(s)."}
+
+@app.post("/vrt/jobs")
+async def create_vrt_job(payload: URLPayload, request: Request):
+  job = start_vrt_job(payload, request)
+  return {"status": "success", **job.summary()}
+
+@app.get("/vrt/jobs")
+async def list_vrt_jobs():
+  return {"status": "success", "jobs": get_vrt_jobs().summaries()}
+
+@app.get("/vrt/jobs/{job_id}")
+async def get_vrt_job(job_id: str):
+  return {"status": "success", **get_vrt_job_or_404(job_id).summary()}
+
+@app.get("/vrt/jobs/{job_id}/events")
+async def stream_vrt_job_events(job_id: str, start: int = 0):
+  job = get_vrt_job_or_404(job_id)
+
+  async def event_generator():
+    # Replays everything so far, then follows the run live; the job itself keeps going if the client leaves
+    async for event in job.stream_events(start):
+      yield f"data: {json.dumps(event)}\n\n"
+
+  return StreamingResponse(
+      event_generator(),
+      media_type="text/event-stream",
+      headers={
+          "Cache-Control": "no-cache",
+          "Connection": "keep-alive",
+          "Access-Control-Allow-Origin": "*",
+          "Access-Control-Allow-Headers": "*",
+      }
+  )
+
+@app.get("/vrt/jobs/{job_id}/images/{image_name}")
+async def get_vrt_job_image(job_id: str, image_name: str):
+  path = get_vrt_job_or_404(job_id).image_path(image_name)
+  if path is None:
+    raise HTTPException(status_code=404, detail=f"Image not found: {image_name}")
+  # A job's images never change once written
+  return FileResponse(path, media_type="image/png", headers={"Cache-Control": "public, max-age=31536000, immutable"})
 
+@app.post("/run-vrt")
+async def run_vrt(payload: URLPayload, request: Request, open_browser: bool = False):
+  job = start_vrt_job(payload, request)
+  await job.wait()
+  if job.status != "completed":
+    raise HTTPException(status_code=500, detail=job.error or "VRT job failed")
+  return {"job_id": job.id, **job.result}
 
 if __name__ == "__main__":
   uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The app imports `config` and `app.*` from the backend root, as when run with `uvicorn main:app`
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
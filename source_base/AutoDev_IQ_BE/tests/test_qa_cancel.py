@@ -0,0 +1,66 @@
+import threading
+
+import pytest
+
+pytest.importorskip("langchain")
+pytest.importorskip("langchain_ollama")
+pytest.importorskip("chromadb")
+
+import app.utils
+from app import qa
+
+TOKENS = ["Hello", ", ", "world"]
+
+
+class FakePrompt:
+    def format(self, **kwargs):
+        return "prompt"
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    stored = []
+
+    def fake_stream_llm(llm, prompt, cancel_event=None, priority=None, user_id=None):
+        for token in TOKENS:
+            if cancel_event is not None and cancel_event.is_set():
+                return
+            yield token
+
+    monkeypatch.setattr(qa, "answer_listing_question", lambda project_id, question: None)
+    monkeypatch.setattr(qa, "catalogue_context", lambda project_id, question: None)
+    monkeypatch.setattr(qa, "prepare_components_parallel", lambda *args: (FakePrompt(), None, None))
+    monkeypatch.setattr(qa, "retrieve_documents", lambda db, question, max_docs, mode: ([], {}))
+    monkeypatch.setattr(qa, "optimize_context_for_question", lambda question, docs: docs)
+    monkeypatch.setattr(qa, "stream_llm", fake_stream_llm)
+    monkeypatch.setattr(app.utils, "check_cache", lambda project_id, question, exact=False: None)
+    monkeypatch.setattr(app.utils, "store_cache_response",
+                        lambda project_id, question, response: stored.append((project_id, question, response)))
+    return stored
+
+
+def close_mid_stream(cancel_event):
+    """What iterate_until_disconnect does on disconnect: set the event, then close the generator."""
+    answer = qa.answer_question_stream("project", "question", 5, "default_prompt", cancel_event=cancel_event)
+    assert next(answer) == "Hello"
+    assert next(answer) == ", "
+    cancel_event.set()
+    answer.close()
+
+
+def test_closing_mid_stream_caches_partial_answer_when_enabled(cache, monkeypatch):
+    monkeypatch.setattr(qa.config, "CACHE_PARTIAL_ANSWERS", True)
+    close_mid_stream(threading.Event())
+    assert cache == [("project", "question", "Hello, " + qa.PARTIAL_ANSWER_NOTE)]
+
+
+def test_closing_mid_stream_caches_nothing_by_default(cache, monkeypatch):
+    monkeypatch.setattr(qa.config, "CACHE_PARTIAL_ANSWERS", False)
+    close_mid_stream(threading.Event())
+    assert cache == []
+
+
+def test_complete_answer_is_cached(cache):
+    answer = qa.answer_question_stream("project", "question", 5, "default_prompt", cancel_event=threading.Event())
+    assert "".join(answer) == "Hello, world"
+    assert cache == [("project", "question", "Hello, world")]
@@ -8,6 +8,14 @@ import { usePathname } from "next/navigation";
 import { Heading } from "../components/Heading";
 import { PageChangeDropDown } from "../components/PageChangeDropDown";
 
+const VRT_STAGE_MESSAGES = {
+  capture: "Capturing base and test pages",
+  dom_diff: "Comparing DOM and styles",
+  pixel_diff: "Comparing screenshots",
+  analysis: "Generating AI suggestions",
+  report: "Writing the report",
+};
+
 export default function VisualRegression() {
   const {
     selectedProject,
@@ -70,6 +78,55 @@ export default function VisualRegression() {
     }
   }, [selectedProject]);
 
+  // Streams a VRT job's progress: screenshots show up as soon as they are diffed and AI
+  // suggestions are appended as each batch is answered; resolves when the job completes.
+  const followVrtJob = (eventsUrl) =>
+    new Promise((resolve, reject) => {
+      const source = new EventSource(`http://localhost:8000${eventsUrl}`);
+      source.onmessage = (message) => {
+        const event = JSON.parse(message.data);
+        if (event.type === "stage") {
+          setIsLoadingVRT(VRT_STAGE_MESSAGES[event.content.stage] || "Running visual regression");
+        } else if (event.type === "pixel_diff") {
+          const images = event.content.images;
+          setVrtResult((prev) =>
+            prev.base_image
+              ? prev
+              : {
+                  ...prev,
+                  base_image: images.base,
+                  test_image: images.test,
+                  diff_image: images.diff,
+                  base_thumbnail: images.base_thumbnail,
+                  test_thumbnail: images.test_thumbnail,
+                  diff_thumbnail: images.diff_thumbnail,
+                }
+          );
+          setVrtLoading(false);
+        } else if (event.type === "suggestions") {
+          setVrtResult((prev) => ({
+            ...prev,
+            llama_output: {
+              ...(prev.llama_output || {}),
+              changes: [...(prev.llama_output?.changes || []), ...event.content],
+            },
+          }));
+        } else if (event.type === "complete") {
+          source.close();
+          setVrtLoading(false);
+          setVrtResult(event.content);
+          resolve(event.content);
+        } else if (event.type === "error") {
+          source.close();
+          reject(new Error(event.content));
+        }
+      };
+      source.onerror = () => {
+        source.close();
+        reject(new Error("VRT event stream failed"));
+      };
+    });
+
   const handleRunClick = async () => {
     if (!selectedProject?.git_url || !selectedBranch) {
       console.error("Missing project URL or branch");
@@ -120,20 +177,19 @@ export default function VisualRegression() {
       const base_port = port1.url[0];
 
       setIsLoadingVRT("Generating snapshots and AI summary");
-      const vrtRes = await fetch("http://localhost:8000/run-vrt", {
+      setVrtResult({});
+      const jobRes = await fetch("http://localhost:8000/vrt/jobs", {
         method: "POST",
         headers: { "Content-Type": "application/json" },
         body: JSON.stringify({
           base_url: test_port,
           test_url: base_port,
-          open_browser: false,
         }),
       });
 
-      if (!vrtRes.ok) throw new Error("Run VRT failed");
-      const result = await vrtRes.json();
-      setVrtLoading(false);
-      setVrtResult(result);
+      if (!jobRes.ok) throw new Error("Run VRT failed");
+      const job = await jobRes.json();
+      await followVrtJob(job.events_url);
     } catch (err) {
       console.error("Run pipeline failed:", err);
       setVrtLoading(false);
@@ -228,14 +284,17 @@ export default function VisualRegression() {
                       <ImageBlock
                         title="Base Snapshot"
                         src={vrtResult.base_image}
+                        thumbnail={vrtResult.base_thumbnail}
                       />
                       <ImageBlock
                         title="Test Snapshot"
                         src={vrtResult.test_image}
+                        thumbnail={vrtResult.test_thumbnail}
                       />
                       <ImageBlock
                         title="Diff Snapshot"
                         src={vrtResult.diff_image}
+                        thumbnail={vrtResult.diff_thumbnail}
                       />
                     </div>
                   </div>
@@ -301,19 +360,21 @@ export default function VisualRegression() {
   );
 }
 
-function ImageBlock({ title, src }) {
+function ImageBlock({ title, src, thumbnail }) {
   return (
     <div className="flex flex-col items-center w-72">
       {" "}
       {/* container width */}
       <h4 className="text-lg font-medium mb-2">{title}</h4>
       <div className="w-full h-60 border rounded shadow-md overflow-hidden flex items-center justify-center">
-        <img
-          src={`data:image/png;base64,${src}`}
-          alt={title}
-          className="max-w-full max-h-full object-contain"
-          style={{ maxWidth: "100%" }}
-        />
+        <a href={`http://localhost:8000${src}`} target="_blank" rel="noopener noreferrer">
+          <img
+            src={`http://localhost:8000${thumbnail || src}`}
+            alt={title}
+            className="max-w-full max-h-full object-contain"
+            style={{ maxWidth: "100%" }}
+          />
+        </a>
       </div>
     </div>
   );